@@ -0,0 +1,233 @@
+import http.server
+import io
+import multiprocessing
+import os
+import re
+import socket
+import time
+from datetime import datetime, timezone
+
+import pystac
+from shapely.geometry import box, shape
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Static file handler answering HTTP range requests, as GDAL's /vsicurl/ reads COGs from blob storage.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        match = re.match(r"bytes=(\d+)-(\d*)", range_header)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+
+        self.send_response(206)
+        self.send_header("Content-Type", "image/tiff")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        return io.BytesIO(data)
+
+def _serve(directory, port, latency_seconds):
+    """
+    Serve a directory until the process is terminated.
+    """
+    class Handler(RangeRequestHandler):
+        def send_head(self):
+            if latency_seconds:
+                time.sleep(latency_seconds)
+            return super().send_head()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), lambda *args: Handler(*args, directory=directory))
+    server.serve_forever()
+
+def free_port():
+    """
+    Pick a free local TCP port.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class LocalFileServer:
+    """
+    Serve a directory over HTTP with range requests from a separate process, standing in for the
+    Planetary Computer blob storage. A separate process is needed because GDAL blocks the Python
+    process while it reads, which would deadlock a server running in the same process.
+
+    Args:
+        directory (str): Directory to serve.
+        latency_seconds (float): Delay added to every request, to model a remote store.
+    """
+
+    def __init__(self, directory, latency_seconds=0.0):
+        self.directory = directory
+        self.latency_seconds = latency_seconds
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context("spawn")
+        self._process = context.Process(target=_serve, args=(self.directory, self.port, self.latency_seconds), daemon=True)
+        self._process.start()
+        _wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
+
+class LocalS3:
+    """
+    Local S3 stand-in: a moto server in a background thread, reached by every boto3 client of this
+    process and of its child processes through the AWS_ENDPOINT_URL environment variable.
+
+    Args:
+        buckets (list): Buckets to create.
+    """
+
+    ENVIRONMENT = {
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+
+    def __init__(self, buckets=("kelpwatch2",)):
+        self.buckets = buckets
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = None
+        self._saved_environment = {}
+
+    def __enter__(self):
+        import logging
+        import boto3
+        from moto.server import ThreadedMotoServer
+
+        # Keep the request log of the server out of the benchmark output
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self._server = ThreadedMotoServer(ip_address="127.0.0.1", port=self.port, verbose=False)
+        self._server.start()
+
+        environment = dict(self.ENVIRONMENT, AWS_ENDPOINT_URL=self.url)
+        for key, value in environment.items():
+            self._saved_environment[key] = os.environ.get(key)
+            os.environ[key] = value
+
+        s3_client = boto3.client("s3")
+        for bucket in self.buckets:
+            s3_client.create_bucket(Bucket=bucket)
+        return self
+
+    def __exit__(self, *exc):
+        for key, value in self._saved_environment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self._server.stop()
+
+def _wait_for_port(port, timeout=30):
+    """
+    Wait until a local server accepts connections.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout} s")
+
+def _parse_datetime(value):
+    """
+    Parse one end of a STAC datetime interval; open ends ('..' or empty) give None.
+    """
+    if value in ("", ".."):
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class LocalStacCatalog:
+    """
+    In-memory stand-in for the Planetary Computer STAC API, with the same
+    ``catalog.search(...).item_collection()`` interface as pystac_client.
+
+    It supports the search arguments the pipelines use: collections (ignored, every item is
+    Sentinel-2 L2A), ids, bbox, datetime (a date, or 'start/end' where a bare end date includes its
+    whole day) and 'eq' queries on item properties. Searches are counted, and an optional latency
+    models the round trip to the API.
+
+    Args:
+        items (list): pystac.Item objects.
+        latency_seconds (float): Delay added to every search.
+    """
+
+    def __init__(self, items, latency_seconds=0.0):
+        self.items = list(items)
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self._footprints = [shape(item.geometry) for item in self.items]
+
+    @classmethod
+    def from_file(cls, path, latency_seconds=0.0):
+        """
+        Load a catalog saved with ``synthetic_data.write_items``.
+        """
+        return cls(pystac.ItemCollection.from_file(path).items, latency_seconds)
+
+    def search(self, collections=None, ids=None, bbox=None, datetime=None, query=None, **kwargs):
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        start = end = None
+        if datetime:
+            parts = datetime.split("/") if "/" in datetime else [datetime, datetime]
+            start, end = _parse_datetime(parts[0]), _parse_datetime(parts[1])
+            if end is not None and len(parts[1]) <= 10:
+                # A bare date ends at the end of that day
+                end = end.replace(hour=23, minute=59, second=59)
+
+        search_box = box(*bbox) if bbox is not None else None
+        matches = []
+        for item, footprint in zip(self.items, self._footprints):
+            if ids is not None and item.id not in ids:
+                continue
+            if search_box is not None and not footprint.intersects(search_box):
+                continue
+            if start is not None and item.datetime < start:
+                continue
+            if end is not None and item.datetime > end:
+                continue
+            if query and any(item.properties.get(name) != condition.get("eq") for name, condition in query.items()):
+                continue
+            matches.append(item)
+        return _LocalSearch(matches)
+
+class _LocalSearch:
+    """
+    Result of LocalStacCatalog.search, resolved by item_collection().
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def item_collection(self):
+        # Fresh copies, as every API response would be
+        return pystac.ItemCollection([item.clone() for item in self.items])
@@ -0,0 +1,422 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+TRAINING_DIR = os.path.join(REPO_DIR, "kelp_training_data_generation")
+INFERENCE_DIR = os.path.join(REPO_DIR, "kelp_inference_data_generation")
+SHARED_DIR = os.path.join(REPO_DIR, "kelp_shared")
+
+# Date range searched by the inference segmentation and by get_bands, as in the monthly inference runs
+INFERENCE_DATE_RANGE = "2023-01-01/2023-01-31"
+
+def memory_kb(field):
+    """
+    Read a memory field of /proc/self/status, in kilobytes, e.g. 'VmRSS' or 'VmHWM' (peak RSS).
+    Outside Linux, fall back to ru_maxrss, which is then the peak of the whole process.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of the process to its current RSS, where the kernel allows it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def measure(function, *args, **kwargs):
+    """
+    Call a function and measure its wall time and the peak resident memory of the process.
+
+    The peak is reset before the call, so it does not include what the stage's setup allocated and
+    freed; rss_before_mb gives the memory already held, mostly the libraries. The peak RSS of worker
+    processes is the largest one among those started and reaped by the stage, 0 if none.
+
+    Returns:
+        dict: wall_seconds, rss_before_mb, peak_rss_mb and peak_children_rss_mb.
+    """
+    rss_before = memory_kb("VmRSS")
+    reset_peak_rss()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "rss_before_mb": round(rss_before / 1024, 1),
+        "peak_rss_mb": round(memory_kb("VmHWM") / 1024, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_children_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+def count_rows(folder):
+    """
+    Count the rows of every table of a folder and its subfolders.
+    """
+    from table_io import read_table
+
+    rows = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith((".csv", ".parquet")):
+                rows += len(read_table(os.path.join(root, name)))
+    return rows
+
+def ensure_nc_segmented(ctx):
+    """
+    Export the NetCDF file to per-timestep tables once, as input of the segmentation stages.
+    """
+    import kelp_data_read
+
+    if not os.path.isdir(ctx["nc_segmented_dir"]):
+        kelp_data_read.main(ctx["nc_file"], ctx["nc_segmented_dir"] + ".tmp", chunked=True, workers=ctx["read_workers"])
+        os.replace(ctx["nc_segmented_dir"] + ".tmp", ctx["nc_segmented_dir"])
+
+def stage_kelp_data_read(ctx, chunked=False):
+    import kelp_data_read
+
+    output_dir = os.path.join(ctx["stage_dir"], "kelp_nc_segmented_data")
+    timing = measure(kelp_data_read.main, ctx["nc_file"], output_dir, "2018-01-01", chunked, ctx["read_workers"])
+    return dict(timing, items=count_rows(output_dir), unit="points")
+
+def stage_kelp_data_segmentation(ctx, batched=False):
+    import kelp_data_segmentation
+    from local_services import LocalStacCatalog
+
+    ensure_nc_segmented(ctx)
+    catalog = LocalStacCatalog.from_file(ctx["items_file"], ctx["stac_latency"])
+    # The segmentation functions use the module's catalog, set in its __main__ block
+    kelp_data_segmentation.catalog = catalog
+
+    output_dir = os.path.join(ctx["stage_dir"], "kelp_tiles_segmented_data")
+    timing = measure(kelp_data_segmentation.main, ctx["nc_segmented_dir"], output_dir, batched)
+    return dict(timing, items=count_rows(ctx["nc_segmented_dir"]), unit="points", stac_searches=catalog.calls)
+
+def stage_inference_segmentation(ctx, batched=False, mgrs_grouping=False):
+    import pandas as pd
+    import inference_data_tiles_segmentation as segmentation
+    from local_services import LocalStacCatalog
+    from point_coverage import PointCoverageIndex
+
+    catalog = LocalStacCatalog.from_file(ctx["items_file"], ctx["stac_latency"])
+    data_kelp = pd.read_csv(ctx["coast_points_file"])
+    data_kelp["processed_flag"] = 0
+    data_kelp["ID"] = range(1, len(data_kelp) + 1)
+    output_dir = os.path.join(ctx["stage_dir"], "inference_tiles")
+    os.makedirs(output_dir, exist_ok=True)
+
+    def run():
+        # Same loops as main, which opens the Planetary Computer catalog itself
+        if batched or mgrs_grouping:
+            segmentation.process_points_batched(catalog, data_kelp, output_dir, INFERENCE_DATE_RANGE, mgrs_grouping=mgrs_grouping)
+            return
+        coverage = PointCoverageIndex(data_kelp["Longitude"], data_kelp["Latitude"])
+        while True:
+            row = coverage.next_uncovered()
+            if row is None:
+                break
+            segmentation.process_point(catalog, data_kelp, row, output_dir, 100, INFERENCE_DATE_RANGE, coverage)
+            coverage.mark_covered([row])
+
+    timing = measure(run)
+    return dict(timing, items=len(data_kelp), unit="points", stac_searches=catalog.calls)
+
+def stage_get_bands(ctx, asset_cache=False, warp_cache=False, lazy=False):
+    import generate_inference_tiles
+    from asset_cache import AssetCache
+    from local_services import LocalStacCatalog
+    from warp_cache import WarpCache
+
+    catalog = LocalStacCatalog.from_file(ctx["items_file"], ctx["stac_latency"])
+    tiles = [item.id for item in catalog.search(datetime=INFERENCE_DATE_RANGE).item_collection()][:ctx["tiles"]]
+    cache = AssetCache(os.path.join(ctx["stage_dir"], "asset_cache")) if asset_cache else None
+    grids = WarpCache(os.path.join(ctx["stage_dir"], "warp_cache")) if warp_cache else None
+    lazy_options = {"strip_rows": 1024, "memory_bytes": 1024 ** 3} if lazy else None
+
+    def run():
+        for tile in tiles:
+            stacked = generate_inference_tiles.get_bands(tile, catalog, ctx["fetch_workers"], cache, grids, lazy_options)
+            if lazy_options is not None:
+                with generate_inference_tiles.lazy_scheduler(lazy_options, stacked.rio.width):
+                    stacked = stacked.compute()
+            del stacked
+
+    if cache is not None or grids is not None:
+        # Fill the caches first, so the measured pass is a rerun over the same tiles
+        run()
+
+    timing = measure(run)
+    return dict(timing, items=len(tiles), unit="tiles")
+
+def stage_process_folders(ctx, zarr=False):
+    import boto3
+    import generate_kelp_mask_tiles
+    import kelp_data_segmentation
+    from local_services import LocalStacCatalog
+    from table_io import list_tables
+
+    catalog = LocalStacCatalog.from_file(ctx["items_file"], ctx["stac_latency"])
+
+    # Segment the stations once, then keep one tile table per folder for the first tiles
+    tiles_dir = ctx["training_tiles_dir"]
+    if not os.path.isdir(tiles_dir):
+        ensure_nc_segmented(ctx)
+        kelp_data_segmentation.catalog = catalog
+        kelp_data_segmentation.main(ctx["nc_segmented_dir"], tiles_dir + ".tmp", batched_search=True)
+        os.replace(tiles_dir + ".tmp", tiles_dir)
+
+    input_dir = os.path.join(ctx["stage_dir"], "kelp_tiles")
+    tables = sorted(list_tables(os.path.join(tiles_dir, "*")))[:ctx["tiles"]]
+    for i, table in enumerate(tables):
+        os.makedirs(os.path.join(input_dir, str(i)))
+        shutil.copy(table, os.path.join(input_dir, str(i)))
+
+    s3_client = boto3.client("s3")
+    bucket_folder = f"benchmarks/{os.path.basename(ctx['stage_dir'])}"
+    timing = measure(
+        generate_kelp_mask_tiles.process_folders, input_dir, ctx["bucket"], bucket_folder, s3_client, catalog,
+        ctx["fetch_workers"], ctx["crop_to_stations"], zarr_options={"chunk_size": 1024} if zarr else None,
+    )
+    uploaded = s3_client.list_objects_v2(Bucket=ctx["bucket"], Prefix=bucket_folder).get("KeyCount", 0)
+    return dict(timing, items=len(tables), unit="tiles", uploaded_objects=uploaded)
+
+# Stages in run order: (pipeline folder, stage function, keyword arguments)
+STAGES = {
+    "kelp_data_read": (TRAINING_DIR, stage_kelp_data_read, {}),
+    "kelp_data_read_chunked": (TRAINING_DIR, stage_kelp_data_read, {"chunked": True}),
+    "kelp_data_segmentation": (TRAINING_DIR, stage_kelp_data_segmentation, {}),
+    "kelp_data_segmentation_batched": (TRAINING_DIR, stage_kelp_data_segmentation, {"batched": True}),
+    "inference_segmentation": (INFERENCE_DIR, stage_inference_segmentation, {}),
+    "inference_segmentation_batched": (INFERENCE_DIR, stage_inference_segmentation, {"batched": True}),
+    "inference_segmentation_mgrs": (INFERENCE_DIR, stage_inference_segmentation, {"mgrs_grouping": True}),
+    "get_bands": (INFERENCE_DIR, stage_get_bands, {}),
+    "get_bands_cached": (INFERENCE_DIR, stage_get_bands, {"asset_cache": True}),
+    "get_bands_warp_cache": (INFERENCE_DIR, stage_get_bands, {"warp_cache": True}),
+    "get_bands_lazy": (INFERENCE_DIR, stage_get_bands, {"lazy": True}),
+    "process_folders": (TRAINING_DIR, stage_process_folders, {}),
+    "process_folders_zarr": (TRAINING_DIR, stage_process_folders, {"zarr": True}),
+}
+
+def _stage_process(name, ctx, queue):
+    """
+    Run one stage in a fresh process, so that its peak memory is its own, with its output in a log file.
+    """
+    folder, function, kwargs = STAGES[name]
+    sys.path[:0] = [folder, SHARED_DIR, BENCHMARKS_DIR]
+    os.makedirs(ctx["stage_dir"], exist_ok=True)
+    os.chdir(ctx["stage_dir"])
+
+    # Redirect at the file descriptor level to also capture GDAL and worker processes
+    log = open(ctx["log_file"], "w")
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+
+    try:
+        result = function(ctx, **kwargs)
+    except Exception:
+        traceback.print_exc()
+        result = {"error": traceback.format_exc().strip().splitlines()[-1]}
+    sys.stdout.flush()
+    queue.put(result)
+
+def run_stage(name, ctx):
+    """
+    Run a stage in a spawned process and compute its throughput.
+
+    Returns:
+        dict: Measurements of the stage.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_stage_process, args=(name, ctx, queue))
+    process.start()
+    process.join()
+    result = queue.get() if not queue.empty() else {"error": f"stage process exited with code {process.exitcode}"}
+
+    if "error" not in result and result["wall_seconds"] > 0:
+        if result["unit"] == "tiles":
+            result["throughput"] = round(result["items"] / result["wall_seconds"] * 3600, 2)
+            result["throughput_unit"] = "tiles/hour"
+        else:
+            result["throughput"] = round(result["items"] / result["wall_seconds"], 1)
+            result["throughput_unit"] = "points/s"
+    result["log"] = ctx["log_file"]
+    return result
+
+def prepare_data(args, base_url):
+    """
+    Generate, or reuse from an earlier run, the synthetic scenes, STAC items, NetCDF file and coastline points.
+
+    Returns:
+        dict: Paths of the inputs.
+    """
+    from synthetic_data import inference_date, make_kelp_netcdf, make_scenes, quarter_dates, write_coast_points, write_items
+
+    data_dir = os.path.join(args.work_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+
+    dates = [d.to_pydatetime().replace(hour=18, minute=49, tzinfo=timezone.utc) for d in quarter_dates(args.timesteps)]
+    items, footprints = make_scenes(data_dir, base_url, args.scenes, args.tile_pixels, dates + [inference_date()])
+    items_file = os.path.join(data_dir, f"items_{args.tile_pixels}_{args.scenes}_{args.timesteps}.json")
+    write_items(items, items_file)
+
+    nc_file = os.path.join(data_dir, f"kelp_{args.scenes}_{args.stations}_{args.timesteps}.nc")
+    if not os.path.exists(nc_file):
+        make_kelp_netcdf(nc_file, footprints, args.stations, args.timesteps)
+
+    coast_points_file = os.path.join(data_dir, f"coast_points_{args.scenes}_{args.coast_points}.csv")
+    if not os.path.exists(coast_points_file):
+        write_coast_points(coast_points_file, footprints, args.coast_points)
+
+    return {
+        "items_file": items_file,
+        "nc_file": nc_file,
+        "nc_segmented_dir": os.path.splitext(nc_file)[0] + "_segmented",
+        "training_tiles_dir": os.path.splitext(nc_file)[0] + f"_tiles_{args.tile_pixels}",
+        "coast_points_file": coast_points_file,
+    }
+
+def git_commit():
+    """
+    Commit of the benchmarked code, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(previous, current, threshold=0.1):
+    """
+    Print the change of every stage's wall time, throughput and peak memory against an earlier run.
+
+    Args:
+        previous (dict): Earlier results.
+        current (dict): Current results.
+        threshold (float): Relative slowdown or memory growth reported as a regression.
+
+    Returns:
+        list: Names of the regressed stages.
+    """
+    regressions = []
+    print(f"\nComparison with {previous.get('git_commit')} ({previous.get('created')}):")
+    for name, stage in current["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if before is None or "error" in before or "error" in stage:
+            continue
+        time_ratio = stage["wall_seconds"] / before["wall_seconds"] if before["wall_seconds"] else float("nan")
+        rss_ratio = stage["peak_rss_mb"] / before["peak_rss_mb"] if before["peak_rss_mb"] else float("nan")
+        regressed = time_ratio > 1 + threshold or rss_ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"  {name:32s} wall {before['wall_seconds']:9.2f}s -> {stage['wall_seconds']:9.2f}s ({time_ratio:5.2f}x)  "
+              f"peak RSS {before['peak_rss_mb']:8.1f} -> {stage['peak_rss_mb']:8.1f} MB ({rss_ratio:5.2f}x)"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(args):
+    """
+    Generate the synthetic inputs, start the local stand-ins and run the selected stages.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments.
+    """
+    from local_services import LocalFileServer, LocalS3
+
+    args.work_dir = os.path.abspath(args.work_dir)
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    run_dir = os.path.join(args.work_dir, "runs", run_id)
+
+    # Directory listings are not available on blob storage either
+    os.environ.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "stages": {},
+    }
+
+    os.makedirs(os.path.join(args.work_dir, "data"), exist_ok=True)
+    with LocalFileServer(os.path.join(args.work_dir, "data"), args.http_latency) as file_server, LocalS3([args.bucket]):
+        inputs = prepare_data(args, file_server.url)
+
+        for name in STAGES:
+            if args.stages and name not in args.stages:
+                continue
+            ctx = dict(
+                inputs,
+                stage_dir=os.path.join(run_dir, name),
+                log_file=os.path.join(run_dir, f"{name}.log"),
+                bucket=args.bucket,
+                tiles=args.tiles,
+                fetch_workers=args.fetch_workers,
+                read_workers=args.read_workers,
+                stac_latency=args.stac_latency,
+                crop_to_stations=args.crop_to_stations,
+            )
+            os.makedirs(run_dir, exist_ok=True)
+            print(f"Running {name} ...", flush=True)
+            result = run_stage(name, ctx)
+            results["stages"][name] = result
+            if "error" in result:
+                print(f"  failed: {result['error']} (see {result['log']})")
+            else:
+                print(f"  {result['wall_seconds']:.2f}s, {result.get('throughput')} {result.get('throughput_unit')}, peak RSS {result['peak_rss_mb']} MB")
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            regressions = compare_results(json.load(previous), results, args.regression_threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the kelp data pipelines on synthetic Sentinel-2 scenes, with local STAC, blob storage and S3 stand-ins.")
+    parser.add_argument("--work-dir", type=str, default="benchmark_work", help="Directory of the synthetic data, reused across runs, and of the stage outputs and logs.")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Path of the JSON results.")
+    parser.add_argument("--stages", type=str, nargs="+", choices=list(STAGES), default=None, help="Stages to run (default: all).")
+    parser.add_argument("--tile-pixels", type=int, default=10980, help="Side of the synthetic 10 m bands in pixels; 10980 is a full Sentinel-2 tile.")
+    parser.add_argument("--scenes", type=int, default=2, help="Number of synthetic scenes (MGRS tiles).")
+    parser.add_argument("--stations", type=int, default=20000, help="Number of Kelpwatch stations in the synthetic NetCDF file.")
+    parser.add_argument("--timesteps", type=int, default=8, help="Number of quarters in the synthetic NetCDF file.")
+    parser.add_argument("--coast-points", type=int, default=20000, help="Number of coastline points of the inference segmentation.")
+    parser.add_argument("--tiles", type=int, default=2, help="Number of tiles processed by the get_bands and process_folders stages.")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="Assets of a tile fetched in parallel.")
+    parser.add_argument("--read-workers", type=int, default=4, help="Worker processes of the chunked kelp_data_read stage.")
+    parser.add_argument("--crop-to-stations", action="store_true", help="Run process_folders in its station-cropped mode.")
+    parser.add_argument("--stac-latency", type=float, default=0.0, help="Seconds added to every STAC search, to model the API round trip.")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="Seconds added to every asset request, to model blob storage.")
+    parser.add_argument("--bucket", type=str, default="kelpwatch2", help="Bucket created in the local S3 stand-in.")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results JSON to compare with.")
+    parser.add_argument("--regression-threshold", type=float, default=0.1, help="Relative slowdown or memory growth reported as a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 when a stage regressed.")
+
+    main(parser.parse_args())
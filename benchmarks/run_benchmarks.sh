@@ -0,0 +1,38 @@
+#!/bin/bash
+
+# Runs the offline benchmarks and compares them with the previous results, if any.
+# Usage: ./run_benchmarks.sh [--small] [any option of run_benchmarks.py]
+#   --small   Quick run on 1024 x 1024 pixel scenes and fewer points, e.g. to check the harness.
+
+work_dir="benchmark_work"
+output="benchmark_results.json"
+previous="benchmark_results_previous.json"
+scale=""
+extra_args=()
+
+while [[ $# -gt 0 ]]; do
+  case $1 in
+    --small)
+      scale="--tile-pixels 1024 --stations 2000 --timesteps 4 --coast-points 2000"
+      shift
+      ;;
+    *)
+      extra_args+=("$1")
+      shift
+      ;;
+  esac
+done
+
+# Keep the last results to compare the new run with
+compare=""
+if [ -f "$output" ]; then
+  cp "$output" "$previous"
+  compare="--compare $previous"
+fi
+
+python3 run_benchmarks.py \
+  --work-dir "$work_dir" \
+  --output "$output" \
+  $scale \
+  $compare \
+  "${extra_args[@]}"
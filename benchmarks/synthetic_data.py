@@ -0,0 +1,294 @@
+import datetime
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pystac
+import rasterio
+import rasterio.shutil
+import xarray as xr
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from shapely.geometry import box, mapping
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_inference_data_generation"))
+from mgrs_index import mgrs_tiles
+
+# Sentinel-2 L2A assets used by the pipelines, by native resolution in meters
+BANDS_10M = ["B02", "B03", "B04", "B08", "WVP", "AOT"]
+BANDS_20M = ["B05", "B06", "B07", "B8A", "B11", "B12", "SCL"]
+
+# Full Sentinel-2 tile: 10980 x 10980 pixels at 10 m, i.e. 109.8 km
+S2_TILE_PIXELS = 10980
+
+# Synthetic scenes are laid out along the Californian coast, in UTM zone 10N, one per MGRS grid square
+SCENE_EPSG = 32610
+SCENE_ORIGIN = (500000, 4200000)
+
+def synthetic_block(coarse, row_start, rows, width, name, rng):
+    """
+    Generate rows of a Sentinel-2-like band: smooth spatial structure plus sensor noise, so that it
+    compresses about as well as real reflectances instead of like white noise.
+
+    Args:
+        coarse (numpy.ndarray): Random field with one value per 256 x 256 pixels of the band.
+        row_start (int): First row of the block.
+        rows (int): Number of rows of the block.
+        width (int): Columns.
+        name (str): Asset name; SCL gets scene classification codes instead of reflectances.
+        rng (numpy.random.Generator): Source of the noise.
+
+    Returns:
+        numpy.ndarray: uint16 reflectances, or uint8 classes for SCL.
+    """
+    row_cells = np.arange(row_start, row_start + rows) // 256
+    field = np.repeat(coarse[row_cells], 256, axis=1)[:, :width]
+
+    if name == "SCL":
+        # Mostly water (6) and vegetation (4), some clouds (8, 9) and no data (0)
+        classes = np.array([6, 6, 6, 4, 4, 5, 8, 9, 0], dtype=np.uint8)
+        return classes[np.minimum((field * len(classes)).astype(np.int64), len(classes) - 1)]
+
+    noise = rng.normal(0, 40, (rows, width)).astype(np.float32)
+    return np.clip(200 + field * 3000 + noise, 1, 10000).astype(np.uint16)
+
+def write_synthetic_cog(path, name, size, resolution, x0, y0, seed, block_rows=1024):
+    """
+    Write one synthetic band as a DEFLATE-compressed COG with overviews, in blocks of rows so that a
+    full-size tile never has to be held in memory.
+
+    Args:
+        path (str): Output path.
+        name (str): Asset name.
+        size (int): Side of the band in pixels.
+        resolution (float): Pixel size in meters.
+        x0 (float): Western edge in the scene's UTM CRS.
+        y0 (float): Northern edge in the scene's UTM CRS.
+        seed (int): Random seed.
+        block_rows (int): Rows generated and written at a time.
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.uniform(0, 1, (size // 256 + 1, size // 256 + 1)).astype(np.float32)
+    dtype = "uint8" if name == "SCL" else "uint16"
+
+    tmp_path = path + ".tmp.tif"
+    with rasterio.open(
+        tmp_path, "w", driver="GTiff", width=size, height=size, count=1, dtype=dtype,
+        crs=f"EPSG:{SCENE_EPSG}", transform=from_origin(x0, y0, resolution, resolution), nodata=0,
+        tiled=True, blockxsize=512, blockysize=512,
+    ) as ds:
+        for row_start in range(0, size, block_rows):
+            rows = min(block_rows, size - row_start)
+            block = synthetic_block(coarse, row_start, rows, size, name, rng)
+            ds.write(block, 1, window=Window(0, row_start, size, rows))
+
+        # Sentinel-2 COGs always have overviews, which the pipelines rely on when opening overview level 0
+        factors = [2 ** level for level in range(1, 8) if size // 2 ** level >= 128] or [2]
+        ds.build_overviews(factors, Resampling.nearest if name == "SCL" else Resampling.average)
+
+    rasterio.shutil.copy(tmp_path, path, driver="COG", compress="DEFLATE", blocksize=512, overviews="FORCE_USE_EXISTING")
+    os.remove(tmp_path)
+
+def make_scene(out_dir, scene_index, tile_pixels=S2_TILE_PIXELS):
+    """
+    Write the 13 COG assets of one synthetic scene, unless they already exist.
+
+    Args:
+        out_dir (str): Directory of the scene's assets.
+        scene_index (int): Position of the scene along the coast; sets its grid square and pixel values.
+        tile_pixels (int): Side of the 10 m bands in pixels; the 20 m bands are half as large.
+
+    Returns:
+        tuple: (bounds in the scene's UTM CRS, dict of asset file names by band).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    x0 = SCENE_ORIGIN[0] + 100000 * scene_index
+    y0 = SCENE_ORIGIN[1]
+
+    assets = {}
+    for i, name in enumerate(BANDS_10M + BANDS_20M):
+        resolution = 10 if name in BANDS_10M else 20
+        file_name = f"{name}.tif"
+        path = os.path.join(out_dir, file_name)
+        assets[name] = file_name
+        if not os.path.exists(path):
+            size = tile_pixels if resolution == 10 else tile_pixels // 2
+            write_synthetic_cog(path, name, size, resolution, x0, y0, seed=1000 * scene_index + i)
+            print(f"Written {path}")
+
+    bounds = (x0, y0 - 10 * tile_pixels, x0 + 10 * tile_pixels, y0)
+    return bounds, assets
+
+def scene_items(scene_index, bounds, assets, base_url, dates, seed=0):
+    """
+    Build the STAC items of one scene, one per acquisition date, all pointing to the same assets.
+
+    Args:
+        scene_index (int): Position of the scene along the coast.
+        bounds (tuple): Bounds of the scene in its UTM CRS.
+        assets (dict): Asset file names by band.
+        base_url (str): URL of the scene's directory on the local file server.
+        dates (list): datetime.datetime of each acquisition.
+        seed (int): Seed of the random cloud cover.
+
+    Returns:
+        list: pystac.Item objects with Sentinel-2-like properties.
+    """
+    rng = np.random.default_rng(seed + scene_index)
+    lonlat = transform_bounds(f"EPSG:{SCENE_EPSG}", "EPSG:4326", *bounds)
+
+    # The scene starts at a grid square corner, so any point just inside that corner gives its tile
+    corner_lon, corner_lat = transform_bounds(f"EPSG:{SCENE_EPSG}", "EPSG:4326", bounds[0] + 1, bounds[3] - 2, bounds[0] + 2, bounds[3] - 1)[:2]
+    mgrs_tile = str(mgrs_tiles([corner_lon], [corner_lat])[0])
+
+    items = []
+    for date in dates:
+        item = pystac.Item(
+            id=f"S2B_MSIL2A_{date:%Y%m%d}T184919_R070_T{mgrs_tile}_{date:%Y%m%d}T000000",
+            geometry=mapping(box(*lonlat)),
+            bbox=list(lonlat),
+            datetime=date,
+            properties={
+                "eo:cloud_cover": float(rng.uniform(0, 60)),
+                "s2:mgrs_tile": mgrs_tile,
+                "proj:epsg": SCENE_EPSG,
+            },
+        )
+        for name, file_name in assets.items():
+            # Grid of the full-resolution asset, as the Planetary Computer publishes it
+            resolution = 10 if name in BANDS_10M else 20
+            extra_fields = {
+                "proj:shape": [round((bounds[3] - bounds[1]) / resolution), round((bounds[2] - bounds[0]) / resolution)],
+                "proj:transform": [resolution, 0.0, bounds[0], 0.0, -resolution, bounds[3]],
+            }
+            item.add_asset(name, pystac.Asset(href=f"{base_url}/{file_name}", media_type=pystac.MediaType.COG, extra_fields=extra_fields))
+        items.append(item)
+    return items
+
+def make_scenes(data_dir, base_url, scenes=2, tile_pixels=S2_TILE_PIXELS, dates=()):
+    """
+    Write the assets of several synthetic scenes and build their STAC items.
+
+    Args:
+        data_dir (str): Directory served by the local file server.
+        base_url (str): URL of data_dir on the local file server.
+        scenes (int): Number of scenes.
+        tile_pixels (int): Side of the 10 m bands in pixels.
+        dates (list): datetime.datetime of the acquisitions of every scene.
+
+    Returns:
+        tuple: (list of pystac.Item, list of scene bounds in EPSG:4326).
+    """
+    items, footprints = [], []
+    for s in range(scenes):
+        name = f"scene_{tile_pixels}_{s}"
+        bounds, assets = make_scene(os.path.join(data_dir, name), s, tile_pixels)
+        items += scene_items(s, bounds, assets, f"{base_url}/{name}", dates)
+        footprints.append(transform_bounds(f"EPSG:{SCENE_EPSG}", "EPSG:4326", *bounds))
+    return items, footprints
+
+def coast_points(footprints, count, seed=0):
+    """
+    Scatter points along a diagonal 'coastline' across each scene footprint.
+
+    Args:
+        footprints (list): Scene bounds in EPSG:4326.
+        count (int): Total number of points, spread evenly over the scenes.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: (longitudes, latitudes) numpy arrays.
+    """
+    rng = np.random.default_rng(seed)
+    lons, lats = [], []
+    per_scene = -(-count // len(footprints))
+    for min_lon, min_lat, max_lon, max_lat in footprints:
+        # Keep clear of the edges, where scenes overlap their neighbours
+        t = rng.uniform(0.1, 0.9, per_scene)
+        jitter = rng.normal(0, 0.02, per_scene)
+        lons.append(min_lon + (max_lon - min_lon) * np.clip(t + jitter, 0.05, 0.95))
+        lats.append(min_lat + (max_lat - min_lat) * np.clip(t - jitter, 0.05, 0.95))
+    return np.concatenate(lons)[:count], np.concatenate(lats)[:count]
+
+def quarter_dates(timesteps, start="2019-02-01"):
+    """
+    Mid-quarter dates as in the Kelpwatch time axis: the 15th of February, May, August and November.
+
+    Args:
+        timesteps (int): Number of quarters.
+        start (str): First day of the month of the first date.
+
+    Returns:
+        pandas.DatetimeIndex: The dates.
+    """
+    return pd.date_range(start, periods=timesteps, freq="3MS") + pd.Timedelta(days=14)
+
+def make_kelp_netcdf(path, footprints, stations=20000, timesteps=8, seed=0):
+    """
+    Write a Kelpwatch-like NetCDF file: stations along the coastlines of the scenes, quarterly biomass.
+
+    Args:
+        path (str): Output NetCDF path.
+        footprints (list): Scene bounds in EPSG:4326.
+        stations (int): Number of stations.
+        timesteps (int): Number of quarters, all after 2018.
+        seed (int): Random seed.
+    """
+    rng = np.random.default_rng(seed)
+    lons, lats = coast_points(footprints, stations, seed)
+    times = quarter_dates(timesteps)
+
+    # Kelp is present at about a third of the stations of a quarter
+    biomass = rng.choice([0.0, 0.0, np.nan, 1.0], size=(stations, timesteps)) * rng.uniform(50, 2000, (stations, timesteps))
+    area = np.where(biomass > 0, rng.uniform(1, 900, (stations, timesteps)), 0.0)
+
+    ds = xr.Dataset(
+        {
+            "latitude": ("station", lats),
+            "longitude": ("station", lons),
+            "year": ("time", times.year.values),
+            "quarter": ("time", times.quarter.values),
+            "biomass": (("station", "time"), biomass),
+            "biomass_se": (("station", "time"), biomass * 0.1),
+            "area": (("station", "time"), area),
+            "area_se": (("station", "time"), area * 0.1),
+            "passes": (("station", "time"), rng.integers(0, 6, (stations, timesteps)).astype("int16")),
+        },
+        coords={"station": np.arange(stations) + 1, "time": times},
+    )
+    ds.to_netcdf(path)
+    print(f"Written {path}: {stations} stations x {timesteps} quarters")
+
+def write_coast_points(path, footprints, count=20000, seed=1):
+    """
+    Write coastline points, as create-coastline-coordinate-data.py does, for the inference segmentation.
+
+    Args:
+        path (str): Output CSV path.
+        footprints (list): Scene bounds in EPSG:4326.
+        count (int): Number of points.
+        seed (int): Random seed.
+    """
+    lons, lats = coast_points(footprints, count, seed)
+    pd.DataFrame({"Longitude": lons, "Latitude": lats}).to_csv(path, index=False)
+    print(f"Written {path}: {count} points")
+
+def write_items(items, path):
+    """
+    Save STAC items as an ItemCollection JSON file, loaded by the local catalog in every stage process.
+
+    Args:
+        items (list): pystac.Item objects.
+        path (str): Output JSON path.
+    """
+    with open(path, "w") as f:
+        json.dump(pystac.ItemCollection(items).to_dict(), f)
+
+def inference_date(year=2023, month=1):
+    """
+    Acquisition date of the scenes searched by the inference segmentation.
+    """
+    return datetime.datetime(year, month, 15, 18, 49, 19, tzinfo=datetime.timezone.utc)
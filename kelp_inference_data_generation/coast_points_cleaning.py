@@ -1,16 +1,26 @@
-import pandas as pd
-import glob
 import os
 import argparse
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from table_io import list_tables, read_table, read_tables, write_table
+from streaming_dedup import stream_unique_rows
 
-def process_coordinates(data_coast_points_path, folder_path):
+def process_coordinates(data_coast_points_path, folder_path, output_path='unique_coords_tiles.csv', streaming=False, workers=4, max_keys=20_000_000, spill_dir=None):
     """
     Process coastal coordinates and Sentinel tile coordinates to filter out
     unused coordinates.
 
     Args:
-        data_coast_points_path (str): Path to the CSV file containing coastal points.
-        folder_path (str): Path to the folder containing CSV files of Sentinel tile coordinates.
+        data_coast_points_path (str): Path to the CSV or Parquet file containing coastal points.
+        folder_path (str or list): Path to the folder containing CSV or Parquet files of Sentinel tile
+            coordinates, or a list of folders combined into one output.
+        output_path (str): Path of the unique coordinates file (.csv or .parquet).
+        streaming (bool): Read the files in parallel and drop duplicates on the fly, writing the unique
+            coordinates incrementally, so memory stays bounded however many files are combined.
+        workers (int): Number of reading threads in streaming mode.
+        max_keys (int): Number of unique coordinates kept in memory before spilling to disk in streaming mode.
+        spill_dir (str, optional): Directory of the spill files in streaming mode.
 
     Returns:
         None
@@ -27,31 +37,31 @@ def process_coordinates(data_coast_points_path, folder_path):
     print(f"Working directory set to: {os.getcwd()}")
 
     # Load the coastal points data
-    data_coast_points = pd.read_csv(data_coast_points_path)
+    data_coast_points = read_table(data_coast_points_path)
     print(f"Loaded coastal points data with shape: {data_coast_points.shape}")
 
-    # Use glob to find all CSV files in the folder
-    csv_files = glob.glob(os.path.join(folder_path, '*.csv'))
+    # Find all CSV and Parquet files in the folders
+    folder_paths = [folder_path] if isinstance(folder_path, str) else folder_path
+    csv_files = [path for folder in folder_paths for path in list_tables(folder)]
 
-    # Initialize an empty list to hold the dataframes
-    dfs = []
+    if streaming:
+        columns = ['Latitude', 'Longitude']
+        read, written = stream_unique_rows(csv_files, output_path, columns, columns, {'Latitude': 'float64', 'Longitude': 'float64'}, workers, max_keys, spill_dir)
+        print(f"Coordinates read: {read}, unique coordinates: {written}")
+        print(f"Unique coordinates have been saved to '{output_path}'.")
+        return
 
-    # Loop through the list of CSV files and read each one into a dataframe
-    for csv_file in csv_files:
-        df = pd.read_csv(csv_file)
-        dfs.append(df)
-
-    # Concatenate all the dataframes in the list into a single dataframe
-    combined_df = pd.concat(dfs, ignore_index=True)
+    # Read only the coordinate columns into a single dataframe
+    combined_df = read_tables(csv_files, columns=['Latitude', 'Longitude'])
     print(f"Combined CSV files into a single dataframe with shape: {combined_df.shape}")
 
     # Extract unique coordinates from the combined dataframe
     unique_coords_tiles = combined_df[['Latitude', 'Longitude']].drop_duplicates(subset=['Latitude', 'Longitude'])
     print(f"Unique coordinates in tile data: {unique_coords_tiles.shape}")
 
-    # Save the unique coordinates to a CSV file
-    unique_coords_tiles.to_csv('unique_coords_tiles.csv', index=False)
-    print("Unique coordinates have been saved to 'unique_coords_tiles.csv'.")
+    # Save the unique coordinates to a CSV or Parquet file
+    write_table(unique_coords_tiles, output_path)
+    print(f"Unique coordinates have been saved to '{output_path}'.")
 
 def main():
     """
@@ -59,12 +69,17 @@ def main():
     """
     parser = argparse.ArgumentParser(description='Process coastal points and Sentinel tile coordinates.')
     parser.add_argument('--data_coast_points', type=str, help='Path to the CSV file containing coastal points.')
-    parser.add_argument('--folder_path', type=str, help='Path to the folder containing CSV files of Sentinel tile coordinates.')
+    parser.add_argument('--folder_path', type=str, nargs='+', help='Path to the folder containing CSV files of Sentinel tile coordinates; several folders are combined.')
+    parser.add_argument('--output', type=str, default='unique_coords_tiles.csv', help='Path of the unique coordinates file (.csv or .parquet).')
+    parser.add_argument('--streaming', action='store_true', help='Read the files in parallel and drop duplicates on the fly, in bounded memory.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of reading threads in streaming mode.')
+    parser.add_argument('--max_keys', type=int, default=20_000_000, help='Number of unique coordinates kept in memory before spilling to disk in streaming mode.')
+    parser.add_argument('--spill_dir', type=str, default=None, help='Directory of the spill files in streaming mode (default: system temporary directory).')
 
     args = parser.parse_args()
 
     # Process the coordinates using the provided paths
-    process_coordinates(args.data_coast_points, args.folder_path)
+    process_coordinates(args.data_coast_points, args.folder_path, args.output, args.streaming, args.workers, args.max_keys, args.spill_dir)
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,30 @@
-import pandas as pd
-import glob
 import os
 import argparse
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from table_io import list_tables, read_tables, write_table
+from streaming_dedup import stream_unique_rows
 
-def process_tiles(folder_path, output_csv_path):
+# Columns identifying a tile, and their dtypes when the files are streamed
+TILE_COLUMNS = ['asset', 'minx', 'maxx', 'miny', 'maxy', 'cloud_cover']
+TILE_DTYPES = {'asset': 'category', 'minx': 'float64', 'maxx': 'float64', 'miny': 'float64', 'maxy': 'float64', 'cloud_cover': 'float64'}
+
+def process_tiles(folder_path, output_csv_path, streaming=False, workers=4, max_keys=20_000_000, spill_dir=None):
     """
-    Process CSV files from a specified folder to find unique coastal tiles and save them to a new CSV file.
+    Process CSV or Parquet files from a specified folder to find unique coastal tiles and save them to a new file.
 
     Args:
-        folder_path (str): Path to the folder containing the input CSV files.
-        output_csv_path (str): Path to the output CSV file where unique tiles will be saved.
+        folder_path (str or list): Path to the folder containing the input CSV or Parquet files, or a list
+            of folders, e.g. one per month, combined into one output.
+        output_csv_path (str): Path to the output file where unique tiles will be saved; a .parquet
+            extension saves a Parquet file.
+        streaming (bool): Read the files in parallel and drop duplicates on the fly, writing the unique
+            tiles incrementally, so memory stays bounded however many files are combined. Only the
+            tile columns are read and saved.
+        workers (int): Number of reading threads in streaming mode.
+        max_keys (int): Number of unique tiles kept in memory before spilling to disk in streaming mode.
+        spill_dir (str, optional): Directory of the spill files in streaming mode.
     """
     # Get the absolute path of the current script
     current_file_path = os.path.abspath(__file__)
@@ -22,19 +37,21 @@ def process_tiles(folder_path, output_csv_path):
 
     print(f"Working directory set to: {os.getcwd()}")
 
-    # Use glob to find all CSV files in the specified folder
-    csv_files = glob.glob(os.path.join(folder_path, '*.csv'))
+    # Find all CSV and Parquet files in the specified folders
+    folder_paths = [folder_path] if isinstance(folder_path, str) else folder_path
+    csv_files = [path for folder in folder_paths for path in list_tables(folder)]
 
-    # Initialize an empty list to hold the dataframes
-    dfs = []
+    # Ensure the output directory exists
+    os.makedirs(os.path.dirname(output_csv_path) or '.', exist_ok=True)
 
-    # Loop through the list of CSV files and read each one into a dataframe
-    for csv_file in csv_files:
-        df = pd.read_csv(csv_file)
-        dfs.append(df)
+    if streaming:
+        read, written = stream_unique_rows(csv_files, output_csv_path, TILE_COLUMNS, TILE_COLUMNS, TILE_DTYPES, workers, max_keys, spill_dir)
+        print(f"Rows read: {read}, unique tiles: {written}")
+        print(f"Unique tiles saved to: {output_csv_path}")
+        return
 
-    # Concatenate all the dataframes in the list into a single dataframe
-    combined_df = pd.concat(dfs, ignore_index=True)
+    # Read them into a single dataframe; Parquet files are scanned together as one dataset
+    combined_df = read_tables(csv_files)
     print(f"Combined DataFrame shape: {combined_df.shape}")
 
     # Drop duplicate rows based on specific columns to find unique coastal tiles
@@ -42,11 +59,8 @@ def process_tiles(folder_path, output_csv_path):
 
     print(f"Unique tiles shape: {unique_tiles.shape}")
 
-    # Ensure the output directory exists
-    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
-
-    # Save the unique tiles to the specified output CSV file
-    unique_tiles.to_csv(output_csv_path, index=False)
+    # Save the unique tiles to the specified output CSV or Parquet file
+    write_table(unique_tiles, output_csv_path)
     print(f"Unique tiles saved to: {output_csv_path}")
 
 def main():
@@ -54,12 +68,16 @@ def main():
     Main function to handle command-line arguments and invoke the processing function.
     """
     parser = argparse.ArgumentParser(description="Process coastal tiles to find unique entries and save to a CSV file.")
-    parser.add_argument('--folder-path', type=str, required=True, help="Path to the folder containing the input CSV files.")
-    parser.add_argument('--output-csv', type=str, required=True, help="Path to the output CSV file where unique tiles will be saved.")
+    parser.add_argument('--folder-path', type=str, nargs='+', required=True, help="Path to the folder containing the input CSV or Parquet files; several folders are combined.")
+    parser.add_argument('--output-csv', type=str, required=True, help="Path to the output file where unique tiles will be saved (.csv or .parquet).")
+    parser.add_argument('--streaming', action='store_true', help="Read the files in parallel and drop duplicates on the fly, in bounded memory.")
+    parser.add_argument('--workers', type=int, default=4, help="Number of reading threads in streaming mode.")
+    parser.add_argument('--max-keys', type=int, default=20_000_000, help="Number of unique tiles kept in memory before spilling to disk in streaming mode.")
+    parser.add_argument('--spill-dir', type=str, default=None, help="Directory of the spill files in streaming mode (default: system temporary directory).")
     
     args = parser.parse_args()
     
-    process_tiles(args.folder_path, args.output_csv)
+    process_tiles(args.folder_path, args.output_csv, args.streaming, args.workers, args.max_keys, args.spill_dir)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,15 @@
 import json
 import csv
 import argparse
+import ijson
+import numpy as np
+import pandas as pd
+
+# Prefixes of the ijson events inside the coordinates of a MultiPolygon of a GeometryCollection
+POLYGON_PREFIX = 'geometries.item.coordinates.item'
+RING_PREFIX = POLYGON_PREFIX + '.item'
+POSITION_PREFIX = RING_PREFIX + '.item'
+NUMBER_PREFIX = POSITION_PREFIX + '.item'
 
 def parse_geojson(geojson_path):
     """
@@ -26,6 +35,99 @@ def parse_geojson(geojson_path):
                     coordinates.append(coord)
     return coordinates
 
+def iter_geojson_chunks(geojson_path, chunk_size=100000):
+    """
+    Stream the exterior-ring vertices of the MultiPolygon geometries of a GeoJSON file in chunks.
+
+    The file is read as a stream of parser events, so memory stays bounded by chunk_size however large
+    the geometries are. The vertices are the same, in the same order, as the ones parse_geojson returns.
+    MultiPolygons are recognised by the nesting depth of their coordinates, whatever the position of
+    their 'type' member.
+
+    Args:
+    geojson_path (str): Path to the GeoJSON file.
+    chunk_size (int): Maximum number of vertices per chunk.
+
+    Yields:
+    numpy.ndarray: Array of shape (n, 2) of (longitude, latitude) vertices.
+    """
+    lons, lats = [], []
+    position = []
+    ring_index = -1
+
+    with open(geojson_path, 'rb') as file:
+        for prefix, event, value in ijson.parse(file, use_float=True):
+            if event == 'number' and prefix == NUMBER_PREFIX:
+                if ring_index == 0:
+                    position.append(value)
+            elif event == 'start_array':
+                if prefix == POLYGON_PREFIX:
+                    # A new polygon of the MultiPolygon; its first ring is the exterior one
+                    ring_index = -1
+                elif prefix == RING_PREFIX:
+                    ring_index += 1
+                elif prefix == POSITION_PREFIX:
+                    position = []
+            elif event == 'end_array' and prefix == POSITION_PREFIX and ring_index == 0:
+                lons.append(position[0])
+                lats.append(position[1])
+                if len(lons) >= chunk_size:
+                    yield np.column_stack([lons, lats])
+                    lons, lats = [], []
+
+    if lons:
+        yield np.column_stack([lons, lats])
+
+class GridThinner:
+    """
+    Keep one vertex per square grid cell of about cell_meters, across all chunks of a stream.
+
+    Cells are cell_meters high; their width in degrees grows with latitude so that they stay about
+    cell_meters wide. Each cell is hashed to one integer key, and the keys of the cells already used
+    are kept in a set, so memory grows with the number of vertices kept rather than read.
+
+    Args:
+    cell_meters (float): Side of the grid cells in meters.
+    """
+
+    def __init__(self, cell_meters=1000):
+        self.cell_degrees = cell_meters / 111000
+        self.seen = set()
+
+    def cell_keys(self, coordinates):
+        """
+        Compute the hashed grid cell of each vertex.
+
+        Args:
+        coordinates (numpy.ndarray): Array of shape (n, 2) of (longitude, latitude) vertices.
+
+        Returns:
+        numpy.ndarray: int64 key of each vertex's cell.
+        """
+        rows = np.floor(coordinates[:, 1] / self.cell_degrees)
+        row_lats = np.clip((rows + 0.5) * self.cell_degrees, -89.9, 89.9)
+        cols = np.floor(coordinates[:, 0] * np.cos(np.radians(row_lats)) / self.cell_degrees)
+
+        # Rows and columns both fit in 32 bits, so one int64 identifies a cell
+        return (rows.astype(np.int64) << 32) + (cols.astype(np.int64) & 0xFFFFFFFF)
+
+    def thin(self, coordinates):
+        """
+        Keep the first vertex of every cell not used by an earlier vertex.
+
+        Args:
+        coordinates (numpy.ndarray): Array of shape (n, 2) of (longitude, latitude) vertices.
+
+        Returns:
+        numpy.ndarray: The kept vertices, in their original order.
+        """
+        keys = self.cell_keys(coordinates)
+        unique_keys, first = np.unique(keys, return_index=True)
+
+        new = np.fromiter((key not in self.seen for key in unique_keys.tolist()), dtype=bool, count=len(unique_keys))
+        self.seen.update(unique_keys[new].tolist())
+        return coordinates[np.sort(first[new])]
+
 def save_coordinates_to_csv(coordinates, output_path):
     """
     Save a list of coordinates to a CSV file.
@@ -41,18 +143,54 @@ def save_coordinates_to_csv(coordinates, output_path):
         for coord in coordinates:
             writer.writerow(coord)
 
+def stream_coordinates_to_csv(geojson_path, output_path, thin_meters=None, chunk_size=100000):
+    """
+    Stream the coastline vertices of a GeoJSON file to a CSV file, optionally thinned to one per grid cell.
+
+    Args:
+    geojson_path (str): Path to the input GeoJSON file.
+    output_path (str): Path to the output CSV file.
+    thin_meters (float, optional): Keep one vertex per grid cell of this size; all vertices if None.
+    chunk_size (int): Number of vertices parsed, thinned and written at a time.
+
+    Returns:
+    tuple: (number of vertices read, number of vertices written).
+    """
+    thinner = GridThinner(thin_meters) if thin_meters else None
+    read = written = 0
+
+    with open(output_path, 'w', newline='') as file:
+        # Same line endings as the csv module uses in save_coordinates_to_csv
+        file.write('Longitude,Latitude\r\n')
+        for chunk in iter_geojson_chunks(geojson_path, chunk_size):
+            read += len(chunk)
+            if thinner is not None:
+                chunk = thinner.thin(chunk)
+            written += len(chunk)
+            # Write the whole chunk at once
+            pd.DataFrame(chunk).to_csv(file, header=False, index=False, lineterminator='\r\n')
+            print(f"Vertices read: {read}, written: {written}")
+
+    return read, written
 
-def main(geojson_path, output_csv_path):
+def main(geojson_path, output_csv_path, streaming=False, thin_meters=None):
     """
     Main function to parse GeoJSON file and save the extracted coordinates to a CSV file.
 
     Args:
     geojson_path (str): Path to the input GeoJSON file.
     output_csv_path (str): Path to the output CSV file.
+    streaming (bool): Parse and write the file in chunks in bounded memory.
+    thin_meters (float, optional): Keep one vertex per grid cell of this size (streaming mode).
     """
+    if streaming or thin_meters:
+        read, written = stream_coordinates_to_csv(geojson_path, output_csv_path, thin_meters)
+        print(f"Saved {written} of {read} coastline vertices to {output_csv_path}")
+        return
+
     # Parse the GeoJSON file to get coastline coordinates
     coastline_coordinates = parse_geojson(geojson_path)
-    
+
     # Save the extracted coordinates to a CSV file
     save_coordinates_to_csv(coastline_coordinates, output_csv_path)
 
@@ -60,7 +198,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Parse a GeoJSON file and save the extracted coordinates to a CSV file.')
     parser.add_argument('--geojson-path', type=str, required=True, help='Path to the input GeoJSON file.')
     parser.add_argument('--output-path', type=str, required=True, help='Path to the output CSV file.')
+    parser.add_argument('--streaming', action='store_true', help='Parse the GeoJSON file as a stream and write the vertices in chunks, in bounded memory.')
+    parser.add_argument('--thin-meters', type=float, default=None, help='Keep one vertex per grid cell of this size in meters, e.g. 1000 (implies --streaming).')
 
     args = parser.parse_args()
-    
-    main(args.geojson_path, args.output_path)
\ No newline at end of file
+
+    main(args.geojson_path, args.output_path, args.streaming, args.thin_meters)
@@ -7,5 +7,8 @@ chmod +x run_create-coastline-coordinate-data.sh
 geojson_path="earth-coastlines-1m.geo.json"
 output_csv_path="coastline-coordinate-data.csv"
 
+# Keep one vertex per grid cell of this size in meters; leave empty to keep every vertex
+thin_meters="${1:-}"
+
 # Run the Python script with specified arguments
-python3 create-coastline-coordinate-data.py --geojson-path "$geojson_path" --output-path "$output_csv_path"
+python3 create-coastline-coordinate-data.py --geojson-path "$geojson_path" --output-path "$output_csv_path" --streaming ${thin_meters:+--thin-meters "$thin_meters"}
@@ -25,7 +25,25 @@ import boto3
 from botocore.exceptions import NoCredentialsError
 import os
 import gc
+import io
+import shutil
+import tempfile
+import functools
 import argparse
+from boto3.s3.transfer import TransferConfig
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from band_stacking import item_destination_grid, iter_warped_bands, iter_lazy_bands, strip_workers, stack_bands, fetch_bands, warp_bands
+from tile_writers import write_bands_geotiff, write_bands_geotiff_bytes, write_bands_zarr, upload_directory
+from tile_pipeline import run_pipeline, SkipTile
+from tile_scheduler import run_scheduler, open_journal, journal_is_empty
+from stac_cache import cached_catalog
+from table_io import read_table
+from tile_metrics import TileMetrics, MetricsRecorder
+from asset_cache import open_asset_cache
+from warp_cache import open_warp_cache
+from scl_precheck import precheck_item, TileRejected, RejectionManifest
 
 session = boto3.Session()
 
@@ -35,6 +53,42 @@ s3_client = session.client('s3')
 bucket = 'kelpwatch2'
 # s3_folder_name = 'inference-data/2024-05'
 
+# Sentinel-2 assets stacked into every inference tile, in band order
+INFERENCE_BANDS = ['B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B08', 'B11', 'B12', 'SCL', 'WVP', 'AOT']
+
+# Multipart settings for uploading tiles from memory in pipelined mode
+UPLOAD_CONFIG = TransferConfig(multipart_threshold=64 * 1024 * 1024, multipart_chunksize=64 * 1024 * 1024, max_concurrency=8)
+
+# Keys marking a finished tile in the S3 folder: a GeoTIFF, or the root metadata of a Zarr store,
+# uploaded after all of its chunks
+TILE_KEY_SUFFIXES = ('.tif', '.zarr/zarr.json')
+
+
+# STAC catalog, asset cache and warp cache of a scheduler worker process, opened on its first tile
+worker_catalog = None
+worker_asset_cache = None
+worker_warp_cache = None
+
+def open_catalog(stac_cache_dir=None, stac_cache_ttl_hours=168):
+    """
+    Open the Planetary Computer STAC catalog with signed asset URLs.
+
+    :param stac_cache_dir: Directory of the on-disk STAC search cache; searches are not cached if None
+    :param stac_cache_ttl_hours: Age after which cached searches are refreshed; 0 keeps them forever
+    :return: pystac_client.Client, or a CachedCatalog wrapping it
+    """
+    catalog = pystac_client.Client.open(
+    "https://planetarycomputer.microsoft.com/api/stac/v1",
+    modifier=planetary_computer.sign_inplace,
+    )
+    return cached_catalog(catalog, stac_cache_dir, stac_cache_ttl_hours)
+
+def init_worker():
+    """
+    Initialize a scheduler worker process with its own S3 client.
+    """
+    global s3_client
+    s3_client = boto3.Session().client('s3')
 
 def clean_folder_name(folder_name, part_remove):
     """
@@ -48,8 +102,8 @@ def clean_folder_name(folder_name, part_remove):
     part_remove_pattern = re.escape(part_remove + '/')
     # Remove part_remove from the start of the folder name
     folder_name = re.sub(r'^' + part_remove_pattern, '', folder_name)
-    # Remove '.tif' from the end of the folder name
-    folder_name = re.sub(r'\.tif/?$', '', folder_name)
+    # Remove '.tif', or '.zarr' and the store's root metadata, from the end of the folder name
+    folder_name = re.sub(r'\.(tif|zarr)(/zarr\.json)?/?$', '', folder_name)
     return folder_name
 
 def check_file_exists_s3(s3_client, bucket_name, file_key):
@@ -88,110 +142,369 @@ def list_objects_in_folder(bucket_name, prefix):
 
     return all_keys
 
-def get_bands(selected_item, catalog):
+def list_processed_tiles(bucket_name, s3_folder_name):
+    """
+    List the IDs of the tiles already in an S3 folder, as GeoTIFFs or complete Zarr stores.
+
+    :param bucket_name: Name of the S3 bucket
+    :param s3_folder_name: Folder path in the S3 bucket where results are uploaded
+    :return: List of tile IDs
+    """
+    keys = list_objects_in_folder(bucket_name, s3_folder_name)
+    return [clean_folder_name(key, s3_folder_name) for key in keys if key.endswith(TILE_KEY_SUFFIXES)]
+
+def get_item(selected_item, catalog):
+    """
+    Look up a Sentinel-2 item by ID.
+
+    :param selected_item: ID of the Sentinel-2 item
+    :param catalog: Sentinel-2 instance
+    :return: The signed pystac.Item
     """
-    Retrieve Sentinel-2 bands from a selected item, rescale bands to 10m resolution where applicable, 
+    search = catalog.search(collections=["sentinel-2-l2a"], ids=[selected_item])
+    return search.item_collection()[0]
+
+def check_tile(selected_item, precheck_options, metrics):
+    """
+    Run the SCL pre-check of an item from a coarse overview, before any of its bands is fetched.
+
+    :param selected_item: Sentinel-2 item
+    :param precheck_options: Keyword arguments of precheck_item (min_water_fraction, overview_level, coastal_buffer_m); nothing is checked if None
+    :param metrics: TileMetrics receiving the pre-check time and statistics
+    :raises TileRejected: When the tile shows too little clear water along the coast
+    """
+    if precheck_options is None:
+        return
+    with metrics.stage("precheck"):
+        metrics.precheck = precheck_item(selected_item, **precheck_options)
+
+def lazy_scheduler(lazy_options, width):
+    """
+    Dask configuration computing lazy bands on a thread pool sized to the memory budget.
+
+    :param lazy_options: Dict with the destination rows per strip ('strip_rows') and the memory the strips in flight may use ('memory_bytes')
+    :param width: Width of the destination grid in pixels
+    :return: Context manager applying the configuration
+    """
+    import dask
+
+    workers = strip_workers(lazy_options["memory_bytes"], lazy_options["strip_rows"], width)
+    return dask.config.set(scheduler="threads", num_workers=workers)
+
+def get_bands(selected_item, catalog, fetch_workers=1, asset_cache=None, warp_cache=None, lazy_options=None):
+    """
+    Retrieve Sentinel-2 bands from a selected item, warp every band onto one common 10m EPSG:4326 grid
     and stack them into a single xarray.Dataset.
 
+    In lazy mode nothing is downloaded: the stack is a dask graph of strips of destination rows, each
+    reading only the source windows it covers, to be computed within ``lazy_scheduler(lazy_options, stack.rio.width)``.
+
     :param selected_item: ID of the Sentinel-2 item to retrieve bands from
     :param catalog: Sentinel-2 instance
+    :param fetch_workers: Number of assets downloaded and decoded in parallel
+    :param asset_cache: AssetCache of decoded assets, read before downloading
+    :param warp_cache: WarpCache of destination grids and warp plans reused across tiles
+    :param lazy_options: Dict with 'strip_rows' and 'memory_bytes' for a lazy stack; the bands are loaded if None
     :return: An xarray.Dataset containing the stacked Sentinel-2 bands
     """
-    target_resolution = 10  # Target resolution in meters
-    scale_factor = 20 / target_resolution  # Scale factor for resampling to 10m resolution
-
     # Search for the selected item in the Sentinel-2 collection
-    search = catalog.search(collections=["sentinel-2-l2a"], ids=[selected_item])
-    selected_item = search.item_collection()
-    selected_item = selected_item[0]
-
-    # Retrieve and reproject each band from the selected item
-    dsB02 = rioxarray.open_rasterio(selected_item.assets["B02"].href, overview_level=0).rename("dsB02")
-    dsB02 = dsB02.rio.reproject("EPSG:4326")
-
-    dsB03 = rioxarray.open_rasterio(selected_item.assets["B03"].href, overview_level=0).rename("dsB03")
-    dsB03 = dsB03.rio.reproject("EPSG:4326")
-
-    dsB04 = rioxarray.open_rasterio(selected_item.assets["B04"].href, overview_level=0).rename("dsB04")
-    dsB04 = dsB04.rio.reproject("EPSG:4326")
-
-    # For bands that need resampling, calculate new dimensions and reproject
-    dsB05 = rioxarray.open_rasterio(selected_item.assets["B05"].href, overview_level=0).rename("dsB05")
-    new_height = int(dsB05.rio.height * scale_factor)
-    new_width = int(dsB05.rio.width * scale_factor)
-    dsB05 = dsB05.rio.reproject(dsB05.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB05 = dsB05.rio.reproject("EPSG:4326")
-
-    dsB06 = rioxarray.open_rasterio(selected_item.assets["B06"].href, overview_level=0).rename("dsB06")
-    new_height = int(dsB06.rio.height * scale_factor)
-    new_width = int(dsB06.rio.width * scale_factor)
-    dsB06 = dsB06.rio.reproject(dsB06.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB06 = dsB06.rio.reproject("EPSG:4326")
-
-    dsB07 = rioxarray.open_rasterio(selected_item.assets["B07"].href, overview_level=0).rename("dsB07")
-    new_height = int(dsB07.rio.height * scale_factor)
-    new_width = int(dsB07.rio.width * scale_factor)
-    dsB07 = dsB07.rio.reproject(dsB07.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB07 = dsB07.rio.reproject("EPSG:4326")
-
-    dsB8A = rioxarray.open_rasterio(selected_item.assets["B8A"].href, overview_level=0).rename("dsB8A")
-    new_height = int(dsB8A.rio.height * scale_factor)
-    new_width = int(dsB8A.rio.width * scale_factor)
-    dsB8A = dsB8A.rio.reproject(dsB8A.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB8A = dsB8A.rio.reproject("EPSG:4326")
-
-    dsB08 = rioxarray.open_rasterio(selected_item.assets["B08"].href, overview_level=0).rename("dsB08")
-    dsB08 = dsB08.rio.reproject("EPSG:4326")
-
-    dsB11 = rioxarray.open_rasterio(selected_item.assets["B11"].href, overview_level=0).rename("dsB11")
-    new_height = int(dsB11.rio.height * scale_factor)
-    new_width = int(dsB11.rio.width * scale_factor)
-    dsB11 = dsB11.rio.reproject(dsB11.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB11 = dsB11.rio.reproject("EPSG:4326")
-
-    dsB12 = rioxarray.open_rasterio(selected_item.assets["B12"].href, overview_level=0).rename("dsB12")
-    new_height = int(dsB12.rio.height * scale_factor)
-    new_width = int(dsB12.rio.width * scale_factor)
-    dsB12 = dsB12.rio.reproject(dsB12.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsB12 = dsB12.rio.reproject("EPSG:4326")
-
-    dsSCL = rioxarray.open_rasterio(selected_item.assets["SCL"].href, overview_level=0).rename("dsSCL")
-    new_height = int(dsSCL.rio.height * scale_factor)
-    new_width = int(dsSCL.rio.width * scale_factor)
-    dsSCL = dsSCL.rio.reproject(dsSCL.rio.crs, shape=(new_height, new_width), resampling=Resampling.bilinear)
-    dsSCL = dsSCL.rio.reproject("EPSG:4326")
-
-    dsWVP = rioxarray.open_rasterio(selected_item.assets["WVP"].href, overview_level=0).rename("dsWVP")
-    dsWVP = dsWVP.rio.reproject("EPSG:4326")
-
-    dsAOT = rioxarray.open_rasterio(selected_item.assets["AOT"].href, overview_level=0).rename("dsAOT")
-    dsAOT = dsAOT.rio.reproject("EPSG:4326")
+    selected_item = get_item(selected_item, catalog)
+
+    # Warp each band, including the 20m ones, onto the item's 10m grid in a single reprojection
+    grid = item_destination_grid(selected_item, warp_cache=warp_cache)
+    if lazy_options is not None:
+        data_arrays = [band for _, band in iter_lazy_bands(selected_item, INFERENCE_BANDS, grid, lazy_options["strip_rows"])]
+    else:
+        data_arrays = [band for _, band in iter_warped_bands(selected_item, INFERENCE_BANDS, grid, fetch_workers, cache=asset_cache, warp_cache=warp_cache)]
 
     # Stack all bands into a single xarray.Dataset
-    data_arrays = [dsB02, dsB03, dsB04, dsB05, dsB06, dsB07, dsB8A, dsB08, dsB11, dsB12, dsSCL, dsWVP, dsAOT]
-    stacked = xr.concat(data_arrays, dim='band')
-    stacked = stacked.assign_coords(band=['B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B08', 'B11', 'B12', 'SCL', 'WVP', 'AOT'])
+    stacked = stack_bands(data_arrays, INFERENCE_BANDS)
 
     print("Assets Download and Stack Complete")
 
     return stacked
 
+def write_bands(selected_item, catalog, raster_file, fetch_workers=1, metrics=None, asset_cache=None, warp_cache=None, zarr_options=None, lazy_options=None, precheck_options=None):
+    """
+    Retrieve Sentinel-2 bands from a selected item and stream them into a GeoTIFF or a Zarr store one
+    at a time, so that only about one warped band is held in memory instead of the full stack. In lazy
+    mode each band is itself streamed in strips of destination rows warped on several threads.
+
+    :param selected_item: ID of the Sentinel-2 item to retrieve bands from
+    :param catalog: Sentinel-2 instance
+    :param raster_file: Path of the GeoTIFF, or of the Zarr store directory, to write
+    :param fetch_workers: Number of assets downloaded and decoded in parallel
+    :param metrics: TileMetrics receiving the stage timings and per-band statistics of the tile
+    :param asset_cache: AssetCache of decoded assets, read before downloading
+    :param warp_cache: WarpCache of destination grids and warp plans reused across tiles
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); a GeoTIFF is written if None
+    :param lazy_options: Dict with 'strip_rows' and 'memory_bytes' to warp the bands lazily in strips; bands are warped whole if None
+    :param precheck_options: Keyword arguments of precheck_item; the tile is not pre-checked if None
+    :return: The path of the GeoTIFF or Zarr store
+    :raises TileRejected: When the pre-check rejects the tile, before any band is fetched
+    """
+    metrics = metrics or TileMetrics(selected_item)
+
+    # Search for the selected item in the Sentinel-2 collection
+    with metrics.stage("stac_lookup"):
+        selected_item = get_item(selected_item, catalog)
+    check_tile(selected_item, precheck_options, metrics)
+
+    # Warp each band onto the item's 10m grid and write it to its slot as soon as it is ready
+    with metrics.stage("grid"):
+        grid = item_destination_grid(selected_item, warp_cache=warp_cache)
+    with metrics.stage("fetch_warp_write"):
+        if lazy_options is not None:
+            with lazy_scheduler(lazy_options, grid.width):
+                write_tile(grid, iter_lazy_bands(selected_item, INFERENCE_BANDS, grid, lazy_options["strip_rows"], stats=metrics.bands), metrics, zarr_options, raster_file)
+        else:
+            bands = iter_warped_bands(selected_item, INFERENCE_BANDS, grid, fetch_workers, stats=metrics.bands, cache=asset_cache, warp_cache=warp_cache)
+            write_tile(grid, bands, metrics, zarr_options, raster_file)
+
+    print("Assets Download and Write Complete")
 
+    return raster_file
+
+
+def write_tile(grid, bands, metrics, zarr_options=None, raster_file=None):
+    """
+    Write warped bands as a GeoTIFF or a Zarr store, to raster_file or, if None, to memory or a temporary directory.
+
+    :param grid: Destination grid shared by all bands
+    :param bands: Iterable of (band name, band on the destination grid)
+    :param metrics: TileMetrics receiving the per-band statistics of the tile
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); a GeoTIFF is written if None
+    :param raster_file: Path of the GeoTIFF or Zarr store to write
+    :return: The path written, or the encoded GeoTIFF as bytes when raster_file is None
+    """
+    if zarr_options is not None:
+        path = raster_file or os.path.join(tempfile.mkdtemp(), "tile.zarr")
+        return write_bands_zarr(path, grid, bands, INFERENCE_BANDS, stats=metrics.bands, **zarr_options)
+    if raster_file is None:
+        return write_bands_geotiff_bytes(grid, bands, INFERENCE_BANDS, stats=metrics.bands)
+    return write_bands_geotiff(raster_file, grid, bands, INFERENCE_BANDS, stats=metrics.bands)
+
+def fetch_tile(tile, catalog, fetch_workers=1, metrics=None, asset_cache=None, warp_cache=None, precheck_options=None):
+    """
+    Fetch stage of the pipelined mode: look up a tile and download all of its assets into memory.
 
-def main(bucket, tiles_file, s3_folder_name):
+    :param tile: ID of the Sentinel-2 item
+    :param catalog: Sentinel-2 instance
+    :param fetch_workers: Number of assets downloaded and decoded in parallel
+    :param metrics: TileMetrics receiving the stage timings and per-band statistics of the tile
+    :param asset_cache: AssetCache of decoded assets, read before downloading
+    :param warp_cache: WarpCache of destination grids and warp plans reused across tiles
+    :param precheck_options: Keyword arguments of precheck_item; the tile is not pre-checked if None
+    :return: Tuple (destination grid, list of (band name, band on its native grid))
+    :raises TileRejected: When the pre-check rejects the tile, before any band is fetched
+    """
+    metrics = metrics or TileMetrics(tile)
+    with metrics.stage("stac_lookup"):
+        selected_item = get_item(tile, catalog)
+    check_tile(selected_item, precheck_options, metrics)
+    with metrics.stage("grid"):
+        grid = item_destination_grid(selected_item, warp_cache=warp_cache)
+    with metrics.stage("fetch"):
+        bands = list(fetch_bands(selected_item, INFERENCE_BANDS, fetch_workers, stats=metrics.bands, cache=asset_cache))
+    print(f"Assets Download Complete: {tile}")
+    return grid, bands
+
+def encode_tile(fetched, metrics=None, warp_cache=None, zarr_options=None):
+    """
+    Warp/stack stage of the pipelined mode: warp the fetched bands and encode them as an in-memory GeoTIFF,
+    or as a Zarr store in a temporary directory.
+
+    :param fetched: Tuple (destination grid, list of (band name, band on its native grid)) from fetch_tile
+    :param metrics: TileMetrics receiving the stage timings and per-band statistics of the tile
+    :param warp_cache: WarpCache of destination grids and warp plans reused across tiles
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); a GeoTIFF is encoded if None
+    :return: The encoded GeoTIFF as bytes, or the path of the Zarr store
+    """
+    metrics = metrics or TileMetrics(None)
+    grid, bands = fetched
+    # Pop each native band as it is warped so it is released right away
+    native_bands = (bands.pop(0) for _ in range(len(bands)))
+    with metrics.stage("warp_write"):
+        return write_tile(grid, warp_bands(native_bands, grid, metrics.bands, warp_cache), metrics, zarr_options)
+
+def encode_tile_lazy(tile, catalog, lazy_options, metrics=None, warp_cache=None, zarr_options=None, precheck_options=None):
+    """
+    Lazy counterpart of fetch_tile and encode_tile: warp the tile's bands strip by strip straight from
+    the assets, within the memory budget, and encode them as an in-memory GeoTIFF or a temporary Zarr store.
+
+    :param tile: ID of the Sentinel-2 item
+    :param catalog: Sentinel-2 instance
+    :param lazy_options: Dict with the destination rows per strip ('strip_rows') and the memory the strips in flight may use ('memory_bytes')
+    :param metrics: TileMetrics receiving the stage timings and per-band statistics of the tile
+    :param warp_cache: WarpCache of destination grids reused across tiles
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); a GeoTIFF is encoded if None
+    :param precheck_options: Keyword arguments of precheck_item; the tile is not pre-checked if None
+    :return: The encoded GeoTIFF as bytes, or the path of the Zarr store
+    :raises TileRejected: When the pre-check rejects the tile, before any band is read
+    """
+    metrics = metrics or TileMetrics(tile)
+    with metrics.stage("stac_lookup"):
+        selected_item = get_item(tile, catalog)
+    check_tile(selected_item, precheck_options, metrics)
+    with metrics.stage("grid"):
+        grid = item_destination_grid(selected_item, warp_cache=warp_cache)
+    with metrics.stage("fetch_warp_write"), lazy_scheduler(lazy_options, grid.width):
+        return write_tile(grid, iter_lazy_bands(selected_item, INFERENCE_BANDS, grid, lazy_options["strip_rows"], stats=metrics.bands), metrics, zarr_options)
+
+def upload_tile(tile, buffer, bucket, s3_folder_name, metrics=None):
+    """
+    Upload stage of the pipelined mode: upload an in-memory GeoTIFF to S3 with multipart uploads, or
+    the files of a Zarr store in parallel.
+
+    :param tile: ID of the Sentinel-2 item
+    :param buffer: The encoded GeoTIFF as bytes, or the path of a Zarr store, deleted once uploaded
+    :param bucket: S3 bucket name
+    :param s3_folder_name: Folder path in the S3 bucket where results will be uploaded
+    :param metrics: TileMetrics receiving the upload time and size of the tile
+    """
+    metrics = metrics or TileMetrics(tile)
+    if isinstance(buffer, str):
+        with metrics.stage("upload"):
+            metrics.uploaded_bytes = upload_directory(s3_client, buffer, bucket, f"{s3_folder_name}/{tile}.zarr")
+        shutil.rmtree(os.path.dirname(buffer))
+        print(f"S3 Upload Complete: {tile}")
+        return
+
+    object_name = f"{s3_folder_name}/{tile}.tif"
+    with metrics.stage("upload"):
+        s3_client.upload_fileobj(io.BytesIO(buffer), bucket, object_name, Config=UPLOAD_CONFIG)
+    metrics.uploaded_bytes = len(buffer)
+    print(f"S3 Upload Complete: {tile}")
+
+def process_tiles_pipelined(tiles, catalog, bucket, s3_folder_name, fetch_workers=1, queue_size=1, recorder=None, asset_cache=None, warp_cache=None, zarr_options=None, precheck_options=None, on_rejected=None):
+    """
+    Process tiles with the fetch, warp/stack and upload stages running concurrently on different tiles.
+
+    :param tiles: IDs of the Sentinel-2 items to process
+    :param catalog: Sentinel-2 instance
+    :param bucket: S3 bucket name
+    :param s3_folder_name: Folder path in the S3 bucket where results will be uploaded
+    :param fetch_workers: Number of assets of a tile downloaded and decoded in parallel
+    :param queue_size: Maximum number of tiles waiting between two stages
+    :param recorder: MetricsRecorder receiving the metrics of every uploaded tile
+    :param asset_cache: AssetCache of decoded assets, read before downloading
+    :param warp_cache: WarpCache of destination grids and warp plans reused across tiles
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); GeoTIFFs are uploaded if None
+    :param precheck_options: Keyword arguments of precheck_item; tiles are not pre-checked if None
+    :param on_rejected: Called with the TileRejected of every tile the pre-check drops
+    :return: IDs of the tiles uploaded
+    """
+    # The metrics of each tile travel through the stages along with its data
+    def fetch(tile, _):
+        metrics = TileMetrics(tile)
+        try:
+            return metrics, fetch_tile(tile, catalog, fetch_workers, metrics, asset_cache, warp_cache, precheck_options)
+        except TileRejected as rejected:
+            if on_rejected is not None:
+                on_rejected(rejected)
+            raise SkipTile(rejected.reason)
+
+    def upload(tile, value):
+        metrics, buffer = value
+        upload_tile(tile, buffer, bucket, s3_folder_name, metrics)
+        if recorder is not None:
+            recorder.record(metrics)
+            print(f"Estimated time of completion: {recorder.eta_text()}")
+
+    stages = [
+        ("Fetch", fetch),
+        ("Warp", lambda tile, value: (value[0], encode_tile(value[1], value[0], warp_cache, zarr_options))),
+        ("Upload", upload),
+    ]
+    return run_pipeline(tiles, stages, queue_size)
+
+def process_tile(tile, bucket, s3_folder_name, fetch_workers=1, stac_cache_dir=None, stac_cache_ttl_hours=168, asset_cache_dir=None, asset_cache_max_gb=50, warp_cache_dir=None, warp_plan_mb=1152, zarr_options=None, lazy_options=None, precheck_options=None):
+    """
+    Fetch, stack and upload one tile from memory. Runs in the scheduler's worker processes.
+
+    :param tile: ID of the Sentinel-2 item
+    :param bucket: S3 bucket name
+    :param s3_folder_name: Folder path in the S3 bucket where results will be uploaded
+    :param fetch_workers: Number of assets downloaded and decoded in parallel
+    :param stac_cache_dir: Directory of the on-disk STAC search cache, shared by all workers
+    :param stac_cache_ttl_hours: Age after which cached searches are refreshed; 0 keeps them forever
+    :param asset_cache_dir: Directory of the on-disk cache of decoded assets, shared by all workers
+    :param asset_cache_max_gb: Size cap of the asset cache in gigabytes
+    :param warp_cache_dir: Directory of the on-disk cache of destination grids, shared by all workers
+    :param warp_plan_mb: Memory held by the warp plans of each worker in megabytes
+    :param zarr_options: Keyword arguments of write_bands_zarr (chunk_size, compressor); a GeoTIFF is uploaded if None
+    :param lazy_options: Dict with 'strip_rows' and 'memory_bytes' to warp the bands lazily in strips; bands are downloaded whole if None
+    :param precheck_options: Keyword arguments of precheck_item; the tile is not pre-checked if None
+    :return: The metrics of the tile as a dict, recorded by the parent process, or for a tile rejected by
+        the pre-check a dict with its ID, the reason under 'rejected' and the statistics under 'precheck'
+    """
+    global worker_catalog, worker_asset_cache, worker_warp_cache
+    if worker_catalog is None:
+        worker_catalog = open_catalog(stac_cache_dir, stac_cache_ttl_hours)
+        worker_asset_cache = open_asset_cache(asset_cache_dir, asset_cache_max_gb)
+        worker_warp_cache = open_warp_cache(warp_cache_dir, warp_plan_mb)
+
+    metrics = TileMetrics(tile)
+    try:
+        if lazy_options is not None:
+            buffer = encode_tile_lazy(tile, worker_catalog, lazy_options, metrics, worker_warp_cache, zarr_options, precheck_options)
+        else:
+            fetched = fetch_tile(tile, worker_catalog, fetch_workers, metrics, worker_asset_cache, worker_warp_cache, precheck_options)
+            buffer = encode_tile(fetched, metrics, worker_warp_cache, zarr_options)
+    except TileRejected as rejected:
+        # A rejected tile is done for the journal; the parent records it in the manifest
+        return {"tile": tile, "rejected": rejected.reason, "precheck": rejected.stats}
+    upload_tile(tile, buffer, bucket, s3_folder_name, metrics)
+    del buffer
+    gc.collect()
+    return metrics.finish()
+
+def main(bucket, tiles_file, s3_folder_name, fetch_workers=1, pipeline=False, queue_size=1, workers=1, journal=None, max_attempts=3, stac_cache_dir=None, stac_cache_ttl_hours=168, metrics_file=None, metrics_port=None, eta_window=20, asset_cache_dir=None, asset_cache_max_gb=50, warp_cache_dir=None, warp_plan_mb=1152, output_format='geotiff', zarr_chunk_size=1024, zarr_compressor='blosc-zstd:3', lazy=False, lazy_strip_rows=1024, lazy_memory_mb=1024, precheck_min_water_fraction=None, precheck_overview_level=2, precheck_buffer_m=1000, precheck_action='skip', precheck_manifest=None):
     """
     Main function to process tiles and upload them to S3.
 
     :param bucket: S3 bucket name
-    :param tiles_file: Path to the CSV file containing tile information
+    :param tiles_file: Path to the CSV or Parquet file containing tile information; only its asset column is read
     :param s3_folder_name: Folder path in the S3 bucket where results will be uploaded
+    :param fetch_workers: Number of assets of a tile downloaded and decoded in parallel
+    :param pipeline: Run the fetch, warp/stack and upload stages concurrently, uploading from memory
+    :param queue_size: Maximum number of tiles waiting between two stages in pipelined mode
+    :param workers: Number of worker processes in scheduler mode
+    :param journal: Path of the SQLite journal; enables scheduler mode
+    :param max_attempts: Attempts per tile before it is marked failed in scheduler mode
+    :param stac_cache_dir: Directory of the on-disk STAC search cache; searches are not cached if None
+    :param stac_cache_ttl_hours: Age after which cached searches are refreshed; 0 keeps them forever
+    :param metrics_file: JSON lines file the metrics of every tile are appended to; not written if None
+    :param metrics_port: Local port serving the aggregated metrics in the Prometheus text format; not served if None
+    :param eta_window: Number of most recent tiles the throughput of the completion estimate is averaged over
+    :param asset_cache_dir: Directory of an on-disk cache of decoded assets, keyed by item ID and asset name; no cache if None
+    :param asset_cache_max_gb: Size cap of the asset cache in gigabytes; the least recently used assets are evicted
+    :param warp_cache_dir: Directory of an on-disk cache of destination grids, reused by later acquisitions of the same tiles; no warp cache if None
+    :param warp_plan_mb: Memory held by the warp plans shared by the nearest-neighbour bands of a tile, in megabytes; 0 disables them
+    :param output_format: 'geotiff' for one GeoTIFF per tile, or 'zarr' for one Zarr store per tile with a chunked array per band
+    :param zarr_chunk_size: Side of the square chunks of the Zarr arrays in pixels
+    :param zarr_compressor: Compressor of the Zarr chunks, e.g. 'blosc-zstd:3', 'blosc-lz4', 'zstd:5' or 'none'
+    :param lazy: Warp every band lazily in strips of destination rows read straight from the assets, on threads, instead of downloading whole assets; bypasses the asset cache and warp plans
+    :param lazy_strip_rows: Destination rows per strip in lazy mode
+    :param lazy_memory_mb: Memory the strips in flight may use in lazy mode, in megabytes; caps the number of threads
+    :param precheck_min_water_fraction: Smallest fraction of clear water along the coast, measured on a coarse overview of the SCL asset, for a tile's bands to be fetched; tiles are not pre-checked if None or 0
+    :param precheck_overview_level: Overview level of the SCL asset read by the pre-check
+    :param precheck_buffer_m: Width in metres of the coastal area around the land pixels of the SCL
+    :param precheck_action: 'skip' to drop the rejected tiles, or 'defer' to process them unchecked after all the others
+    :param precheck_manifest: JSON lines file the rejected tiles and their reasons are appended to; tiles already in it are not checked again
     """
 
 
-    catalog = pystac_client.Client.open(
-    "https://planetarycomputer.microsoft.com/api/stac/v1",
-    modifier=planetary_computer.sign_inplace,
-    )
+    catalog = open_catalog(stac_cache_dir, stac_cache_ttl_hours)
+    asset_cache = open_asset_cache(asset_cache_dir, asset_cache_max_gb)
+    warp_cache = open_warp_cache(warp_cache_dir, warp_plan_mb)
+    zarr_options = {"chunk_size": zarr_chunk_size, "compressor": zarr_compressor} if output_format == 'zarr' else None
+    lazy_options = {"strip_rows": lazy_strip_rows, "memory_bytes": int(lazy_memory_mb * 1024 ** 2)} if lazy else None
+    precheck_options = {
+        "min_water_fraction": precheck_min_water_fraction,
+        "overview_level": precheck_overview_level,
+        "coastal_buffer_m": precheck_buffer_m,
+    } if precheck_min_water_fraction else None
 
 
     # Set the working directory to the current directory
@@ -200,13 +513,60 @@ def main(bucket, tiles_file, s3_folder_name):
     os.chdir(current_directory)
     print(f"Working directory set to: {os.getcwd()}")
 
-    # Read tile information from CSV file
-    tiles_df = pd.read_csv(tiles_file)
+    # Read the tile IDs from the CSV or Parquet file
+    tiles_df = read_table(tiles_file, columns=['asset'])
     print(f"Total tiles for month: {len(tiles_df)}")
 
+    # Tiles rejected by the pre-check of an earlier run are not checked again; deferred ones are
+    # processed, unchecked, after all the others
+    manifest = RejectionManifest(precheck_manifest)
+    rejected_before = manifest.entries() if precheck_options is not None else {}
+    deferred_before = [tile for tile, entry in rejected_before.items() if entry["action"] == 'defer'] if precheck_action == 'defer' else []
+    if rejected_before:
+        print(f"Tiles rejected by an earlier pre-check: {len(rejected_before)}, deferred: {len(deferred_before)}")
+
+    if journal:
+        # On the first run, drop the tiles already in S3; later runs resume from the journal alone
+        conn = open_journal(journal)
+        first_run = journal_is_empty(conn)
+        conn.close()
+        tiles = tiles_df['asset'].tolist()
+        if first_run:
+            s3_tiles = set(list_processed_tiles(bucket, s3_folder_name))
+            print(f"Tiles already processed: {len(s3_tiles)}")
+            tiles = [tile for tile in tiles if tile not in s3_tiles]
+        deferred = sorted(set(deferred_before).intersection(tiles))
+        tiles = [tile for tile in tiles if tile not in rejected_before]
+
+        worker = functools.partial(process_tile, bucket=bucket, s3_folder_name=s3_folder_name, fetch_workers=fetch_workers,
+                                   stac_cache_dir=stac_cache_dir, stac_cache_ttl_hours=stac_cache_ttl_hours,
+                                   asset_cache_dir=asset_cache_dir, asset_cache_max_gb=asset_cache_max_gb,
+                                   warp_cache_dir=warp_cache_dir, warp_plan_mb=warp_plan_mb, zarr_options=zarr_options,
+                                   lazy_options=lazy_options, precheck_options=precheck_options)
+
+        # Tiles deferred to the second run still count as remaining while the first one runs
+        def on_done(tile, result, remaining, queued=deferred):
+            if "rejected" in result:
+                manifest.record(TileRejected(tile, result["rejected"], result["precheck"]), precheck_action)
+                if precheck_action == 'defer':
+                    deferred.append(tile)
+                else:
+                    recorder.skip()
+            else:
+                recorder.record(result, remaining + len(queued))
+            print(f"Estimated time of completion: {recorder.eta_text()}")
+
+        with MetricsRecorder(metrics_file, metrics_port, len(tiles) + len(deferred), eta_window) as recorder:
+            run_scheduler(journal, tiles, worker, workers, max_attempts, initializer=init_worker, on_done=on_done)
+            if deferred:
+                # Deferred tiles have their own journal, so a restart resumes them too
+                print(f"Processing deferred tiles: {len(deferred)}")
+                run_scheduler(f"{journal}.deferred", deferred, functools.partial(worker, precheck_options=None), workers, max_attempts,
+                              initializer=init_worker, on_done=functools.partial(on_done, queued=()))
+        return
+
     # List and clean existing tiles in S3
-    s3_tiles = list_objects_in_folder(bucket, s3_folder_name)
-    s3_tiles = [clean_folder_name(folder, s3_folder_name) for folder in s3_tiles]
+    s3_tiles = list_processed_tiles(bucket, s3_folder_name)
     print(f"Tiles already processed: {len(s3_tiles)}")
 
     # Filter out already processed tiles
@@ -214,38 +574,105 @@ def main(bucket, tiles_file, s3_folder_name):
     tiles_df = tiles_df.reset_index(drop=True)
     print(f"Total tiles to be processed for month: {len(tiles_df)}")
     tiles_df = tiles_df.sample(frac=1).reset_index(drop=True)
-
-    # Process and upload tiles
-    for i in range(len(tiles_df)):
-        tile = tiles_df['asset'].iloc[i]
-        print(f"Tiles left: {len(tiles_df) - i}")
-        print(f"Estimated time of completion: {(len(tiles_df) - i) / 60:.2f} hrs")
-        print(f"Processing tile number: {i} {tile}")
-
-        raster_file = f"{tile}.tif"
-        object_name = f"{s3_folder_name}/{raster_file}"
-
-        if check_file_exists_s3(s3_client, bucket, object_name):
-            print(f"{tile} already processed: {len(s3_tiles)}")
-            continue
-
-        # Download and stack bands, then save as a raster file
-        stacked = get_bands(tile, catalog)
-        stacked.rio.to_raster(raster_file)
-        print("Bands Merge Complete and Saved")
-        del stacked
-
-        # Upload the raster file to S3
-        s3_client.upload_file(raster_file, bucket, object_name)
-        print("S3 Upload Complete")
-        gc.collect()
-        os.remove(raster_file)
+    deferred = sorted(set(deferred_before).intersection(tiles_df['asset']))
+    tiles = [tile for tile in tiles_df['asset'] if tile not in rejected_before]
+
+    if pipeline:
+        def on_rejected(rejected):
+            manifest.record(rejected, precheck_action)
+            if precheck_action == 'defer':
+                deferred.append(rejected.tile)
+            else:
+                recorder.skip()
+
+        # Overlap fetching, warping and uploading of consecutive tiles
+        total = len(tiles) + len(deferred)
+        with MetricsRecorder(metrics_file, metrics_port, total, eta_window) as recorder:
+            uploaded = process_tiles_pipelined(tiles, catalog, bucket, s3_folder_name, fetch_workers, queue_size, recorder, asset_cache, warp_cache, zarr_options, precheck_options, on_rejected)
+            if deferred:
+                print(f"Processing deferred tiles: {len(deferred)}")
+                uploaded += process_tiles_pipelined(deferred, catalog, bucket, s3_folder_name, fetch_workers, queue_size, recorder, asset_cache, warp_cache, zarr_options)
+        print(f"Tiles uploaded: {len(uploaded)} of {total}")
+        return
+
+    # Process and upload tiles; tiles deferred by the pre-check are appended, unchecked, to the end
+    pending = [(tile, precheck_options) for tile in tiles] + [(tile, None) for tile in deferred]
+    with MetricsRecorder(metrics_file, metrics_port, len(pending), eta_window) as recorder:
+        for i, (tile, tile_precheck) in enumerate(pending):
+            print(f"Tiles left: {len(pending) - i}")
+            print(f"Estimated time of completion: {recorder.eta_text()}")
+            print(f"Processing tile number: {i} {tile}")
+
+            raster_file = f"{tile}.zarr" if zarr_options is not None else f"{tile}.tif"
+            # A Zarr store is complete once its root metadata, uploaded last, is in S3
+            object_name = f"{s3_folder_name}/{raster_file}/zarr.json" if zarr_options is not None else f"{s3_folder_name}/{raster_file}"
+
+            if check_file_exists_s3(s3_client, bucket, object_name):
+                print(f"{tile} already processed: {len(s3_tiles)}")
+                recorder.skip()
+                continue
+
+            # Download bands and stream them into a raster file
+            metrics = TileMetrics(tile)
+            try:
+                write_bands(tile, catalog, raster_file, fetch_workers, metrics, asset_cache, warp_cache, zarr_options, lazy_options, tile_precheck)
+            except TileRejected as rejected:
+                manifest.record(rejected, precheck_action)
+                if precheck_action == 'defer':
+                    pending.append((tile, None))
+                else:
+                    recorder.skip()
+                continue
+            print("Bands Merge Complete and Saved")
+
+            # Upload the raster file, or every file of the Zarr store, to S3
+            with metrics.stage("upload"):
+                if zarr_options is not None:
+                    metrics.uploaded_bytes = upload_directory(s3_client, raster_file, bucket, f"{s3_folder_name}/{raster_file}")
+                else:
+                    s3_client.upload_file(raster_file, bucket, object_name)
+                    metrics.uploaded_bytes = os.path.getsize(raster_file)
+            print("S3 Upload Complete")
+            gc.collect()
+            if zarr_options is not None:
+                shutil.rmtree(raster_file)
+            else:
+                os.remove(raster_file)
+            recorder.record(metrics)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Sentinel-2 tiles and upload to S3.")
     parser.add_argument("--bucket", type=str, required=True, help="S3 bucket name")
-    parser.add_argument("--tiles-file", type=str, required=True, help="Path to CSV file containing tile information")
+    parser.add_argument("--tiles-file", type=str, required=True, help="Path to the CSV or Parquet file containing tile information")
     parser.add_argument("--s3-folder-name", type=str, required=True, help="Folder path in S3 bucket where results will be uploaded")
-
+    parser.add_argument("--fetch-workers", type=int, default=1, help="Number of assets of a tile downloaded and decoded in parallel")
+    parser.add_argument("--pipeline", action="store_true", help="Run the fetch, warp/stack and upload stages concurrently and upload tiles from memory")
+    parser.add_argument("--queue-size", type=int, default=1, help="Maximum number of tiles waiting between two stages in pipelined mode")
+    parser.add_argument("--journal", type=str, default=None, help="SQLite journal of tile states; runs the multi-process scheduler and resumes from it after a crash")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes in scheduler mode")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per tile before it is marked failed in scheduler mode")
+    parser.add_argument("--stac-cache-dir", type=str, default=None, help="Directory of an on-disk cache of STAC search results, reused across runs and workers")
+    parser.add_argument("--stac-cache-ttl-hours", type=float, default=168, help="Age in hours after which cached STAC searches are refreshed; 0 keeps them forever")
+    parser.add_argument("--metrics-file", type=str, default=None, help="JSON lines file the timings, sizes and peak memory of every tile are appended to")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Local port serving the aggregated metrics in the Prometheus text format at /metrics")
+    parser.add_argument("--eta-window", type=int, default=20, help="Number of most recent tiles the throughput of the completion estimate is averaged over")
+    parser.add_argument("--asset-cache-dir", type=str, default=None, help="Directory of an on-disk cache of decoded Sentinel-2 assets, reused across runs, restarts and workers")
+    parser.add_argument("--asset-cache-max-gb", type=float, default=50, help="Size cap of the asset cache in gigabytes; the least recently used assets are evicted")
+    parser.add_argument("--warp-cache-dir", type=str, default=None, help="Directory of an on-disk cache of destination grids keyed by source grid, reused by later acquisitions of the same tiles; also enables warp plans")
+    parser.add_argument("--warp-plan-mb", type=float, default=1152, help="Memory held by the warp plans shared by the nearest-neighbour bands of a tile, in megabytes; 0 disables them")
+    parser.add_argument("--output-format", type=str, choices=["geotiff", "zarr"], default="geotiff", help="Write one GeoTIFF per tile, or one Zarr store with a chunked array per band")
+    parser.add_argument("--zarr-chunk-size", type=int, default=1024, help="Side of the square chunks of the Zarr arrays in pixels")
+    parser.add_argument("--zarr-compressor", type=str, default="blosc-zstd:3", help="Compressor of the Zarr chunks: blosc-zstd, blosc-lz4, zstd, gzip or none, optionally followed by ':level'")
+    parser.add_argument("--lazy", action="store_true", help="Warp every band lazily in strips of destination rows read straight from the assets, on threads within a memory budget; bypasses the asset cache and warp plans")
+    parser.add_argument("--lazy-strip-rows", type=int, default=1024, help="Destination rows per strip in lazy mode; a multiple of --zarr-chunk-size avoids rewriting Zarr chunks")
+    parser.add_argument("--lazy-memory-mb", type=float, default=1024, help="Memory the strips in flight may use in lazy mode, in megabytes; caps the number of threads")
+    parser.add_argument("--precheck-min-water-fraction", type=float, default=None, help="Smallest fraction of clear water along the coast, read from a coarse overview of the SCL asset, for a tile's bands to be fetched; no pre-check if unset")
+    parser.add_argument("--precheck-overview-level", type=int, default=2, help="Overview level of the SCL asset read by the pre-check; level 2 of a full tile is 687 pixels wide")
+    parser.add_argument("--precheck-buffer-m", type=float, default=1000, help="Width in metres of the coastal area around the land of the SCL in which the water fraction is measured")
+    parser.add_argument("--precheck-action", type=str, choices=["skip", "defer"], default="skip", help="Drop the tiles rejected by the pre-check, or process them unchecked after all the others")
+    parser.add_argument("--precheck-manifest", type=str, default=None, help="JSON lines file the tiles rejected by the pre-check are appended to, with their reason and SCL fractions; tiles already in it are not checked again")
     args = parser.parse_args()
-    main(args.bucket, args.tiles_file, args.s3_folder_name)
\ No newline at end of file
+    if args.lazy and args.pipeline:
+        # Lazy mode reads strips while they are warped, leaving no separate fetch stage to overlap
+        parser.error("--lazy cannot be combined with --pipeline")
+    main(args.bucket, args.tiles_file, args.s3_folder_name, args.fetch_workers, args.pipeline, args.queue_size, args.workers, args.journal, args.max_attempts, args.stac_cache_dir, args.stac_cache_ttl_hours, args.metrics_file, args.metrics_port, args.eta_window, args.asset_cache_dir, args.asset_cache_max_gb, args.warp_cache_dir, args.warp_plan_mb, args.output_format, args.zarr_chunk_size, args.zarr_compressor, args.lazy, args.lazy_strip_rows, args.lazy_memory_mb, args.precheck_min_water_fraction, args.precheck_overview_level, args.precheck_buffer_m, args.precheck_action, args.precheck_manifest)
\ No newline at end of file
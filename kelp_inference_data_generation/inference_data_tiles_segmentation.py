@@ -1,5 +1,5 @@
 import geopandas as gpd
-from shapely.geometry import Point
+from shapely.geometry import Point, shape
 import matplotlib.pyplot as plt
 from geopandas import GeoSeries
 import os
@@ -11,6 +11,14 @@ import math
 import glob
 from datetime import datetime
 import argparse
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from stac_cache import cached_catalog
+from region_search import search_region_items, assign_points
+from point_coverage import PointCoverageIndex
+from mgrs_index import group_by_nearby_tiles, search_tile_items
+from table_io import TABLE_FORMATS, read_table, table_path, write_table
 
 def calculate_bbox(lon, lat, shift_meters=30):
     """
@@ -55,7 +63,7 @@ def calculate_bbox(lon, lat, shift_meters=30):
 
     return bbox
 
-def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, date_range):
+def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, date_range, coverage=None, output_format='csv'):
     """
     Process a single data point to find and save Sentinel-2 imagery data within the bounding box.
 
@@ -66,6 +74,9 @@ def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, d
         directory (str): Directory to save the output CSV files.
         cloud_threshold (float): Cloud cover threshold to filter the imagery.
         date_range (str): Time range to query Sentinel-2 imagery.
+        coverage (PointCoverageIndex, optional): Index over the rows of data_kelp_temp; used to find the
+            points inside the selected item and to mark them covered instead of scanning the whole frame.
+        output_format (str): 'csv' or 'parquet'.
     """
     # Extract latitude and longitude of the point at row 'rowNum'
     lat = data_kelp_temp.iloc[rowNum]["Latitude"]
@@ -83,6 +94,8 @@ def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, d
     if len(items.to_dict()['features']) == 0:
         print("No features found.")
         data_kelp_temp.loc[rowNum, 'processed_flag'] = 1
+        if coverage is not None:
+            coverage.mark_covered([rowNum])
         return
 
     # Convert the search results to a GeoDataFrame
@@ -113,10 +126,15 @@ def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, d
     min_lon, min_lat, max_lon, max_lat = selected_item.bbox
 
     # Filter the kelp data to include only points within the selected bounding box
-    filtered_kelp_data = data_kelp_temp[(data_kelp_temp['Latitude'] >= min_lat) &
-                                   (data_kelp_temp['Latitude'] <= max_lat) &
-                                   (data_kelp_temp['Longitude'] >= min_lon) &
-                                   (data_kelp_temp['Longitude'] <= max_lon)].copy()
+    if coverage is not None:
+        rows = coverage.query_bbox(min_lon, min_lat, max_lon, max_lat)
+        filtered_kelp_data = data_kelp_temp.iloc[rows].copy()
+        coverage.mark_covered(rows)
+    else:
+        filtered_kelp_data = data_kelp_temp[(data_kelp_temp['Latitude'] >= min_lat) &
+                                       (data_kelp_temp['Latitude'] <= max_lat) &
+                                       (data_kelp_temp['Longitude'] >= min_lon) &
+                                       (data_kelp_temp['Longitude'] <= max_lon)].copy()
 
     print(filtered_kelp_data.shape)
 
@@ -129,30 +147,111 @@ def process_point(catalog, data_kelp_temp, rowNum, directory, cloud_threshold, d
     filtered_kelp_data['miny'] = miny
     filtered_kelp_data['maxy'] = maxy
 
-    # Construct the file path for the CSV file
-    file_path = f"{directory}/{selected_item.id}.csv"
+    # Construct the file path for the CSV or Parquet file
+    file_path = table_path(f"{directory}/{selected_item.id}", output_format)
 
-    filtered_kelp_data.to_csv(file_path, index=False)
+    write_table(filtered_kelp_data, file_path)
 
     # Update the processed flag in the original dataset
     data_kelp_temp.loc[filtered_kelp_data.index, 'processed_flag'] = 1
 
-def main(data_kelp_path, date_range, csv_dir):
+def search_points_by_tile(catalog, lons, lats, date_range, region_degrees=5.0):
+    """
+    Collect the candidate items of a set of points with one STAC search per Sentinel-2 tile.
+
+    The points are grouped by the MGRS tiles that can overlap their buffered box, computed locally, so
+    the number of searches is the number of distinct tiles rather than of points, and the items of
+    neighbouring tiles a per-point search would return are found too. Points outside the MGRS
+    latitudes fall back to the per-region searches.
+
+    Args:
+        catalog (sentinel instance): API
+        lons (numpy.ndarray): Longitudes of the points.
+        lats (numpy.ndarray): Latitudes of the points.
+        date_range (str): Time range to query Sentinel-2 imagery.
+        region_degrees (float): Side of the search regions of the fallback searches in degrees.
+
+    Returns:
+        list: Unique pystac.Item objects.
+    """
+    groups = group_by_nearby_tiles(lons, lats)
+    untiled = groups.pop("", None)
+    print(f"Points grouped into {len(groups)} Sentinel-2 tiles")
+
+    items = search_tile_items(catalog, groups.keys(), date_range)
+    if untiled is not None:
+        known = {item.id for item in items}
+        items += [item for item in search_region_items(catalog, lons[untiled], lats[untiled], date_range, region_degrees) if item.id not in known]
+    return items
+
+def process_points_batched(catalog, data_kelp, directory, date_range, region_degrees=5.0, output_format='csv', mgrs_grouping=False):
+    """
+    Assign all points to Sentinel-2 items with one STAC search per region, or per Sentinel-2 tile, and
+    save the same per-asset CSV files as process_point.
+
+    Args:
+        catalog (sentinel instance): API
+        data_kelp (DataFrame): DataFrame containing the kelp coordinates.
+        directory (str): Directory to save the output CSV files.
+        date_range (str): Time range to query Sentinel-2 imagery.
+        region_degrees (float): Side of the search regions in degrees.
+        output_format (str): 'csv' or 'parquet'.
+        mgrs_grouping (bool): Search once per MGRS tile near the points instead of once per region.
+    """
+    lons = data_kelp['Longitude'].to_numpy(dtype=float)
+    lats = data_kelp['Latitude'].to_numpy(dtype=float)
+    if mgrs_grouping:
+        items = search_points_by_tile(catalog, lons, lats, date_range, region_degrees)
+    else:
+        items = search_region_items(catalog, lons, lats, date_range, region_degrees)
+    print(f"Candidate items: {len(items)}")
+
+    for selected_item, rows in assign_points(lons, lats, items):
+        if selected_item is None:
+            print(f"No features found for point at row {rows[0]}.")
+            data_kelp.iloc[rows, data_kelp.columns.get_loc('processed_flag')] = 1
+            continue
+
+        minx, miny, maxx, maxy = shape(selected_item.geometry).bounds
+
+        filtered_kelp_data = data_kelp.iloc[rows].copy()
+        print(filtered_kelp_data.shape)
+
+        filtered_kelp_data['processed_flag'] = 1
+        filtered_kelp_data['asset'] = selected_item.id
+        filtered_kelp_data['cloud_cover'] = selected_item.properties['eo:cloud_cover']
+        filtered_kelp_data['minx'] = minx
+        filtered_kelp_data['maxx'] = maxx
+        filtered_kelp_data['miny'] = miny
+        filtered_kelp_data['maxy'] = maxy
+
+        write_table(filtered_kelp_data, table_path(f"{directory}/{selected_item.id}", output_format))
+        data_kelp.iloc[rows, data_kelp.columns.get_loc('processed_flag')] = 1
+
+def main(data_kelp_path, date_range, csv_dir, stac_cache_dir=None, stac_cache_ttl_hours=168, batched_search=False, region_degrees=5.0, output_format='csv', mgrs_grouping=False):
     """
     Main function to process kelp data and extract Sentinel-2 imagery.
 
     Args:
-        data_kelp_path (str): Path to the CSV file containing kelp data points.
+        data_kelp_path (str): Path to the CSV or Parquet file containing kelp data points.
         date_range (str): Time range for querying Sentinel-2 imagery.
         csv_dir (str): Directory to save the output CSV files.
+        stac_cache_dir (str, optional): Directory of the on-disk STAC search cache; searches are not cached if None.
+        stac_cache_ttl_hours (float): Age after which cached searches are refreshed; 0 keeps them forever.
+        batched_search (bool): Search once per region and assign points with a spatial index instead of searching per point.
+        region_degrees (float): Side of the search regions in degrees when batched_search is set.
+        output_format (str): Format of the saved tiles tables, 'csv' or 'parquet'.
+        mgrs_grouping (bool): Group the points by the locally computed Sentinel-2 (MGRS) tiles that can
+            overlap their box and search once per tile; implies batched_search.
     """
     catalog = pystac_client.Client.open(
         "https://planetarycomputer.microsoft.com/api/stac/v1",
         modifier=planetary_computer.sign_inplace,
     )
+    catalog = cached_catalog(catalog, stac_cache_dir, stac_cache_ttl_hours)
 
-    # Load kelp data from CSV file
-    data_kelp = pd.read_csv(data_kelp_path)
+    # Load kelp data from a CSV or Parquet file
+    data_kelp = read_table(data_kelp_path)
     print(data_kelp.shape)
 
     # Define the bounding box to filter out unnecessary points
@@ -174,19 +273,28 @@ def main(data_kelp_path, date_range, csv_dir):
 
     os.makedirs(csv_dir, exist_ok=True)
 
+    if batched_search or mgrs_grouping:
+        process_points_batched(catalog, data_kelp, csv_dir, date_range, region_degrees, output_format, mgrs_grouping)
+        print(f"{csv_dir} All points processed.")
+        return
+
+    # Track the uncovered points incrementally instead of rescanning the frame for every tile
+    coverage = PointCoverageIndex(data_kelp['Longitude'], data_kelp['Latitude'])
+
     # Process each point in the data
     while True:
-        # Find indices of unprocessed rows
-        unprocessed_indices = data_kelp[data_kelp['processed_flag'] == 0].index
+        # Find the first unprocessed row
+        rowNum = coverage.next_uncovered()
         # Break the loop if all points are processed
-        if len(unprocessed_indices) == 0:
+        if rowNum is None:
             break
 
         # Process the first unprocessed point
-        rowNum = unprocessed_indices[0]
-        process_point(catalog, data_kelp, rowNum, csv_dir, 100, date_range)
+        process_point(catalog, data_kelp, rowNum, csv_dir, 100, date_range, coverage, output_format)
         # Update the processed flag for the current point
         data_kelp.loc[rowNum, 'processed_flag'] = 1
+        coverage.mark_covered([rowNum])
+        print(f"Points left: {coverage.remaining}")
 
     print(f"{csv_dir} All points processed.")
 
@@ -195,6 +303,12 @@ if __name__ == "__main__":
     parser.add_argument('--data_kelp', type=str, required=True, help="Path to the CSV file containing kelp data points.")
     parser.add_argument('--date_range', type=str, required=True, help="Time range for querying Sentinel-2 imagery.")
     parser.add_argument('--csv_dir', type=str, required=True, help="Directory to save the output CSV files.")
+    parser.add_argument('--stac_cache_dir', type=str, default=None, help="Directory of an on-disk cache of STAC search results, reused across runs.")
+    parser.add_argument('--stac_cache_ttl_hours', type=float, default=168, help="Age in hours after which cached STAC searches are refreshed; 0 keeps them forever.")
+    parser.add_argument('--batched_search', action='store_true', help="Search once per region and assign points to items with a spatial index instead of one search per point.")
+    parser.add_argument('--region_degrees', type=float, default=5.0, help="Side of the search regions in degrees in batched mode.")
+    parser.add_argument('--output_format', type=str, choices=TABLE_FORMATS, default='csv', help="Format of the saved tiles tables.")
+    parser.add_argument('--mgrs_grouping', action='store_true', help="Group points by the Sentinel-2 MGRS tiles that can overlap their 300 m box, computed offline, and search once per tile (implies --batched_search).")
     
     args = parser.parse_args()
-    main(args.data_kelp, args.date_range, args.csv_dir)
+    main(args.data_kelp, args.date_range, args.csv_dir, args.stac_cache_dir, args.stac_cache_ttl_hours, args.batched_search, args.region_degrees, args.output_format, args.mgrs_grouping)
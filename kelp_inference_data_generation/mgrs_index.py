@@ -0,0 +1,227 @@
+import numpy as np
+from pyproj import Transformer
+
+# MGRS latitude bands of 8 degrees from 80S, the last one (X) stretching to 84N
+LATITUDE_BANDS = np.array(list("CDEFGHJKLMNPQRSTUVWX"))
+
+# 100 km square column letters repeat every three zones, row letters every two zones
+COLUMN_LETTERS = ("STUVWXYZ", "ABCDEFGH", "JKLMNPQR")
+ROW_LETTERS = "ABCDEFGHJKLMNPQRSTUV"
+
+# Sentinel-2 tiles extend their 100 km grid square by this much to the east and south
+TILE_OVERLAP_M = 9800
+
+# Samples per edge of a point's box when looking for the tiles overlapping it
+BOX_EDGE_SAMPLES = 8
+
+def utm_zones(lons, lats):
+    """
+    Compute the UTM zone of each point, with the MGRS exceptions around Norway and Svalbard.
+
+    Args:
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+
+    Returns:
+        numpy.ndarray: Zone numbers from 1 to 60.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    # Longitude 180 belongs to zone 60, not to a zone 61
+    zones = np.clip(np.floor((lons + 180) / 6).astype(np.int64) + 1, 1, 60)
+
+    # Zone 32 is widened over southwestern Norway (band V)
+    norway = (lats >= 56) & (lats < 64) & (lons >= 3) & (lons < 12)
+    zones[norway] = 32
+
+    # Only the odd zones 31 to 37 are used around Svalbard (band X)
+    svalbard = (lats >= 72) & (lats <= 84) & (lons >= 0) & (lons < 42)
+    for zone, west, east in ((31, 0, 9), (33, 9, 21), (35, 21, 33), (37, 33, 42)):
+        zones[svalbard & (lons >= west) & (lons < east)] = zone
+
+    return zones
+
+def latitude_bands(lats):
+    """
+    Compute the MGRS latitude band letter of each point.
+
+    Args:
+        lats (array-like): Latitudes of the points, between -80 and 84.
+
+    Returns:
+        numpy.ndarray: Band letters from 'C' to 'X'.
+    """
+    lats = np.asarray(lats, dtype=float)
+    bands = np.clip(np.floor((lats + 80) / 8).astype(np.int64), 0, len(LATITUDE_BANDS) - 1)
+    return LATITUDE_BANDS[bands]
+
+def zone_squares(lons, lats, zones, clip=False):
+    """
+    Compute the MGRS 100 km grid square of each point in a given UTM zone, which need not be its own.
+
+    Args:
+        lons (numpy.ndarray): Longitudes of the points.
+        lats (numpy.ndarray): Latitudes of the points, between -80 and 84.
+        zones (numpy.ndarray): Zone number to project each point to.
+        clip (bool): Clamp the eastings to the squares 1 to 8 of the zone; otherwise points falling
+            outside them get an empty string.
+
+    Returns:
+        numpy.ndarray: Tile IDs such as '10SEG'.
+    """
+    south = lats < 0
+    eastings = np.empty(len(lons))
+    northings = np.empty(len(lons))
+    for zone, is_south in set(zip(zones.tolist(), south.tolist())):
+        members = (zones == zone) & (south == is_south)
+        epsg = (32700 if is_south else 32600) + zone
+        transformer = Transformer.from_crs("EPSG:4326", f"EPSG:{epsg}", always_xy=True)
+        eastings[members], northings[members] = transformer.transform(lons[members], lats[members])
+
+    # Eastings of a zone span the squares 1 to 8 (100 to 900 km); northings repeat every 2000 km
+    columns = np.floor(eastings / 100000).astype(np.int64)
+    inside = (columns >= 1) & (columns <= 8)
+    columns = np.clip(columns, 1, 8) - 1
+    row_offsets = np.where(zones % 2 == 0, 5, 0)
+    row_indices = (np.floor(northings / 100000).astype(np.int64) + row_offsets) % len(ROW_LETTERS)
+
+    column_letters = np.array([COLUMN_LETTERS[zone % 3][column] for zone, column in zip(zones.tolist(), columns.tolist())], dtype="<U1")
+    row_letters = np.array(list(ROW_LETTERS))[row_indices]
+
+    tiles = np.char.add(
+        np.char.add(np.char.zfill(zones.astype(str), 2), latitude_bands(lats)),
+        np.char.add(column_letters, row_letters),
+    ).astype("<U5")
+    if not clip:
+        tiles[~inside] = ""
+    return tiles
+
+def mgrs_tiles(lons, lats):
+    """
+    Compute the MGRS 100 km grid square, i.e. the Sentinel-2 tile ID, of each point, without any network call.
+
+    Points are projected to UTM once per zone and hemisphere, and the square letters are derived from
+    the easting and northing with the standard (AA) MGRS lettering used by the Sentinel-2 tiling grid.
+    A Sentinel-2 tile extends its grid square by 9.8 km to the east and south, so the tile of a point's
+    square always covers the point.
+
+    Args:
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+
+    Returns:
+        numpy.ndarray: Tile IDs such as '10SEG'; an empty string for points outside the UTM latitudes
+        (south of 80S, north of 84N) or without valid coordinates.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    tiles = np.full(len(lons), "", dtype="<U5")
+
+    valid = np.isfinite(lons) & np.isfinite(lats) & (lats >= -80) & (lats <= 84) & (lons >= -180) & (lons <= 180)
+    if not valid.any():
+        return tiles
+
+    rows = np.flatnonzero(valid)
+    tiles[rows] = zone_squares(lons[rows], lats[rows], utm_zones(lons[rows], lats[rows]), clip=True)
+    return tiles
+
+def group_by_nearby_tiles(lons, lats, shift_meters=300):
+    """
+    Group points by every MGRS tile whose Sentinel-2 footprint can overlap their buffered box.
+
+    A per-point search also returns the items of neighbouring tiles that overlap the point's box:
+    Sentinel-2 tiles extend their grid square by 9.8 km to the east and south, and the tiles along a
+    zone boundary reach into the neighbouring zone. So points along the edges of the box, widened by
+    the 9.8 km overlap to the west and north, are projected into the point's zone and the two zones
+    next to it, and the point joins the group of its own tile and of every square they fall in. A
+    point can be in several groups.
+
+    Args:
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+        shift_meters (float): Buffer around each point in meters, as in the per-point searches.
+
+    Returns:
+        dict: Row numbers of the points, in ascending order, keyed by tile ID. Points without a tile
+        are grouped under an empty string.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    own = mgrs_tiles(lons, lats)
+    groups = {}
+    untiled = np.flatnonzero(own == "")
+    if len(untiled):
+        groups[""] = untiled
+
+    rows = np.flatnonzero(own != "")
+    if not len(rows):
+        return groups
+
+    # Same degree conversion as the per-point bounding boxes
+    lat_shift = shift_meters / 111000
+    lat_reach = (shift_meters + TILE_OVERLAP_M) / 111000
+    scale = 111000 * np.cos(np.radians(lats[rows]))
+    lon_shift = shift_meters / scale
+    lon_reach = (shift_meters + TILE_OVERLAP_M) / scale
+
+    # Samples along the edges of the widened box; a 100 km square overlapping a box this small
+    # crosses its edges, so only a sliver at a box corner can fall between two samples
+    west, east = lons[rows] - lon_reach, lons[rows] + lon_shift
+    south, north = lats[rows] - lat_shift, lats[rows] + lat_reach
+    steps = np.linspace(0, 1, BOX_EDGE_SAMPLES + 1)[:-1]
+    sample_lons, sample_lats = [], []
+    for step in steps:
+        sample_lons += [west + step * (east - west), east, east - step * (east - west), west]
+        sample_lats += [south, south + step * (north - south), north, north - step * (north - south)]
+    sample_lons = (np.concatenate(sample_lons) + 180) % 360 - 180
+    sample_lats = np.clip(np.concatenate(sample_lats), -80, 84)
+    sample_rows = np.tile(rows, 4 * len(steps))
+
+    zones = utm_zones(lons[rows], lats[rows])
+    tiles, tile_rows = [], []
+    for zone_offset in (-1, 0, 1):
+        sample_zones = (np.tile(zones, 4 * len(steps)) - 1 + zone_offset) % 60 + 1
+        tiles.append(zone_squares(sample_lons, sample_lats, sample_zones))
+        tile_rows.append(sample_rows)
+    tiles = np.concatenate(tiles + [own[rows]])
+    tile_rows = np.concatenate(tile_rows + [rows])
+    found = tiles != ""
+    tiles, tile_rows = tiles[found], tile_rows[found]
+
+    # Sort by tile then row, and drop the pairs found by several samples
+    order = np.lexsort((tile_rows, tiles))
+    tiles, tile_rows = tiles[order], tile_rows[order]
+    first = np.r_[True, (tiles[1:] != tiles[:-1]) | (tile_rows[1:] != tile_rows[:-1])]
+    tiles, tile_rows = tiles[first], tile_rows[first]
+    starts = np.flatnonzero(np.r_[True, tiles[1:] != tiles[:-1]])
+    ends = np.r_[starts[1:], len(tiles)]
+    groups.update({str(tiles[start]): tile_rows[start:end] for start, end in zip(starts, ends)})
+    return groups
+
+def search_tile_items(catalog, tile_ids, date_range, collections=("sentinel-2-l2a",)):
+    """
+    Collect the items of a set of Sentinel-2 tiles with one STAC search per tile.
+
+    Args:
+        catalog (pystac_client.Client): STAC catalog.
+        tile_ids (iterable): MGRS tile IDs, e.g. from ``group_by_nearby_tiles``.
+        date_range (str): Time range of the search.
+        collections (tuple): Collections to search.
+
+    Returns:
+        list: Unique pystac.Item objects found for all tiles.
+    """
+    items = {}
+    tile_ids = sorted(tile_ids)
+    for i, tile_id in enumerate(tile_ids):
+        found = catalog.search(
+            collections=list(collections),
+            datetime=date_range,
+            query={"s2:mgrs_tile": {"eq": tile_id}},
+        ).item_collection()
+        print(f"Tile {i + 1}/{len(tile_ids)} {tile_id}: {len(found)} items")
+        for item in found:
+            items.setdefault(item.id, item)
+
+    return list(items.values())
@@ -6,17 +6,26 @@ DEFAULT_OUTPUT_CSV="world_coastal_tiles_tiles_only/coastal_tiles_world.csv"
 
 # Print usage instructions
 usage() {
-    echo "Usage: $0 [--folder-path FOLDER_PATH] [--output-csv OUTPUT_CSV]"
+    echo "Usage: $0 [--folder-path FOLDER_PATH] [--output-csv OUTPUT_CSV] [--streaming [--workers N] [--max-keys N] [--spill-dir DIR]]"
     echo "  --folder-path FOLDER_PATH  Path to the folder containing the input CSV files (default: $DEFAULT_FOLDER_PATH)"
     echo "  --output-csv OUTPUT_CSV    Path to the output CSV file (default: $DEFAULT_OUTPUT_CSV)"
+    echo "  --streaming                Read the files in parallel and drop duplicates on the fly, in bounded memory"
+    echo "  --workers N                Number of reading threads in streaming mode (default: 4)"
+    echo "  --max-keys N               Unique tiles kept in memory before spilling to disk (default: 20000000)"
+    echo "  --spill-dir DIR            Directory of the spill files (default: system temporary directory)"
     exit 1
 }
 
+# Streaming flags, kept in an array so that paths with spaces stay one argument
+STREAMING=()
+
 # Parse command-line arguments
 while [[ "$#" -gt 0 ]]; do
     case $1 in
         --folder-path) FOLDER_PATH="$2"; shift ;;
         --output-csv) OUTPUT_CSV="$2"; shift ;;
+        --streaming) STREAMING+=(--streaming) ;;
+        --workers|--max-keys|--spill-dir) STREAMING+=("$1" "$2"); shift ;;
         *) usage ;;
     esac
     shift
@@ -31,4 +40,4 @@ echo "Using folder path: $FOLDER_PATH"
 echo "Using output CSV path: $OUTPUT_CSV"
 
 # Run the Python script with the specified or default arguments
-python3 coast_points_tiles_extraction.py --folder-path "$FOLDER_PATH" --output-csv "$OUTPUT_CSV"
+python3 coast_points_tiles_extraction.py --folder-path "$FOLDER_PATH" --output-csv "$OUTPUT_CSV" "${STREAMING[@]}"
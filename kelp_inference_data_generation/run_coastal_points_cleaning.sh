@@ -2,10 +2,14 @@
 
 # This script processes coastal points and Sentinel tile coordinates.
 # Usage: ./run_process_coordinates.sh --data-coast-points "path/to/coastline-coordinate-data.csv" --folder-path "path/to/folder/with/tile/csvs"
+# Add --streaming [--workers N] [--max-keys N] [--spill-dir DIR] to deduplicate in bounded memory.
 
 # Define default values for the arguments
 DATA_COAST_POINTS="coastal_points_extraction_from_geojson/coastline-coordinate-data.csv"
 FOLDER_PATH="world_monthly_inference_tiles/coastal_tiles_world_2024_06"
+OUTPUT="unique_coords_tiles.csv"
+# Streaming flags, kept in an array so that paths with spaces stay one argument
+STREAMING=()
 
 # Parse command-line arguments
 while [[ $# -gt 0 ]]; do
@@ -20,6 +24,30 @@ while [[ $# -gt 0 ]]; do
       shift
       shift
       ;;
+    --output)
+      OUTPUT="$2"
+      shift
+      shift
+      ;;
+    --streaming)
+      STREAMING+=(--streaming)
+      shift
+      ;;
+    --workers)
+      STREAMING+=(--workers "$2")
+      shift
+      shift
+      ;;
+    --max-keys)
+      STREAMING+=(--max_keys "$2")
+      shift
+      shift
+      ;;
+    --spill-dir)
+      STREAMING+=(--spill_dir "$2")
+      shift
+      shift
+      ;;
     *)
       shift
       ;;
@@ -27,4 +55,4 @@ while [[ $# -gt 0 ]]; do
 done
 
 # Run the Python script with the specified arguments
-python3 coastal_points_cleaning.py --data_coast_points "$DATA_COAST_POINTS" --folder_path "$FOLDER_PATH"
+python3 coastal_points_cleaning.py --data_coast_points "$DATA_COAST_POINTS" --folder_path "$FOLDER_PATH" --output "$OUTPUT" "${STREAMING[@]}"
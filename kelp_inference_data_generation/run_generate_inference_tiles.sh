@@ -4,9 +4,19 @@
 DEFAULT_BUCKET_NAME="kelpwatch2"
 DEFAULT_TILES_FILE="world_coastal_tiles_tiles_only/coastal_tiles_world.csv"
 DEFAULT_S3_FOLDER_NAME="inference-data/default_test"
+DEFAULT_FETCH_WORKERS=1
+PIPELINE=""
+SCHEDULER=()
+STAC_CACHE=()
+METRICS=()
+ASSET_CACHE=()
+WARP_CACHE=()
+OUTPUT_FORMAT=""
+LAZY=""
+PRECHECK=""
 
 # Parse command-line arguments
-while getopts ":b:t:f:" opt; do
+while getopts ":b:t:f:w:pj:n:c:m:P:a:g:zl:s:d" opt; do
     case ${opt} in
         b )
             BUCKET_NAME=$OPTARG
@@ -17,24 +27,75 @@ while getopts ":b:t:f:" opt; do
         f )
             S3_FOLDER_NAME=$OPTARG
             ;;
+        w )
+            FETCH_WORKERS=$OPTARG
+            ;;
+        p )
+            PIPELINE="--pipeline"
+            ;;
+        j )
+            SCHEDULER+=(--journal "$OPTARG")
+            ;;
+        n )
+            SCHEDULER+=(--workers "$OPTARG")
+            ;;
+        c )
+            STAC_CACHE+=(--stac-cache-dir "$OPTARG")
+            ;;
+        m )
+            METRICS+=(--metrics-file "$OPTARG")
+            ;;
+        P )
+            METRICS+=(--metrics-port "$OPTARG")
+            ;;
+        a )
+            ASSET_CACHE+=(--asset-cache-dir "$OPTARG")
+            ;;
+        g )
+            WARP_CACHE+=(--warp-cache-dir "$OPTARG")
+            ;;
+        z )
+            OUTPUT_FORMAT="--output-format zarr"
+            ;;
+        l )
+            LAZY="--lazy --lazy-memory-mb $OPTARG"
+            ;;
+        s )
+            PRECHECK="$PRECHECK --precheck-min-water-fraction $OPTARG --precheck-manifest precheck_manifest.jsonl"
+            ;;
+        d )
+            PRECHECK="$PRECHECK --precheck-action defer"
+            ;;
         \? )
-            echo "Usage: $0 [-b bucket-name] [-t tiles-file] [-f s3-folder-name]"
+            echo "Usage: $0 [-b bucket-name] [-t tiles-file] [-f s3-folder-name] [-w fetch-workers] [-p] [-j journal-file -n worker-processes] [-c stac-cache-dir] [-m metrics-file] [-P metrics-port] [-a asset-cache-dir] [-g warp-cache-dir] [-z] [-l lazy-memory-mb] [-s min-water-fraction [-d]]"
             exit 1
             ;;
     esac
 done
 
+# Lazy mode warps in strips on its own threads and has no pipelined counterpart
+if [ -n "$PIPELINE" ] && [ -n "$LAZY" ]; then
+    echo "-l cannot be combined with -p"
+    exit 1
+fi
+
 # If any argument is missing, use the default value
 BUCKET_NAME=${BUCKET_NAME:-$DEFAULT_BUCKET_NAME}
 TILES_FILE=${TILES_FILE:-$DEFAULT_TILES_FILE}
 S3_FOLDER_NAME=${S3_FOLDER_NAME:-$DEFAULT_S3_FOLDER_NAME}
+FETCH_WORKERS=${FETCH_WORKERS:-$DEFAULT_FETCH_WORKERS}
 
 # Run the Python script with the provided or default arguments
 while true; do
-    python3 generate_inference_tiles.py --bucket "$BUCKET_NAME" --tiles-file "$TILES_FILE" --s3-folder-name "$S3_FOLDER_NAME"
-    if [ $? -eq 0 ]; then
+    python3 generate_inference_tiles.py --bucket "$BUCKET_NAME" --tiles-file "$TILES_FILE" --s3-folder-name "$S3_FOLDER_NAME" --fetch-workers "$FETCH_WORKERS" $PIPELINE "${SCHEDULER[@]}" "${STAC_CACHE[@]}" "${METRICS[@]}" "${ASSET_CACHE[@]}" "${WARP_CACHE[@]}" $OUTPUT_FORMAT $LAZY $PRECHECK
+    status=$?
+    if [ $status -eq 0 ]; then
         break
     fi
+    # Status 2 is a command-line error, which a restart cannot fix
+    if [ $status -eq 2 ]; then
+        exit 2
+    fi
     echo "Script crashed. Restarting..."
     sleep 5
 done
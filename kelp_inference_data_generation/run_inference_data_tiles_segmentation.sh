@@ -7,15 +7,24 @@ DEFAULT_CSV_DIR="world_monthly_inference_tiles_new"
 
 # Function to display help message
 usage() {
-    echo "Usage: $0 [--data-kelp <path>] [--date-range <range>] [--csv-dir <directory>]"
+    echo "Usage: $0 [--data-kelp <path>] [--date-range <range>] [--csv-dir <directory>] [--stac-cache-dir <directory>] [--stac-cache-ttl-hours <hours>] [--batched-search [--region-degrees <degrees>]] [--mgrs-grouping] [--output-format <csv|parquet>]"
     echo
     echo "Options:"
     echo "  --data-kelp <path>      Path to the CSV file containing kelp data points (default: $DEFAULT_DATA_KELP)."
     echo "  --date-range <range>    Time range for querying Sentinel-2 imagery (default: $DEFAULT_DATE_RANGE)."
     echo "  --csv-dir <directory>   Directory to save the output CSV files (default: $DEFAULT_CSV_DIR)."
+    echo "  --stac-cache-dir <directory>     Directory of an on-disk cache of STAC search results (default: none)."
+    echo "  --stac-cache-ttl-hours <hours>   Age after which cached searches are refreshed, 0 keeps them forever (default: 168)."
+    echo "  --batched-search                 Search once per region and assign points with a spatial index."
+    echo "  --region-degrees <degrees>       Side of the search regions in batched mode (default: 5)."
+    echo "  --mgrs-grouping                  Group points by Sentinel-2 tile offline and search once per tile."
+    echo "  --output-format <csv|parquet>    Format of the per-asset tables (default: csv)."
     exit 1
 }
 
+# STAC cache flags, kept in an array so that paths with spaces stay one argument
+STAC_CACHE=()
+
 # Parse command-line arguments
 while [[ $# -gt 0 ]]; do
     case $1 in
@@ -31,6 +40,30 @@ while [[ $# -gt 0 ]]; do
             CSV_DIR="$2"
             shift 2
             ;;
+        --stac-cache-dir)
+            STAC_CACHE+=(--stac_cache_dir "$2")
+            shift 2
+            ;;
+        --stac-cache-ttl-hours)
+            STAC_CACHE+=(--stac_cache_ttl_hours "$2")
+            shift 2
+            ;;
+        --batched-search)
+            BATCHED="$BATCHED --batched_search"
+            shift
+            ;;
+        --mgrs-grouping)
+            BATCHED="$BATCHED --mgrs_grouping"
+            shift
+            ;;
+        --output-format)
+            BATCHED="$BATCHED --output_format $2"
+            shift 2
+            ;;
+        --region-degrees)
+            BATCHED="$BATCHED --region_degrees $2"
+            shift 2
+            ;;
         *)
             usage
             ;;
@@ -52,4 +85,6 @@ echo "  CSV Directory: $CSV_DIR"
 python3 inference_data_tiles_segmentation.py \
     --data_kelp "$DATA_KELP" \
     --date_range "$DATE_RANGE" \
-    --csv_dir "$CSV_DIR"
+    --csv_dir "$CSV_DIR" \
+    "${STAC_CACHE[@]}" \
+    $BATCHED
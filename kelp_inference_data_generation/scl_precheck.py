@@ -0,0 +1,189 @@
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+# Sentinel-2 L2A scene classification (SCL) codes
+SCL_NO_DATA = 0
+SCL_WATER = 6
+SCL_LAND = (4, 5)  # vegetation, not vegetated
+SCL_CLOUD = (3, 8, 9, 10)  # cloud shadow, medium and high probability cloud, thin cirrus
+# The remaining codes (saturated or defective, dark area, unclassified, snow) count as unusable
+
+SCL_ASSET = "SCL"
+
+class TileRejected(Exception):
+    """
+    Raised when the coarse SCL pre-check finds too little clear water along the coast of a tile.
+
+    Args:
+        tile (str): ID of the Sentinel-2 item.
+        reason (str): 'cloud', 'land', 'no_data' or 'other', whichever class hides most of the coastal area.
+        stats (dict): Statistics of the pre-check, see ``coastal_water_stats``.
+    """
+
+    def __init__(self, tile, reason, stats):
+        super().__init__(f"{tile}: coastal water fraction {stats['coastal_water_fraction']:.3f} below {stats['min_water_fraction']}, mostly {reason}")
+        self.tile = tile
+        self.reason = reason
+        self.stats = stats
+
+def read_scl_overview(href, overview_level=2):
+    """
+    Read an SCL asset at one of its overview levels, downloading only that overview of a COG.
+
+    Args:
+        href (str): URL or path of the SCL asset.
+        overview_level (int): Overview to read, 0 being the first (half resolution) as in ``open_band``;
+            the coarsest overview is read if the asset has fewer. The 20 m SCL of a full tile is 687
+            pixels wide at level 2.
+
+    Returns:
+        tuple: (2-D uint8 array of SCL codes, pixel size in the units of the asset's CRS).
+    """
+    with rasterio.open(href) as src:
+        factors = src.overviews(1)
+        factor = factors[min(overview_level, len(factors) - 1)] if factors else 1
+        # Reading at an overview's size makes GDAL read that overview instead of the full resolution
+        shape = (max(src.height // factor, 1), max(src.width // factor, 1))
+        scl = src.read(1, out_shape=shape, resampling=Resampling.nearest)
+        pixel_size = abs(src.transform.a) * src.width / shape[1]
+    return scl, pixel_size
+
+def _near(mask, radius):
+    """
+    Pixels within radius pixels (in a square neighbourhood) of a True pixel of mask, from an integral image.
+    """
+    size = 2 * radius + 1
+    height, width = mask.shape
+    integral = np.pad(np.pad(mask, radius).astype(np.int32).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    counts = integral[size:size + height, size:size + width] - integral[:height, size:size + width] \
+        - integral[size:size + height, :width] + integral[:height, :width]
+    return counts > 0
+
+def coastal_water_stats(scl, pixel_size, coastal_buffer_m=1000):
+    """
+    Measure how much of the coastal area of a tile is clear water in its SCL.
+
+    The coastal area is every pixel within coastal_buffer_m of a land pixel, or the whole tile when no
+    land is visible. Its land pixels are left out, so the coastal water fraction is the share of the
+    sea along the coast, where kelp grows, that is neither cloud nor no data.
+
+    Args:
+        scl (numpy.ndarray): 2-D array of SCL codes.
+        pixel_size (float): Pixel size of scl in metres.
+        coastal_buffer_m (float): Width of the coastal area on the sea side of the land, in metres.
+
+    Returns:
+        dict: 'coastal_water_fraction', the fractions of the coastal area ('coastal_pixels' pixels) that
+        are 'cloud', 'land', 'no_data' and 'other', and the fractions of the whole tile that are
+        'tile_water' and 'tile_cloud'.
+    """
+    land = np.isin(scl, SCL_LAND)
+    coastal = _near(land, max(math.ceil(coastal_buffer_m / pixel_size), 1)) if land.any() else np.ones(scl.shape, dtype=bool)
+    classes = scl[coastal]
+    total = max(classes.size, 1)
+    counts = {
+        "water": int(np.count_nonzero(classes == SCL_WATER)),
+        "cloud": int(np.count_nonzero(np.isin(classes, SCL_CLOUD))),
+        "land": int(np.count_nonzero(np.isin(classes, SCL_LAND))),
+        "no_data": int(np.count_nonzero(classes == SCL_NO_DATA)),
+    }
+    counts["other"] = classes.size - sum(counts.values())
+    sea = classes.size - counts["land"]
+
+    return {
+        "coastal_water_fraction": counts["water"] / sea if sea else 0.0,
+        "coastal_pixels": int(classes.size),
+        **{name: counts[name] / total for name in ("cloud", "land", "no_data", "other")},
+        "tile_water": float(np.count_nonzero(scl == SCL_WATER) / max(scl.size, 1)),
+        "tile_cloud": float(np.count_nonzero(np.isin(scl, SCL_CLOUD)) / max(scl.size, 1)),
+    }
+
+def precheck_item(item, min_water_fraction, overview_level=2, coastal_buffer_m=1000):
+    """
+    Check from a coarse overview of its SCL asset that an item shows enough clear water along the coast
+    to be worth fetching its bands.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        min_water_fraction (float): Smallest accepted coastal water fraction, see ``coastal_water_stats``.
+        overview_level (int): Overview level of the SCL asset to read.
+        coastal_buffer_m (float): Width of the coastal area in metres.
+
+    Returns:
+        dict: Statistics of the pre-check, with the threshold under 'min_water_fraction'.
+
+    Raises:
+        TileRejected: When the coastal water fraction is below min_water_fraction.
+    """
+    scl, pixel_size = read_scl_overview(item.assets[SCL_ASSET].href, overview_level)
+    stats = coastal_water_stats(scl, pixel_size, coastal_buffer_m)
+    stats["min_water_fraction"] = min_water_fraction
+    if stats["coastal_water_fraction"] < min_water_fraction:
+        if stats["land"] == 1.0:
+            reason = "land"
+        else:
+            reason = max(("cloud", "no_data", "other"), key=lambda name: stats[name])
+        raise TileRejected(item.id, reason, stats)
+    return stats
+
+class RejectionManifest:
+    """
+    JSON lines file of the tiles rejected by the pre-check, with their reason and statistics.
+
+    Every entry is appended with a single write to a file opened in append mode, so the worker
+    processes of scheduler mode can share one manifest. Tiles are keyed by item ID, so a manifest can
+    be kept across runs: the entry written last for a tile wins.
+
+    Args:
+        path (str, optional): Path of the manifest; rejections are only printed if None.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, rejected, action):
+        """
+        Append a rejected tile to the manifest.
+
+        Args:
+            rejected (TileRejected): The rejection.
+            action (str): 'skip' or 'defer', what was done with the tile.
+        """
+        print(f"Pre-check rejected {rejected}, {action}")
+        if not self.path:
+            return
+        entry = {"tile": rejected.tile, "action": action, "reason": rejected.reason, "time": time.time(), **rejected.stats}
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(entry) + "\n").encode())
+            finally:
+                os.close(fd)
+
+    def entries(self):
+        """
+        Read the manifest.
+
+        Returns:
+            dict: Latest entry of every tile in the manifest, keyed by tile ID; empty if there is no file.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        entries = {}
+        with open(self.path) as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Line cut short by a crash
+                    continue
+                entries[entry["tile"]] = entry
+        return entries
@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from table_io import TableWriter, iter_tables
+
+class HashKeySet:
+    """
+    Compact set of 64-bit key hashes, stored as sorted numpy arrays at 8 bytes per key.
+
+    New hashes are kept in small sorted runs that are merged into the main array once they hold a
+    quarter of its size, so adding n keys costs O(n log n) overall.
+    """
+
+    def __init__(self):
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._runs = []
+        self._run_size = 0
+        self.size = 0
+
+    def contains(self, hashes):
+        """
+        Test which hashes are in the set.
+
+        Args:
+            hashes (numpy.ndarray): uint64 hashes.
+
+        Returns:
+            numpy.ndarray: Boolean mask, True for the hashes already in the set.
+        """
+        found = np.zeros(len(hashes), dtype=bool)
+        for keys in [self._keys] + self._runs:
+            if len(keys):
+                positions = np.minimum(np.searchsorted(keys, hashes), len(keys) - 1)
+                found |= keys[positions] == hashes
+        return found
+
+    def add(self, hashes):
+        """
+        Add hashes that are not in the set yet.
+
+        Args:
+            hashes (numpy.ndarray): Unique uint64 hashes, none of them already in the set.
+        """
+        if not len(hashes):
+            return
+        self._runs.append(np.sort(hashes))
+        self._run_size += len(hashes)
+        self.size += len(hashes)
+
+        if len(self._runs) > 16:
+            self._runs = [np.sort(np.concatenate(self._runs))]
+        if self._run_size > max(len(self._keys) // 4, 65536):
+            self._keys = np.sort(np.concatenate([self._keys] + self._runs))
+            self._runs = []
+            self._run_size = 0
+
+class StreamingDeduplicator:
+    """
+    Drop duplicate rows from a stream of DataFrame chunks, keeping the first occurrence of each key.
+
+    The keys of the rows already emitted are kept as 64-bit hashes, so rows are deduplicated on the fly
+    with 8 bytes of memory per unique key. Once max_keys unique keys have been seen, the set stops
+    growing: later rows whose key was already emitted are still dropped, and the others are spilled to
+    hash partitions on disk, each deduplicated on its own by finish(). Memory therefore stays bounded
+    however many rows the stream holds.
+
+    Two different keys with the same 64-bit hash, about one chance in 10^4 for 10^8 keys, would be taken
+    for duplicates in the on-the-fly phase; spilled partitions are deduplicated on the key values.
+
+    Args:
+        key_columns (list): Columns identifying a row.
+        max_keys (int): Number of unique keys kept in memory before spilling to disk.
+        spill_dir (str, optional): Directory for the spill files; the system temporary directory if None.
+        partitions (int): Number of spill partitions.
+    """
+
+    def __init__(self, key_columns, max_keys=20_000_000, spill_dir=None, partitions=64):
+        self.key_columns = list(key_columns)
+        self.max_keys = max_keys
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+        self.seen = HashKeySet()
+        self.spilled = 0
+        self._spill_path = None
+        self._dtypes = None
+
+    def add(self, df):
+        """
+        Deduplicate a chunk against itself and every earlier chunk.
+
+        Args:
+            df (pandas.DataFrame): Chunk of rows.
+
+        Returns:
+            pandas.DataFrame: The rows of the chunk that can be written now; rows spilled to disk are
+            returned by finish() instead.
+        """
+        # Hash the key values, not the categorical codes, so that hashes agree across chunks
+        hashes = pd.util.hash_pandas_object(df[self.key_columns], index=False, categorize=False).to_numpy()
+
+        # First occurrence of each key in the chunk, in row order, not emitted by an earlier chunk
+        _, first = np.unique(hashes, return_index=True)
+        first = np.sort(first)
+        first = first[~self.seen.contains(hashes[first])]
+
+        if self._spill_path is None and self.seen.size + len(first) <= self.max_keys:
+            self.seen.add(hashes[first])
+            return df.iloc[first]
+
+        self._spill(df.iloc[first], hashes[first])
+        return df.iloc[:0]
+
+    def _spill(self, df, hashes):
+        """
+        Append rows to the spill partition of their key hash.
+        """
+        if self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix="dedup_spill_", dir=self.spill_dir)
+            # Categories differ between chunks, so categorical columns are read back with their own
+            self._dtypes = {
+                column: "category" if isinstance(dtype, pd.CategoricalDtype) else dtype
+                for column, dtype in df.dtypes.items()
+            }
+            print(f"More than {self.max_keys} unique keys, spilling to {self._spill_path}")
+
+        partition = hashes % np.uint64(self.partitions)
+        for p in np.unique(partition):
+            path = os.path.join(self._spill_path, f"{p}.csv")
+            df[partition == p].to_csv(path, mode="a", index=False, header=not os.path.exists(path))
+        self.spilled += len(df)
+
+    def finish(self):
+        """
+        Deduplicate the spilled partitions, one at a time, and delete the spill files.
+
+        Yields:
+            pandas.DataFrame: The unique rows of each partition, first occurrences kept.
+        """
+        if self._spill_path is None:
+            return
+        try:
+            for p in range(self.partitions):
+                path = os.path.join(self._spill_path, f"{p}.csv")
+                if os.path.exists(path):
+                    # Round-trip parsing gives back exactly the float values that were spilled
+                    df = pd.read_csv(path, dtype=self._dtypes, float_precision="round_trip")
+                    yield df.drop_duplicates(subset=self.key_columns)
+        finally:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+
+def stream_unique_rows(paths, output_path, key_columns, columns=None, dtypes=None, workers=4, max_keys=20_000_000, spill_dir=None):
+    """
+    Read many tables in parallel, drop duplicate rows on the fly and write the unique rows incrementally.
+
+    Only a few tables and the set of unique key hashes are held in memory at once, however many tables
+    are combined.
+
+    Args:
+        paths (list): Paths of the input CSV or Parquet tables.
+        output_path (str): Path of the output table (.csv or .parquet).
+        key_columns (list): Columns identifying a row.
+        columns (list, optional): Columns to read and write. All columns if None.
+        dtypes (dict, optional): Explicit dtype of each column.
+        workers (int): Number of reading threads.
+        max_keys (int): Number of unique keys kept in memory before spilling to disk.
+        spill_dir (str, optional): Directory for the spill files.
+
+    Returns:
+        tuple: (number of rows read, number of unique rows written).
+    """
+    dedup = StreamingDeduplicator(key_columns, max_keys, spill_dir)
+    read = 0
+
+    with TableWriter(output_path) as writer:
+        for i, (path, df) in enumerate(iter_tables(paths, columns, dtypes, workers)):
+            read += len(df)
+            writer.write(dedup.add(df))
+            if (i + 1) % 1000 == 0:
+                print(f"Tables read: {i + 1}/{len(paths)}, rows read: {read}, unique rows: {writer.rows + dedup.spilled}")
+
+        for df in dedup.finish():
+            writer.write(df)
+
+    return read, writer.rows
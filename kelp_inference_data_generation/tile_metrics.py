@@ -0,0 +1,359 @@
+import collections
+import contextlib
+import http.server
+import json
+import resource
+import sys
+import threading
+import time
+
+# Prefix of the metric names on the Prometheus endpoint
+METRIC_PREFIX = "kelp_inference_"
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process, so that the next reading covers only what follows.
+
+    Only Linux can reset it (through /proc/self/clear_refs); elsewhere the peak keeps covering the whole
+    life of the process.
+
+    Returns:
+        bool: True if the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process since it started or since the last ``reset_peak_rss``.
+
+    Returns:
+        int: Peak resident memory in bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+class TileMetrics:
+    """
+    Timings and sizes measured while one tile is processed.
+
+    Stages are timed on the wall clock with ``stage``; the per-band fetch, warp and write times and the
+    decoded size of every asset are filled into ``bands`` by the band_stacking and tile_writers functions
+    that take a ``stats`` dict.
+
+    Args:
+        tile (str): ID of the Sentinel-2 item.
+    """
+
+    def __init__(self, tile):
+        self.tile = tile
+        self.started = time.time()
+        self.stages = {}
+        self.bands = {}
+        self.uploaded_bytes = None
+        self.precheck = None
+        self.seconds = None
+        self.peak_rss_bytes = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the tile; time spent in a stage entered several times is added up.
+
+        Args:
+            name (str): Stage name, e.g. 'stac_lookup' or 'upload'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self):
+        """
+        Record the total time and the peak memory of the tile, then reset the peak for the next tile.
+
+        When several tiles are processed at once in one process, as in pipelined mode, the peak covers
+        all of them since the previous tile finished.
+
+        Returns:
+            dict: The metrics as a JSON-serializable dict, see ``to_dict``.
+        """
+        self.seconds = time.time() - self.started
+        self.peak_rss_bytes = peak_rss_bytes()
+        reset_peak_rss()
+        return self.to_dict()
+
+    def to_dict(self):
+        """
+        Convert the metrics to a JSON-serializable dict.
+
+        Returns:
+            dict: Tile ID, start time, total seconds, wall-clock seconds per stage, per-band statistics,
+            their totals over all bands, uploaded bytes, SCL pre-check statistics and peak resident memory.
+        """
+        totals = {
+            key: sum(band.get(key, 0) for band in self.bands.values())
+            for key in ("fetch_seconds", "bytes", "warp_seconds", "write_seconds")
+        }
+        return {
+            "tile": self.tile,
+            "started": self.started,
+            "seconds": self.seconds,
+            "stages": dict(self.stages),
+            "bands": {name: dict(band) for name, band in self.bands.items()},
+            "totals": totals,
+            "uploaded_bytes": self.uploaded_bytes,
+            "precheck": self.precheck,
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+class ThroughputEstimator:
+    """
+    Moving-average throughput over the last completed tiles, and the time left at that rate.
+
+    The rate is measured between tile completions rather than from the time spent on each tile, so it
+    accounts for tiles processed concurrently by pipelined stages or several workers.
+
+    Args:
+        window (int): Number of most recent completions the rate is averaged over.
+        started (float, optional): Start of the run (time.time()); the first completion is measured from it.
+    """
+
+    def __init__(self, window=20, started=None):
+        self.completions = collections.deque([time.time() if started is None else started], maxlen=window + 1)
+
+    def add(self, finished=None):
+        """
+        Record a completed tile.
+
+        Args:
+            finished (float, optional): Completion time (time.time()); now if None.
+        """
+        self.completions.append(time.time() if finished is None else finished)
+
+    def tiles_per_second(self):
+        """
+        Average throughput over the last completions.
+
+        Returns:
+            float: Tiles per second over the window, or None before the first completion.
+        """
+        elapsed = self.completions[-1] - self.completions[0]
+        if len(self.completions) < 2 or elapsed <= 0:
+            return None
+        return (len(self.completions) - 1) / elapsed
+
+    def eta_seconds(self, remaining):
+        """
+        Estimate the time left at the current throughput.
+
+        Args:
+            remaining (int): Number of tiles left.
+
+        Returns:
+            float: Estimated seconds until the remaining tiles are done, or None before the first completion.
+        """
+        rate = self.tiles_per_second()
+        return None if rate is None else remaining / rate
+
+class MetricsRecorder:
+    """
+    Collect the metrics of finished tiles: append them to a JSON lines file, aggregate them per stage
+    and band, expose the aggregates as Prometheus text on a local HTTP endpoint and estimate the time
+    left from the measured throughput.
+
+    Args:
+        path (str, optional): JSON lines file the tile metrics are appended to; not written if None.
+        port (int, optional): Local port of the Prometheus endpoint (GET /metrics); not served if None.
+        total (int): Number of tiles to process in this run.
+        window (int): Number of most recent tiles the throughput is averaged over.
+    """
+
+    def __init__(self, path=None, port=None, total=0, window=20):
+        self.path = path
+        self.remaining = total
+        self.done = 0
+        self.throughput = ThroughputEstimator(window)
+        self.stage_seconds = collections.defaultdict(float)
+        self.stage_counts = collections.Counter()
+        self.band_seconds = collections.defaultdict(float)
+        self.band_bytes = collections.Counter()
+        self.uploaded_bytes = 0
+        self.last_peak_rss_bytes = 0
+        self.max_peak_rss_bytes = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1) if path else None
+        self._server = None
+        if port is not None:
+            self.serve(port)
+
+    def record(self, metrics, remaining=None):
+        """
+        Record the metrics of a finished tile.
+
+        Args:
+            metrics (TileMetrics or dict): Metrics of the tile; a TileMetrics is finished first.
+            remaining (int, optional): Number of tiles left, when known better by the caller (e.g. the
+                scheduler's journal); otherwise one less than before.
+        """
+        if isinstance(metrics, TileMetrics):
+            metrics = metrics.finish()
+
+        with self._lock:
+            self.done += 1
+            self.remaining = max(self.remaining - 1, 0) if remaining is None else remaining
+            self.throughput.add()
+
+            for stage, seconds in metrics["stages"].items():
+                self.stage_seconds[stage] += seconds
+                self.stage_counts[stage] += 1
+            for band, stats in metrics["bands"].items():
+                for step in ("fetch", "warp", "write"):
+                    if f"{step}_seconds" in stats:
+                        self.band_seconds[(band, step)] += stats[f"{step}_seconds"]
+                self.band_bytes[band] += stats.get("bytes", 0)
+            self.uploaded_bytes += metrics.get("uploaded_bytes") or 0
+            if metrics.get("peak_rss_bytes"):
+                self.last_peak_rss_bytes = metrics["peak_rss_bytes"]
+                self.max_peak_rss_bytes = max(self.max_peak_rss_bytes, metrics["peak_rss_bytes"])
+
+            if self._file is not None:
+                self._file.write(json.dumps(metrics) + "\n")
+
+    def skip(self):
+        """
+        Count a tile that turned out to need no processing, e.g. because it is already in S3.
+        """
+        with self._lock:
+            self.remaining = max(self.remaining - 1, 0)
+
+    def eta_text(self):
+        """
+        Format the estimated time of completion for the logs.
+
+        Returns:
+            str: Estimated time of completion in hours with the measured throughput, for the logs.
+        """
+        rate = self.throughput.tiles_per_second()
+        if rate is None:
+            return "unknown until the first tile is done"
+        return f"{self.remaining / rate / 3600:.2f} hrs at {rate * 3600:.1f} tiles/h"
+
+    def slowest_stages(self):
+        """
+        Rank the stages by their average time per tile, to find the one limiting throughput.
+
+        Returns:
+            list: (stage, average seconds per tile) pairs, slowest first.
+        """
+        with self._lock:
+            return sorted(
+                ((stage, seconds / self.stage_counts[stage]) for stage, seconds in self.stage_seconds.items()),
+                key=lambda pair: pair[1],
+                reverse=True,
+            )
+
+    def prometheus_text(self):
+        """
+        Render the aggregates in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        with self._lock:
+            rate = self.throughput.tiles_per_second()
+            eta = self.throughput.eta_seconds(self.remaining)
+            lines = [
+                "# TYPE tiles_done_total counter",
+                f"tiles_done_total {self.done}",
+                "# TYPE tiles_remaining gauge",
+                f"tiles_remaining {self.remaining}",
+                "# TYPE tiles_per_second gauge",
+                f"tiles_per_second {rate if rate is not None else 'NaN'}",
+                "# TYPE eta_seconds gauge",
+                f"eta_seconds {eta if eta is not None else 'NaN'}",
+                "# TYPE stage_seconds summary",
+            ]
+            for stage in sorted(self.stage_seconds):
+                lines.append(f'stage_seconds_sum{{stage="{stage}"}} {self.stage_seconds[stage]}')
+                lines.append(f'stage_seconds_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+            lines.append("# TYPE band_seconds_total counter")
+            for band, step in sorted(self.band_seconds):
+                lines.append(f'band_seconds_total{{band="{band}",step="{step}"}} {self.band_seconds[(band, step)]}')
+            lines.append("# TYPE fetched_bytes_total counter")
+            for band in sorted(self.band_bytes):
+                lines.append(f'fetched_bytes_total{{band="{band}"}} {self.band_bytes[band]}')
+            lines += [
+                "# TYPE uploaded_bytes_total counter",
+                f"uploaded_bytes_total {self.uploaded_bytes}",
+                "# TYPE tile_peak_rss_bytes gauge",
+                f"tile_peak_rss_bytes {self.last_peak_rss_bytes}",
+                "# TYPE tile_peak_rss_bytes_max gauge",
+                f"tile_peak_rss_bytes_max {self.max_peak_rss_bytes}",
+            ]
+        lines = [
+            f"# TYPE {METRIC_PREFIX}{line[len('# TYPE '):]}" if line.startswith("# TYPE ") else METRIC_PREFIX + line
+            for line in lines
+        ]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        """
+        Serve the Prometheus text on http://127.0.0.1:<port>/metrics from a background thread.
+
+        Args:
+            port (int): Local TCP port.
+        """
+        recorder = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = recorder.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on http://127.0.0.1:{self._server.server_address[1]}/metrics")
+
+    def close(self):
+        """
+        Print the average time of every stage, slowest first, stop the endpoint and close the file.
+        """
+        for stage, seconds in self.slowest_stages():
+            print(f"Stage {stage}: {seconds:.2f}s per tile on average")
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
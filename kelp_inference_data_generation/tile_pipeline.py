@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+import traceback
+
+# Marks the end of the tile stream between two stages
+_END = object()
+
+class SkipTile(Exception):
+    """
+    Raised by a stage to drop a tile on purpose, e.g. one rejected by a pre-check, without logging a failure.
+    """
+
+def _run_stage(name, func, in_queue, out_queue):
+    """
+    Apply one pipeline stage to every tile coming from in_queue and pass the results on.
+
+    A tile whose stage raises is logged and dropped, so one bad tile does not stop the pipeline. A
+    stage raising SkipTile drops the tile without the traceback.
+
+    Args:
+        name (str): Stage name, used in the log.
+        func (callable): Stage function taking (tile, value) and returning the value for the next stage.
+        in_queue (queue.Queue): Queue of (tile, value) pairs from the previous stage.
+        out_queue (queue.Queue): Bounded queue of (tile, value) pairs for the next stage.
+    """
+    while True:
+        entry = in_queue.get()
+        if entry is _END:
+            out_queue.put(_END)
+            return
+
+        tile, value = entry
+        # The entry tuple holds the input too, so only value may keep it alive below
+        del entry
+        start = time.perf_counter()
+        try:
+            result = func(tile, value)
+        except SkipTile as skip:
+            print(f"{name} skipped {tile}: {skip}")
+            continue
+        except Exception:
+            print(f"{name} failed for {tile}, skipping it:\n{traceback.format_exc()}")
+            continue
+        finally:
+            # Release the input before blocking on the next queue
+            del value
+        print(f"{name} {tile} took {time.perf_counter() - start:.2f}s")
+        out_queue.put((tile, result))
+        # The next stage owns the result now; do not hold it while waiting for the next input
+        del result
+
+def run_pipeline(tiles, stages, queue_size=1):
+    """
+    Run tiles through a chain of stages, each in its own thread, connected by bounded queues.
+
+    While one tile is being uploaded the next one can be warped and a third one fetched, so the
+    throughput approaches that of the slowest stage instead of the sum of all of them. Each queue holds
+    at most queue_size tiles, which bounds the memory held between stages.
+
+    Args:
+        tiles (iterable): Tile identifiers to process.
+        stages (list): (name, func) pairs. The first func receives (tile, None); each following func
+            receives (tile, result of the previous stage).
+        queue_size (int): Maximum number of tiles waiting between two stages.
+
+    Returns:
+        list: Identifiers of the tiles that went through every stage.
+    """
+    queues = [queue.Queue()] + [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = [
+        threading.Thread(target=_run_stage, args=(name, func, queues[i], queues[i + 1]), name=name, daemon=True)
+        for i, (name, func) in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Feed the tiles from a separate thread so the caller can drain the last queue meanwhile
+    def feed():
+        for tile in tiles:
+            queues[0].put((tile, None))
+        queues[0].put(_END)
+
+    threading.Thread(target=feed, name="feed", daemon=True).start()
+
+    completed = []
+    while True:
+        entry = queues[-1].get()
+        if entry is _END:
+            break
+        completed.append(entry[0])
+
+    for thread in threads:
+        thread.join()
+
+    return completed
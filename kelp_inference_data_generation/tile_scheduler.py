@@ -0,0 +1,217 @@
+import multiprocessing
+import sqlite3
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# States a tile goes through in the journal
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+def open_journal(journal_path):
+    """
+    Open (or create) the SQLite journal that records the state of every tile.
+
+    Args:
+        journal_path (str): Path of the SQLite file.
+
+    Returns:
+        sqlite3.Connection: Connection to the journal.
+    """
+    conn = sqlite3.connect(journal_path)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tiles (
+            tile TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            updated REAL
+        )
+        """
+    )
+    conn.commit()
+    return conn
+
+def journal_is_empty(conn):
+    """
+    Check whether a journal has no tiles yet, i.e. whether this is the first run.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the journal.
+
+    Returns:
+        bool: True if no tile has been recorded.
+    """
+    return conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0] == 0
+
+def add_tiles(conn, tiles, state=PENDING):
+    """
+    Record tiles in the journal, leaving tiles that are already there untouched.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the journal.
+        tiles (iterable): Tile identifiers.
+        state (str): State of the newly added tiles.
+    """
+    now = time.time()
+    conn.executemany(
+        "INSERT OR IGNORE INTO tiles (tile, state, updated) VALUES (?, ?, ?)",
+        ((tile, state, now) for tile in tiles),
+    )
+    conn.commit()
+
+def state_counts(conn):
+    """
+    Count the tiles in each state.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the journal.
+
+    Returns:
+        dict: Number of tiles per state.
+    """
+    return dict(conn.execute("SELECT state, COUNT(*) FROM tiles GROUP BY state").fetchall())
+
+def _set_state(conn, tile, state, error=None, next_attempt=0, attempt=False):
+    """
+    Update the state of one tile, optionally counting an attempt.
+    """
+    conn.execute(
+        "UPDATE tiles SET state = ?, error = ?, next_attempt = ?, attempts = attempts + ?, updated = ? WHERE tile = ?",
+        (state, error, next_attempt, int(attempt), time.time(), tile),
+    )
+    conn.commit()
+
+def _record_failure(conn, tile, error, max_attempts, backoff_seconds):
+    """
+    Record a failed attempt: schedule a retry with exponential backoff, or give up after max_attempts.
+    """
+    attempts = conn.execute("SELECT attempts FROM tiles WHERE tile = ?", (tile,)).fetchone()[0] + 1
+    if attempts >= max_attempts:
+        print(f"{tile} failed after {attempts} attempts: {error.splitlines()[-1] if error else ''}")
+        _set_state(conn, tile, FAILED, error, attempt=True)
+    else:
+        delay = backoff_seconds * 2 ** (attempts - 1)
+        print(f"{tile} failed (attempt {attempts}), retrying in {delay:.0f}s")
+        _set_state(conn, tile, PENDING, error, next_attempt=time.time() + delay, attempt=True)
+
+def _run_tile(process_tile, tile):
+    """
+    Run one tile in a worker process, returning (None, result) or (traceback text, None) instead of raising.
+
+    Exceptions are turned into text so that errors that cannot be pickled still reach the parent.
+    """
+    try:
+        return None, process_tile(tile)
+    except Exception:
+        return traceback.format_exc(), None
+
+def run_scheduler(journal_path, tiles, process_tile, workers=1, max_attempts=3, backoff_seconds=30, initializer=None, initargs=(), on_done=None):
+    """
+    Process tiles with a pool of worker processes, recording progress in a SQLite journal.
+
+    Every tile is pending, running, done or failed in the journal. Tiles left running by a crashed run
+    are put back to pending on start, failed attempts are retried with exponential backoff, and a tile
+    is only handed to one worker at a time, so restarts resume where the last run stopped without
+    duplicating work.
+
+    Args:
+        journal_path (str): Path of the SQLite journal.
+        tiles (iterable): Tile identifiers to add to the journal as pending.
+        process_tile (callable): Picklable function processing one tile; raising marks an attempt failed.
+            Its return value must be picklable too and is passed to on_done.
+        workers (int): Number of worker processes.
+        max_attempts (int): Attempts per tile before it is marked failed.
+        backoff_seconds (float): Delay before the first retry; doubled after every failed attempt.
+        initializer (callable, optional): Called once in every worker process.
+        initargs (tuple): Arguments of the initializer.
+        on_done (callable, optional): Called in the parent as on_done(tile, result, remaining) after each
+            tile is done, with the value returned by process_tile and the number of tiles still pending
+            or running.
+
+    Returns:
+        dict: Number of tiles per state when the run ends.
+    """
+    conn = open_journal(journal_path)
+    add_tiles(conn, tiles)
+
+    # Tiles that were running when the last run died go back to the queue
+    conn.execute("UPDATE tiles SET state = ? WHERE state = ?", (PENDING, RUNNING))
+    conn.commit()
+    print(f"Journal {journal_path}: {state_counts(conn)}")
+
+    # Spawned workers do not inherit the parent's GDAL or HTTP connection state
+    context = multiprocessing.get_context("spawn")
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer, initargs=initargs)
+
+    executor = new_pool()
+    in_flight = {}
+
+    while True:
+        # Hand pending tiles whose retry time has come to the free workers
+        free = workers - len(in_flight)
+        if free > 0:
+            rows = conn.execute(
+                "SELECT tile FROM tiles WHERE state = ? AND next_attempt <= ? ORDER BY next_attempt, tile LIMIT ?",
+                (PENDING, time.time(), free),
+            ).fetchall()
+            for (tile,) in rows:
+                try:
+                    future = executor.submit(_run_tile, process_tile, tile)
+                except BrokenProcessPool:
+                    if in_flight:
+                        # A worker died since the last check; collect the in-flight tiles first
+                        break
+                    executor = new_pool()
+                    future = executor.submit(_run_tile, process_tile, tile)
+                _set_state(conn, tile, RUNNING)
+                in_flight[future] = tile
+
+        # Wake up for the next finished tile, or for the next retry if a worker is idle
+        next_retry = conn.execute("SELECT MIN(next_attempt) FROM tiles WHERE state = ?", (PENDING,)).fetchone()[0]
+        if not in_flight:
+            if next_retry is None:
+                break
+            time.sleep(max(next_retry - time.time(), 0))
+            continue
+        timeout = max(next_retry - time.time(), 0.1) if next_retry is not None and len(in_flight) < workers else None
+
+        finished, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        broken = False
+        for future in finished:
+            tile = in_flight.pop(future)
+            try:
+                error, result = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for running out of memory); the pool has to be replaced
+                broken = True
+                error, result = "Worker process died", None
+            if error is None:
+                _set_state(conn, tile, DONE)
+                counts = state_counts(conn)
+                remaining = counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+                print(f"{tile} done. Tiles done: {counts.get(DONE, 0)}, left: {remaining}")
+                if on_done is not None:
+                    on_done(tile, result, remaining)
+            else:
+                _record_failure(conn, tile, error, max_attempts, backoff_seconds)
+
+        if broken:
+            executor.shutdown(wait=False, cancel_futures=True)
+            for tile in in_flight.values():
+                _record_failure(conn, tile, "Worker process died", max_attempts, backoff_seconds)
+            in_flight = {}
+            executor = new_pool()
+
+    executor.shutdown()
+    counts = state_counts(conn)
+    conn.close()
+    print(f"Scheduler finished: {counts}")
+    return counts
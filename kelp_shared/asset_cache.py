@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import rioxarray
+
+class AssetCache:
+    """
+    On-disk cache of decoded Sentinel-2 asset windows.
+
+    Entries are keyed by item ID, asset name and the bounds of the window read, never by the signed
+    URL, so reruns, restarts and the training and inference pipelines share them whatever SAS token
+    their items carry. Every entry is a losslessly compressed GeoTIFF that keeps the CRS, transform,
+    nodata value and data type of the asset. The least recently used entries are evicted once the
+    cache grows beyond max_bytes.
+
+    Args:
+        cache_dir (str): Directory holding the cache files.
+        max_bytes (int): Size above which the least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(item_id, asset_name, bounds=None):
+        """
+        Build the cache key of an asset window.
+
+        Args:
+            item_id (str): ID of the Sentinel-2 item.
+            asset_name (str): Asset name, e.g. 'B02'.
+            bounds (tuple, optional): Bounds of the window, rounded to 1e-6; None for the whole asset.
+
+        Returns:
+            dict: The key.
+        """
+        return {
+            "item": item_id,
+            "asset": asset_name,
+            "bounds": [round(float(v), 6) for v in bounds] if bounds is not None else None,
+        }
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.tif")
+
+    def get(self, item_id, asset_name, bounds, load):
+        """
+        Read an asset window through the cache.
+
+        Args:
+            item_id (str): ID of the Sentinel-2 item.
+            asset_name (str): Asset name.
+            bounds (tuple, optional): Bounds of the window, as passed to ``read_band``.
+            load (callable): Downloads and decodes the window on a cache miss; returns an
+                xarray.DataArray with its data loaded.
+
+        Returns:
+            tuple: (xarray.DataArray with its data loaded, True if it came from the cache).
+        """
+        path = self._path(self.key(item_id, asset_name, bounds))
+
+        band = self._load(path)
+        if band is not None:
+            self.hits += 1
+            return band, True
+
+        self.misses += 1
+        band = load()
+        self._store(path, band)
+        self._evict()
+        return band, False
+
+    def _load(self, path):
+        """
+        Read a cache entry, returning None when it is missing or unreadable.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            band = rioxarray.open_rasterio(path, lock=False).load()
+        except Exception:
+            return None
+
+        # Mark the entry as recently used for eviction; the band is already in memory if it was evicted meanwhile
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return band
+
+    def _store(self, path, band):
+        """
+        Write a cache entry atomically, so that concurrent threads and processes never read a partial file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            band.rio.to_raster(tmp_path, driver="GTiff", tiled=True, compress="DEFLATE", predictor=2, zlevel=1)
+            os.replace(tmp_path, path)
+        except Exception:
+            # A full disk or an unwritable directory only costs the cache entry
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tif"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def open_asset_cache(asset_cache_dir=None, max_gb=50):
+    """
+    Open an on-disk asset cache when a cache directory is given.
+
+    Args:
+        asset_cache_dir (str, optional): Directory of the cache. No cache is used if None.
+        max_gb (float): Size cap of the cache in gigabytes.
+
+    Returns:
+        AssetCache or None.
+    """
+    if not asset_cache_dir:
+        return None
+    return AssetCache(asset_cache_dir, int(max_gb * 1024 ** 3))
@@ -0,0 +1,439 @@
+import functools
+import math
+import os
+import threading
+import time
+import numpy as np
+import rasterio
+import xarray as xr
+import rioxarray
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.warp import calculate_default_transform, reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import transform as window_transform
+
+# CRS of every stacked tile
+DST_CRS = "EPSG:4326"
+
+# 10 m band whose native grid defines the destination grid of an item
+REFERENCE_BAND = "B02"
+
+# Resampling used when warping a band from its native grid straight onto the 10 m destination grid.
+# The 20 m bands keep the bilinear resampling they used to get when upsampled to 10 m before
+# reprojection; SCL is a classification and is warped with nearest neighbour.
+BAND_RESAMPLING = {
+    "B05": Resampling.bilinear,
+    "B06": Resampling.bilinear,
+    "B07": Resampling.bilinear,
+    "B8A": Resampling.bilinear,
+    "B11": Resampling.bilinear,
+    "B12": Resampling.bilinear,
+    "SCL": Resampling.nearest,
+}
+
+# Destination grid shared by all bands of an item
+WarpGrid = namedtuple("WarpGrid", ["crs", "transform", "height", "width"])
+
+def open_band(href, lock=None):
+    """
+    Open a Sentinel-2 asset lazily at overview level 0, as the pipelines always have.
+
+    Args:
+        href (str): URL or path of the asset.
+        lock (optional): Passed to ``rioxarray.open_rasterio``. ``False`` lets several threads read
+            different assets at the same time instead of sharing rioxarray's global lock.
+
+    Returns:
+        xarray.DataArray: The asset, with data read on first access.
+    """
+    return rioxarray.open_rasterio(href, overview_level=0, lock=lock)
+
+def read_band(item, name, bounds=None, dst_crs=DST_CRS, stats=None, cache=None):
+    """
+    Download and decode one asset of an item into memory, logging how long it took.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        name (str): Asset name, e.g. 'B02'.
+        bounds (tuple, optional): (minx, miny, maxx, maxy) in dst_crs. When given, only the window of
+            the asset covering these bounds (plus a two pixel margin for resampling) is read.
+        dst_crs (str): CRS of bounds.
+        stats (dict, optional): Per-band statistics; 'fetch_seconds', the decoded 'bytes' of the asset
+            and whether it was 'cached' are stored under stats[name].
+        cache (AssetCache, optional): On-disk cache of decoded asset windows, read before downloading.
+
+    Returns:
+        xarray.DataArray: The asset on its native grid, named 'ds<name>', with its data loaded.
+    """
+    start = time.perf_counter()
+
+    def download():
+        band = open_band(item.assets[name].href, lock=False)
+
+        if bounds is not None:
+            # Clip lazily in the asset's own CRS so that only the overlapping blocks are downloaded
+            minx, miny, maxx, maxy = transform_bounds(dst_crs, band.rio.crs, *bounds, densify_pts=21)
+            margin = 2 * max(abs(r) for r in band.rio.resolution())
+            band = band.rio.clip_box(minx=minx - margin, miny=miny - margin, maxx=maxx + margin, maxy=maxy + margin)
+
+        return band.load()
+
+    if cache is None:
+        band, cached = download(), False
+    else:
+        band, cached = cache.get(item.id, name, bounds, download)
+    band = band.rename(f"ds{name}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {name} in {elapsed:.2f}s{' from the asset cache' if cached else ''}")
+    if stats is not None:
+        stats.setdefault(name, {}).update(fetch_seconds=elapsed, bytes=band.nbytes, cached=cached)
+    return band
+
+def fetch_bands(item, band_names, max_workers=1, bounds=None, stats=None, cache=None):
+    """
+    Download and decode the requested assets of an item, concurrently when max_workers > 1.
+
+    At most max_workers assets are fetched ahead of the caller, so no more than max_workers + 1 raw
+    bands are held in memory while the caller consumes them.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        band_names (list): Asset names to fetch.
+        max_workers (int): Number of assets fetched in parallel.
+        bounds (tuple, optional): EPSG:4326 bounds; only the covering window of each asset is read.
+        stats (dict, optional): Per-band statistics, filled by ``read_band``.
+        cache (AssetCache, optional): On-disk cache of decoded asset windows.
+
+    Yields:
+        tuple: (band name, xarray.DataArray on its native grid), in the order of band_names.
+    """
+    if max_workers <= 1:
+        for name in band_names:
+            yield name, read_band(item, name, bounds, stats=stats, cache=cache)
+        return
+
+    names = iter(band_names)
+    pending = deque()
+
+    def submit_next():
+        name = next(names, None)
+        if name is not None:
+            pending.append((name, executor.submit(read_band, item, name, bounds, stats=stats, cache=cache)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in range(max_workers):
+            submit_next()
+        while pending:
+            name, future = pending.popleft()
+            submit_next()
+            band = future.result()
+            # Drop the finished future so it does not keep the band alive after the caller is done with it
+            del future
+            yield name, band
+
+def destination_grid(reference, dst_crs=DST_CRS):
+    """
+    Compute the destination grid for a band in the target CRS, at the reference band's resolution.
+
+    This is the grid ``rio.reproject(dst_crs)`` would pick for the reference band on its own.
+
+    Args:
+        reference (xarray.DataArray): Band on the native 10 m grid of the item.
+        dst_crs (str): Target CRS.
+
+    Returns:
+        WarpGrid: The destination grid.
+    """
+    transform, width, height = calculate_default_transform(
+        reference.rio.crs, dst_crs, reference.rio.width, reference.rio.height, *reference.rio.bounds()
+    )
+    return WarpGrid(dst_crs, transform, height, width)
+
+def item_destination_grid(item, reference_band=REFERENCE_BAND, dst_crs=DST_CRS, warp_cache=None):
+    """
+    Compute the common 10 m destination grid of a Sentinel-2 item.
+
+    Only the metadata of the reference asset is read.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        reference_band (str): Name of a 10 m asset of the item.
+        dst_crs (str): Target CRS.
+        warp_cache (WarpCache, optional): Cache of destination grids; with it the reference asset is only
+            opened the first time the item's source grid is seen.
+
+    Returns:
+        WarpGrid: The destination grid shared by all bands of the item.
+    """
+    if warp_cache is not None:
+        return warp_cache.item_grid(item, reference_band, dst_crs)
+    return destination_grid(open_band(item.assets[reference_band].href), dst_crs)
+
+def crop_grid(grid, bounds):
+    """
+    Restrict a destination grid to the pixels covering the given bounds, keeping its pixel alignment.
+
+    Args:
+        grid (WarpGrid): Destination grid.
+        bounds (tuple): (minx, miny, maxx, maxy) in the grid's CRS.
+
+    Returns:
+        WarpGrid: The cropped grid.
+    """
+    window = from_bounds(*bounds, transform=grid.transform)
+
+    # Round outwards to whole pixels and clamp to the grid
+    col_start = max(math.floor(window.col_off), 0)
+    row_start = max(math.floor(window.row_off), 0)
+    col_stop = min(math.ceil(window.col_off + window.width), grid.width)
+    row_stop = min(math.ceil(window.row_off + window.height), grid.height)
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    return WarpGrid(grid.crs, window_transform(window, grid.transform), int(window.height), int(window.width))
+
+def grid_bounds(grid):
+    """
+    Bounds of a destination grid.
+
+    Args:
+        grid (WarpGrid): Destination grid.
+
+    Returns:
+        tuple: (minx, miny, maxx, maxy) in the grid's CRS.
+    """
+    return array_bounds(grid.height, grid.width, grid.transform)
+
+def warp_band(band, grid, resampling=Resampling.nearest):
+    """
+    Warp a band from its native grid onto the destination grid in a single reprojection.
+
+    Args:
+        band (xarray.DataArray): Band on its native grid (10 m or 20 m).
+        grid (WarpGrid): Destination grid.
+        resampling (Resampling): Resampling method.
+
+    Returns:
+        xarray.DataArray: The band on the destination grid.
+    """
+    return band.rio.reproject(
+        grid.crs,
+        shape=(grid.height, grid.width),
+        transform=grid.transform,
+        resampling=resampling,
+    )
+
+def iter_warped_bands(item, band_names, grid=None, max_workers=1, windowed=False, stats=None, cache=None, warp_cache=None):
+    """
+    Fetch the requested bands of an item and warp them onto one common destination grid, one at a time.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        band_names (list): Asset names to warp, e.g. ['B02', 'B03'].
+        grid (WarpGrid, optional): Destination grid. Defaults to the item's 10 m grid.
+        max_workers (int): Number of assets fetched in parallel while earlier ones are warped.
+        windowed (bool): Only read the window of each asset that covers the grid. Use it with a grid
+            cropped by ``crop_grid``; for a full-tile grid it only adds a clip.
+        stats (dict, optional): Per-band statistics; fetch and warp times are stored under each band name.
+        cache (AssetCache, optional): On-disk cache of decoded asset windows, read before downloading.
+        warp_cache (WarpCache, optional): Cache of destination grids and warp plans.
+
+    Yields:
+        tuple: (band name, xarray.DataArray named 'ds<band name>' on the destination grid).
+    """
+    if grid is None:
+        grid = item_destination_grid(item, warp_cache=warp_cache)
+
+    bounds = grid_bounds(grid) if windowed else None
+
+    yield from warp_bands(fetch_bands(item, band_names, max_workers, bounds, stats, cache), grid, stats, warp_cache)
+
+def warp_bands(bands, grid, stats=None, warp_cache=None):
+    """
+    Warp already fetched bands onto one common destination grid, one at a time.
+
+    Args:
+        bands (iterable): (band name, xarray.DataArray on its native grid) pairs, e.g. from ``fetch_bands``.
+        grid (WarpGrid): Destination grid.
+        stats (dict, optional): Per-band statistics; 'warp_seconds' is stored under stats[name].
+        warp_cache (WarpCache, optional): Cache of warp plans, reused by the bands on the same source grid.
+
+    Yields:
+        tuple: (band name, xarray.DataArray on the destination grid).
+    """
+    for name, band in bands:
+        start = time.perf_counter()
+        resampling = BAND_RESAMPLING.get(name, Resampling.nearest)
+        if warp_cache is not None:
+            warped = warp_cache.warp(band, grid, resampling)
+        else:
+            warped = warp_band(band, grid, resampling)
+        elapsed = time.perf_counter() - start
+        print(f"Warped {name} in {elapsed:.2f}s")
+        if stats is not None:
+            stats.setdefault(name, {})["warp_seconds"] = elapsed
+        # Release the native band before the next one is warped
+        del band
+        yield name, warped
+
+def stack_bands(data_arrays, band_names):
+    """
+    Stack bands that share one destination grid into a single DataArray.
+
+    The concat uses ``join='exact'`` so that a band on a different grid raises instead of being
+    realigned with an outer join.
+
+    Args:
+        data_arrays (list): Bands on the same destination grid.
+        band_names (list): Labels of the band coordinate.
+
+    Returns:
+        xarray.DataArray: The stacked bands.
+    """
+    stacked = xr.concat(data_arrays, dim='band', join='exact')
+    stacked = stacked.assign_coords(band=band_names)
+    return stacked
+
+def strip_workers(memory_budget_bytes, strip_rows, width, itemsize=2):
+    """
+    Number of strips of a lazy band that can be computed at once within a memory budget.
+
+    Each strip in flight holds about four strip-sized arrays: its source window (up to twice the
+    strip's pixels once rotated into the source grid, with the resampling margin) and the warped
+    strip, which is kept until it is written.
+
+    Args:
+        memory_budget_bytes (int): Memory the strips in flight may use.
+        strip_rows (int): Destination rows per strip.
+        width (int): Width of the destination grid in pixels.
+        itemsize (int): Bytes per pixel.
+
+    Returns:
+        int: Number of worker threads, between 1 and the number of CPUs.
+    """
+    strip_bytes = 4 * strip_rows * width * itemsize
+    return max(1, min(os.cpu_count() or 1, memory_budget_bytes // strip_bytes))
+
+# Guards the per-band statistics that the strips of a lazy band add to from several threads
+_STRIP_STATS_LOCK = threading.Lock()
+
+def _warp_strip(href, grid, resampling, dtype, nodata, stats=None, name=None, block_info=None):
+    """
+    Warp the strip of destination rows described by block_info, reading only the window of the asset it covers.
+
+    The time spent opening and reading the asset, the decoded bytes read and the warp time are added
+    to stats[name] when stats is given.
+    """
+    (_, _), (row_start, row_stop), _ = block_info[None]["array-location"]
+    strip = Window(0, row_start, grid.width, row_stop - row_start)
+    strip_transform = window_transform(strip, grid.transform)
+    destination = np.full((1, strip.height, strip.width), nodata, dtype=dtype)
+
+    start = time.perf_counter()
+    source = None
+    with rasterio.open(href, overview_level=0) as src:
+        # Source window of the strip's bounds, with a margin for the resampling kernel
+        bounds = transform_bounds(grid.crs, src.crs, *array_bounds(strip.height, strip.width, strip_transform), densify_pts=21)
+        window = from_bounds(*bounds, transform=src.transform)
+        col_off = max(math.floor(window.col_off) - 2, 0)
+        row_off = max(math.floor(window.row_off) - 2, 0)
+        col_end = min(math.ceil(window.col_off + window.width) + 2, src.width)
+        row_end = min(math.ceil(window.row_off + window.height) + 2, src.height)
+        if col_end > col_off and row_end > row_off:
+            window = Window(col_off, row_off, col_end - col_off, row_end - row_off)
+            source = src.read(1, window=window)
+            read_end = time.perf_counter()
+            reproject(
+                source, destination[0],
+                src_transform=src.window_transform(window), src_crs=src.crs, src_nodata=nodata,
+                dst_transform=strip_transform, dst_crs=grid.crs, dst_nodata=nodata,
+                resampling=resampling,
+            )
+    end = time.perf_counter()
+
+    if stats is not None:
+        if source is None:
+            read_end = end
+        with _STRIP_STATS_LOCK:
+            band_stats = stats.setdefault(name, {})
+            band_stats["fetch_seconds"] = band_stats.get("fetch_seconds", 0.0) + read_end - start
+            band_stats["bytes"] = band_stats.get("bytes", 0) + (source.nbytes if source is not None else 0)
+            band_stats["warp_seconds"] = band_stats.get("warp_seconds", 0.0) + end - read_end
+    return destination
+
+def lazy_warp_band(href, grid, resampling=Resampling.nearest, strip_rows=1024, name=None, stats=None, stats_name=None):
+    """
+    Warp an asset onto the destination grid lazily, as a dask array of strips of destination rows.
+
+    Nothing is read until the band is computed. Each strip then opens the asset at overview level 0,
+    as ``open_band`` does, reads only the source window covering the strip and warps it, so a band
+    can be written strip by strip in bounded memory and its strips warped on several threads. The
+    strips span the full width of the grid because GDAL picks the source pixels of a destination row
+    from the row's whole extent: full-width strips give the output of ``warp_band`` wherever GDAL warps
+    the whole band in one chunk, narrower blocks would not.
+
+    Args:
+        href (str): URL or path of the asset.
+        grid (WarpGrid): Destination grid.
+        resampling (Resampling): Resampling method.
+        strip_rows (int): Destination rows per strip.
+        name (str, optional): Name of the DataArray.
+        stats (dict, optional): Per-band statistics; as the strips are computed, their read times
+            ('fetch_seconds'), the decoded 'bytes' of the source windows they read and their
+            'warp_seconds' are summed under stats[stats_name]. The times add up over strips warped
+            in parallel.
+        stats_name (str, optional): Key of the band in stats.
+
+    Returns:
+        xarray.DataArray: The band on the destination grid, of shape (1, height, width), backed by dask.
+    """
+    import dask.array as da
+
+    with rasterio.open(href, overview_level=0) as src:
+        dtype = src.dtypes[0]
+        nodata = src.nodata if src.nodata is not None else 0
+
+    # Bind the statistics to the function, so that dask passes the dict itself rather than a copy
+    warp_strip = functools.partial(_warp_strip, stats=stats, name=stats_name)
+    data = da.map_blocks(
+        warp_strip, href, grid, resampling, dtype, nodata,
+        chunks=((1,), da.core.normalize_chunks(strip_rows, (grid.height,))[0], (grid.width,)),
+        dtype=dtype, meta=np.empty((0, 0, 0), dtype=dtype),
+    )
+    transform = grid.transform
+    band = xr.DataArray(
+        data,
+        dims=("band", "y", "x"),
+        coords={
+            "band": [1],
+            "y": transform.f + (np.arange(grid.height) + 0.5) * transform.e,
+            "x": transform.c + (np.arange(grid.width) + 0.5) * transform.a,
+        },
+        name=name,
+    )
+    band = band.rio.write_crs(grid.crs).rio.write_transform(transform)
+    return band.rio.write_nodata(nodata, encoded=False)
+
+def iter_lazy_bands(item, band_names, grid=None, strip_rows=1024, stats=None):
+    """
+    Lazy counterpart of ``iter_warped_bands``: build the warp of every requested band as a dask graph.
+
+    Args:
+        item (pystac.Item): Sentinel-2 item.
+        band_names (list): Asset names to warp.
+        grid (WarpGrid, optional): Destination grid. Defaults to the item's 10 m grid.
+        strip_rows (int): Destination rows per strip.
+        stats (dict, optional): Per-band statistics, filled by ``lazy_warp_band`` as the bands are computed.
+
+    Yields:
+        tuple: (band name, lazy xarray.DataArray named 'ds<band name>' on the destination grid).
+    """
+    if grid is None:
+        grid = item_destination_grid(item)
+
+    for name in band_names:
+        resampling = BAND_RESAMPLING.get(name, Resampling.nearest)
+        yield name, lazy_warp_band(item.assets[name].href, grid, resampling, strip_rows, f"ds{name}", stats, name)
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+from shapely import STRtree, box
+from shapely.geometry import shape
+from point_coverage import PointCoverageIndex
+
+def point_bbox(lon, lat, shift_meters=300):
+    """
+    Calculate the bounding box around a point with a buffer in meters, as the per-point searches do.
+
+    Args:
+        lon (float): Longitude of the point.
+        lat (float): Latitude of the point.
+        shift_meters (float): Buffer distance in meters.
+
+    Returns:
+        list: Bounding box [min_lon, min_lat, max_lon, max_lat], clamped to valid coordinates.
+    """
+    lat_shift_deg = shift_meters / 111000
+    lon_shift_deg = shift_meters / (111000 * math.cos(math.radians(lat)))
+
+    return [
+        max(lon - lon_shift_deg, -180),
+        max(lat - lat_shift_deg, -90),
+        min(lon + lon_shift_deg, 180),
+        min(lat + lat_shift_deg, 90),
+    ]
+
+def region_bboxes(lons, lats, region_degrees=5.0, shift_meters=300):
+    """
+    Split points into square regions and compute one search bounding box per non-empty region.
+
+    Each bounding box covers the buffered boxes of all points of its region, so one search per region
+    finds every item a per-point search would find for any of its points.
+
+    Args:
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+        region_degrees (float): Side of the regions in degrees.
+        shift_meters (float): Buffer around each point in meters.
+
+    Returns:
+        list: Bounding boxes [min_lon, min_lat, max_lon, max_lat], one per region holding points.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    # Same buffer as point_bbox, computed for all points at once
+    lat_shift = shift_meters / 111000
+    lon_shift = shift_meters / (111000 * np.cos(np.radians(lats)))
+
+    cells = np.stack([np.floor(lons / region_degrees), np.floor(lats / region_degrees)], axis=1)
+    _, region = np.unique(cells, axis=0, return_inverse=True)
+    region = region.ravel()
+
+    bboxes = []
+    for r in range(region.max() + 1 if len(region) else 0):
+        members = region == r
+        bboxes.append([
+            max(float((lons[members] - lon_shift[members]).min()), -180),
+            max(float((lats[members] - lat_shift).min()), -90),
+            min(float((lons[members] + lon_shift[members]).max()), 180),
+            min(float((lats[members] + lat_shift).max()), 90),
+        ])
+    return bboxes
+
+def search_region_items(catalog, lons, lats, date_range, region_degrees=5.0, shift_meters=300, collections=("sentinel-2-l2a",)):
+    """
+    Collect the items covering a set of points with one STAC search per region instead of one per point.
+
+    Args:
+        catalog (pystac_client.Client): STAC catalog.
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+        date_range (str): Time range of the search.
+        region_degrees (float): Side of the search regions in degrees.
+        shift_meters (float): Buffer around each point in meters.
+        collections (tuple): Collections to search.
+
+    Returns:
+        list: Unique pystac.Item objects found in all regions.
+    """
+    items = {}
+    bboxes = region_bboxes(lons, lats, region_degrees, shift_meters)
+    for i, bbox in enumerate(bboxes):
+        found = catalog.search(collections=list(collections), bbox=bbox, datetime=date_range).item_collection()
+        print(f"Region {i + 1}/{len(bboxes)} {[round(v, 3) for v in bbox]}: {len(found)} items")
+        for item in found:
+            items.setdefault(item.id, item)
+
+    return list(items.values())
+
+class ItemFootprintIndex:
+    """
+    In-memory spatial index of item footprints, answering the per-point searches without the catalog.
+
+    Args:
+        items (list): pystac.Item objects, e.g. from ``search_region_items``.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.footprints = [shape(item.geometry) for item in items]
+        self.tree = STRtree(self.footprints)
+        self.cloud_cover = np.array([item.properties.get("eo:cloud_cover", 100.0) for item in items], dtype=float)
+        centroids = [footprint.centroid for footprint in self.footprints]
+        self.centroids = np.array([(c.x, c.y) for c in centroids]).reshape(-1, 2)
+
+    def best_item(self, lon, lat, shift_meters=300):
+        """
+        Pick the item for a point: the least cloudy footprint intersecting the point's buffered box,
+        ties broken by the distance from the point to the footprint's centroid.
+
+        Args:
+            lon (float): Longitude of the point.
+            lat (float): Latitude of the point.
+            shift_meters (float): Buffer around the point in meters.
+
+        Returns:
+            int: Index of the selected item in ``items``, or None if no footprint covers the point.
+        """
+        candidates = self.tree.query(box(*point_bbox(lon, lat, shift_meters)), predicate="intersects")
+        if len(candidates) == 0:
+            return None
+
+        distance = np.hypot(self.centroids[candidates, 0] - lon, self.centroids[candidates, 1] - lat)
+        # lexsort sorts by the last key first
+        order = np.lexsort((distance, self.cloud_cover[candidates]))
+        return int(candidates[order[0]])
+
+def assign_points(lons, lats, items, shift_meters=300):
+    """
+    Assign points to items the way the per-point loops do, using the footprint index instead of searches.
+
+    The first unprocessed point selects its best item; every point inside that item's bounding box is
+    assigned to it and marked processed, and the loop moves on to the next unprocessed point. As in
+    the per-point loops, a point can be listed for several items when their bounding boxes overlap.
+
+    Args:
+        lons (array-like): Longitudes of the points.
+        lats (array-like): Latitudes of the points.
+        items (list): Candidate pystac.Item objects covering the points.
+        shift_meters (float): Buffer around each point in meters.
+
+    Yields:
+        tuple: (pystac.Item or None, row numbers of the points assigned to it, in ascending order).
+        None is yielded with a single point when no item covers that point.
+    """
+    coverage = PointCoverageIndex(lons, lats)
+    index = ItemFootprintIndex(items) if items else None
+
+    while True:
+        row = coverage.next_uncovered()
+        if row is None:
+            break
+
+        selected = index.best_item(coverage.lons[row], coverage.lats[row], shift_meters) if index is not None else None
+        if selected is None:
+            coverage.mark_covered([row])
+            yield None, np.array([row])
+            continue
+
+        item = items[selected]
+        rows = coverage.query_bbox(*item.bbox)
+        coverage.mark_covered(rows)
+        # The selecting point counts as processed even if it lies just outside the item's bbox
+        coverage.mark_covered([row])
+        yield item, rows
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import planetary_computer
+import pystac
+
+class StacCache:
+    """
+    On-disk cache of STAC search results.
+
+    Results are keyed by the normalized query (collections, bbox, datetime, ids and any extra filter)
+    and stored as one JSON file per query. Entries older than ttl_seconds are searched again, and the
+    least recently used entries are evicted once the cache grows beyond max_bytes. Asset hrefs are
+    stored without their SAS tokens and signed again every time an entry is reused, so cached items
+    never carry expired tokens.
+
+    Args:
+        cache_dir (str): Directory holding the cache files.
+        ttl_seconds (float, optional): Age after which an entry is refreshed. None keeps entries forever,
+            which together with sign=None lets a recorded cache be replayed fully offline.
+        max_bytes (int): Size above which the least recently used entries are deleted.
+        sign (callable, optional): Signs a pystac.ItemCollection in place of the stored hrefs.
+            Defaults to ``planetary_computer.sign``; None returns the unsigned hrefs.
+    """
+
+    def __init__(self, cache_dir, ttl_seconds=7 * 24 * 3600, max_bytes=512 * 1024 * 1024, sign=planetary_computer.sign):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sign = sign
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_query(collections=None, bbox=None, datetime=None, ids=None, **extra):
+        """
+        Normalize a search query so that equivalent queries share one cache entry.
+
+        Args:
+            collections (list, optional): Collection IDs.
+            bbox (list, optional): [min_lon, min_lat, max_lon, max_lat], rounded to 1e-6 degrees.
+            datetime (str, optional): Datetime or range.
+            ids (list, optional): Item IDs.
+            **extra: Other search arguments, e.g. ``query``.
+
+        Returns:
+            dict: The normalized query.
+        """
+        query = {
+            "collections": sorted(collections) if collections else None,
+            "bbox": [round(float(v), 6) for v in bbox] if bbox is not None else None,
+            "datetime": datetime,
+            "ids": sorted(ids) if ids else None,
+        }
+        query.update(extra)
+        return query
+
+    def _path(self, query):
+        key = hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def search(self, catalog, **query):
+        """
+        Search the catalog through the cache.
+
+        Args:
+            catalog (pystac_client.Client): STAC catalog, only queried on a cache miss.
+            **query: Arguments of ``catalog.search``.
+
+        Returns:
+            pystac.ItemCollection: The matching items, with signed hrefs.
+        """
+        normalized = self.normalize_query(**query)
+        path = self._path(normalized)
+
+        entry = self._load(path)
+        if entry is None:
+            items = catalog.search(**query).item_collection()
+            entry = {"query": normalized, "created": time.time(), "items": _strip_tokens(items.to_dict())}
+            self._store(path, entry)
+            self._evict()
+
+        items = pystac.ItemCollection.from_dict(entry["items"])
+        if self.sign is not None:
+            items = self.sign(items)
+        return items
+
+    def _load(self, path):
+        """
+        Read a cache entry, returning None when it is missing, unreadable or expired.
+        """
+        try:
+            with open(path) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry["created"] > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already removed by another process
+                pass
+            return None
+
+        # Mark the entry as recently used for eviction; an entry evicted meanwhile counts as a miss
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def _store(self, path, entry):
+        """
+        Write a cache entry atomically, so that concurrent processes never read a partial file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def _strip_tokens(item_collection):
+    """
+    Remove the query string (SAS token) from every asset href of a serialized ItemCollection.
+    """
+    for feature in item_collection["features"]:
+        for asset in feature.get("assets", {}).values():
+            parts = urlsplit(asset["href"])
+            asset["href"] = urlunsplit(parts._replace(query=""))
+    return item_collection
+
+class CachedCatalog:
+    """
+    Wrapper exposing a catalog's ``search`` through a StacCache, so existing
+    ``catalog.search(...).item_collection()`` calls use the cache unchanged.
+
+    Args:
+        catalog (pystac_client.Client): STAC catalog, only queried on cache misses.
+        stac_cache (StacCache): Cache of search results.
+    """
+
+    def __init__(self, catalog, stac_cache):
+        self.catalog = catalog
+        self.stac_cache = stac_cache
+
+    def search(self, **query):
+        return _CachedSearch(self.catalog, self.stac_cache, query)
+
+class _CachedSearch:
+    """
+    Deferred search returned by CachedCatalog.search, resolved by item_collection().
+    """
+
+    def __init__(self, catalog, stac_cache, query):
+        self.catalog = catalog
+        self.stac_cache = stac_cache
+        self.query = query
+
+    def item_collection(self):
+        return self.stac_cache.search(self.catalog, **self.query)
+
+def cached_catalog(catalog, stac_cache_dir=None, ttl_hours=168):
+    """
+    Route a catalog's searches through an on-disk cache when a cache directory is given.
+
+    Args:
+        catalog (pystac_client.Client): STAC catalog.
+        stac_cache_dir (str, optional): Directory of the cache. The catalog is returned as-is if None.
+        ttl_hours (float): Age after which cached searches are refreshed; 0 keeps them forever.
+
+    Returns:
+        The catalog, or a CachedCatalog wrapping it.
+    """
+    if not stac_cache_dir:
+        return catalog
+    return CachedCatalog(catalog, StacCache(stac_cache_dir, ttl_hours * 3600 or None))
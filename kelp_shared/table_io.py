@@ -0,0 +1,304 @@
+import glob
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# Formats of the intermediate point and tile tables, chosen by file extension
+TABLE_FORMATS = ("csv", "parquet")
+
+# Compact dtypes of the known columns of the point and tile tables. Columns missing from a table are
+# ignored and other columns keep their dtype.
+COLUMN_DTYPES = {
+    "latitude": "float32",
+    "longitude": "float32",
+    "Latitude": "float32",
+    "Longitude": "float32",
+    "station": "int32",
+    "year": "int16",
+    "quarter": "int8",
+    "ID": "int32",
+    "processed_flag": "int8",
+    "proccessed_flag": "int8",
+    "asset": "category",
+    "time": "category",
+}
+
+def table_format(path):
+    """
+    Get the format of a table file from its extension.
+
+    Args:
+        path (str): Path of the table.
+
+    Returns:
+        str: 'parquet' for .parquet files, 'csv' otherwise.
+    """
+    return "parquet" if path.endswith(".parquet") else "csv"
+
+def table_path(base_path, fmt="csv"):
+    """
+    Add the extension of a table format to a path.
+
+    Args:
+        base_path (str): Path without extension.
+        fmt (str): 'csv' or 'parquet'.
+
+    Returns:
+        str: The path with the format's extension.
+    """
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format {fmt}, expected one of {TABLE_FORMATS}")
+    return f"{base_path}.{fmt}"
+
+def list_tables(folder_path):
+    """
+    List the CSV and Parquet tables of a folder.
+
+    Args:
+        folder_path (str): Folder holding the tables.
+
+    Returns:
+        list: Paths of the tables.
+    """
+    return glob.glob(os.path.join(folder_path, "*.csv")) + glob.glob(os.path.join(folder_path, "*.parquet"))
+
+def compact_dtypes(df):
+    """
+    Convert the known columns of a table to their compact dtypes.
+
+    Integer columns holding missing values keep their dtype. Datetime 'time' columns are stored as the
+    same date strings the CSV files hold.
+
+    Args:
+        df (pandas.DataFrame): Table to convert.
+
+    Returns:
+        pandas.DataFrame: The table with converted columns; the other columns are not copied.
+    """
+    converted = {}
+    for column, dtype in COLUMN_DTYPES.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if column == "time" and pd.api.types.is_datetime64_any_dtype(values):
+            values = values.astype(str)
+        if dtype.startswith("int") and values.isna().any():
+            continue
+        converted[column] = values.astype(dtype)
+    return df.assign(**converted)
+
+def write_table(df, path, index=False):
+    """
+    Write a table as CSV or Parquet, depending on the path's extension.
+
+    Parquet tables get compact dtypes (float32 coordinates, categorical asset IDs and dates), and
+    categorical columns always use int32 dictionary indices so that the files of one folder share a
+    schema and can be read as a single dataset.
+
+    Args:
+        df (pandas.DataFrame): Table to write.
+        path (str): Output path, ending in .csv or .parquet.
+        index (bool): Write the DataFrame's index as columns.
+    """
+    if table_format(path) == "csv":
+        df.to_csv(path, index=index)
+        return
+
+    import pyarrow.parquet as pq
+
+    if index:
+        df = df.reset_index()
+    table = _arrow_table(df)
+    pq.write_table(table, path, compression="zstd")
+
+def _arrow_table(df, schema=None):
+    """
+    Convert a DataFrame to an Arrow table with compact dtypes and int32 dictionary indices, or to a
+    given schema.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(compact_dtypes(df), preserve_index=False)
+    if schema is None:
+        # Fix the dictionary index type, which pandas otherwise picks from the number of categories
+        schema = pa.schema([
+            field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+            for field in table.schema
+        ])
+    return table.select(schema.names).cast(schema)
+
+class TableWriter:
+    """
+    Write a CSV or Parquet table incrementally, one DataFrame chunk at a time.
+
+    CSV chunks are appended after a single header; Parquet chunks become row groups of one file, with
+    the schema of the first chunk. The files are the same as write_table would produce for the
+    concatenated chunks.
+
+    Args:
+        path (str): Output path, ending in .csv or .parquet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.columns = None
+        self._file = None
+        self._writer = None
+
+    def write(self, df):
+        """
+        Append a chunk to the table. The first chunk, even if empty, sets the columns and their order.
+
+        Args:
+            df (pandas.DataFrame): Rows to append.
+        """
+        if self.columns is None:
+            self.columns = list(df.columns)
+        else:
+            df = df[self.columns]
+
+        if table_format(self.path) == "csv":
+            if self._file is None:
+                self._file = open(self.path, "w", newline="")
+                df.to_csv(self._file, index=False)
+            else:
+                df.to_csv(self._file, index=False, header=False)
+        else:
+            import pyarrow.parquet as pq
+
+            if self._writer is None:
+                table = _arrow_table(df)
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            else:
+                table = _arrow_table(df, self._writer.schema)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        """
+        Flush and close the table.
+        """
+        if self._file is not None:
+            self._file.close()
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _filter_frame(df, filters):
+    """
+    Apply Parquet-style filters, e.g. [('biomass', '>', 0)], to a DataFrame read from CSV.
+    """
+    operators = {
+        "==": lambda s, v: s == v,
+        "=": lambda s, v: s == v,
+        "!=": lambda s, v: s != v,
+        ">": lambda s, v: s > v,
+        ">=": lambda s, v: s >= v,
+        "<": lambda s, v: s < v,
+        "<=": lambda s, v: s <= v,
+        "in": lambda s, v: s.isin(v),
+        "not in": lambda s, v: ~s.isin(v),
+    }
+    for column, op, value in filters:
+        df = df[operators[op](df[column], value)]
+    return df
+
+def read_table(path, columns=None, filters=None):
+    """
+    Read a CSV or Parquet table, depending on the path's extension.
+
+    With Parquet, only the requested columns are read and the filters are applied while scanning the
+    file; with CSV, the same selection is applied after parsing.
+
+    Args:
+        path (str): Path of the table.
+        columns (list, optional): Columns to read. All columns if None.
+        filters (list, optional): (column, operator, value) tuples that rows must all match.
+
+    Returns:
+        pandas.DataFrame: The table.
+    """
+    return read_tables([path], columns, filters)
+
+def read_tables(paths, columns=None, filters=None):
+    """
+    Read several CSV and Parquet tables into one DataFrame.
+
+    All Parquet files are scanned as one dataset, with column and predicate pushdown.
+
+    Args:
+        paths (list): Paths of the tables.
+        columns (list, optional): Columns to read. All columns if None.
+        filters (list, optional): (column, operator, value) tuples that rows must all match.
+
+    Returns:
+        pandas.DataFrame: The concatenated tables.
+    """
+    parquet_paths = [path for path in paths if table_format(path) == "parquet"]
+    csv_paths = [path for path in paths if table_format(path) == "csv"]
+
+    dfs = []
+    if parquet_paths:
+        import pyarrow.parquet as pq
+        dfs.append(pq.read_table(parquet_paths, columns=columns, filters=filters).to_pandas())
+    for path in csv_paths:
+        df = pd.read_csv(path, usecols=columns)
+        dfs.append(_filter_frame(df, filters) if filters else df)
+
+    if len(dfs) == 1:
+        return dfs[0]
+    return pd.concat(dfs, ignore_index=True)
+
+def _read_typed(path, columns=None, dtypes=None):
+    """
+    Read one table with only the given columns, converted to the given dtypes.
+    """
+    dtypes = dtypes or {}
+    if table_format(path) == "csv":
+        # Parse the columns straight into their dtypes instead of inferring and converting them;
+        # usecols keeps the file's column order, so restore the requested one
+        df = pd.read_csv(path, usecols=columns, dtype=dtypes)
+        return df[columns] if columns is not None else df
+
+    df = read_table(path, columns)
+    return df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+
+def iter_tables(paths, columns=None, dtypes=None, workers=4):
+    """
+    Read tables in parallel threads and yield them one at a time, in the order of the paths.
+
+    At most 2 * workers tables are read ahead, so memory is bounded by a few tables however many paths
+    are given.
+
+    Args:
+        paths (list): Paths of the CSV or Parquet tables.
+        columns (list, optional): Columns to read. All columns if None.
+        dtypes (dict, optional): dtype of each column, e.g. {'Latitude': 'float64', 'asset': 'category'},
+            so that the tables of a stream share their dtypes.
+        workers (int): Number of reading threads.
+
+    Yields:
+        tuple: (path, pandas.DataFrame).
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append((path, executor.submit(_read_typed, path, columns, dtypes)))
+            if len(pending) >= 2 * workers:
+                break
+
+        while pending:
+            path, future = pending.popleft()
+            # Keep the read-ahead window full while the caller works on this table
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(_read_typed, next_path, columns, dtypes)))
+            yield path, future.result()
@@ -0,0 +1,276 @@
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+def geotiff_profile(grid, count, dtype="uint16", nodata=0):
+    """
+    Build the rasterio profile of a stacked tile GeoTIFF on a destination grid.
+
+    Args:
+        grid (WarpGrid): Destination grid shared by all bands.
+        count (int): Number of bands.
+        dtype (str): Data type of every band.
+        nodata (int): No-data value.
+
+    Returns:
+        dict: Profile for ``rasterio.open(path, 'w', **profile)``.
+    """
+    return {
+        "driver": "GTiff",
+        "height": grid.height,
+        "width": grid.width,
+        "count": count,
+        "dtype": dtype,
+        "crs": grid.crs,
+        "transform": grid.transform,
+        "nodata": nodata,
+        # Band interleaving keeps each band's strips separate, so a band can be written and flushed
+        # without touching the others
+        "interleave": "band",
+    }
+
+def iter_band_blocks(band, height, width):
+    """
+    Compute a band on a (height, width) grid block by block.
+
+    A NumPy-backed band is one block. A dask-backed band, e.g. from ``lazy_warp_band``, is computed
+    one batch of chunks at a time, as many chunks per batch as the configured dask 'num_workers', so
+    only that many blocks are held in memory while they are written. The chunks of a batch are
+    computed in parallel with dask's configured scheduler.
+
+    Args:
+        band (xarray.DataArray): Band of shape (1, height, width).
+        height (int): Grid height in pixels.
+        width (int): Grid width in pixels.
+
+    Yields:
+        tuple: (row slice, column slice, 2-D NumPy array of the block).
+    """
+    if band.chunks is None:
+        yield slice(0, height), slice(0, width), band.values.reshape(height, width)
+        return
+
+    import dask
+
+    data = band.data.reshape(height, width)
+    slices = []
+    row_start = 0
+    for rows in data.chunks[0]:
+        col_start = 0
+        for cols in data.chunks[1]:
+            slices.append((slice(row_start, row_start + rows), slice(col_start, col_start + cols)))
+            col_start += cols
+        row_start += rows
+
+    batch_size = dask.config.get("num_workers", None) or os.cpu_count() or 1
+    for start in range(0, len(slices), batch_size):
+        batch = slices[start:start + batch_size]
+        blocks = dask.compute(*[data[rows, cols] for rows, cols in batch])
+        for (rows, cols), block in zip(batch, blocks):
+            yield rows, cols, block
+
+def write_band(dst, index, band, name):
+    """
+    Write one band into its slot of an open GeoTIFF, block by block if it is backed by dask.
+
+    Args:
+        dst (rasterio.io.DatasetWriter): GeoTIFF opened for writing.
+        index (int): 1-based band index in the file.
+        band (xarray.DataArray): Band of shape (1, height, width) on the file's grid.
+        name (str): Band name, stored as the band description.
+    """
+    if band.shape[-2:] != (dst.height, dst.width):
+        raise ValueError(f"Band {name} has shape {band.shape[-2:]}, expected {(dst.height, dst.width)}")
+
+    for rows, cols, values in iter_band_blocks(band, dst.height, dst.width):
+        window = Window(cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start)
+        dst.write(values.astype(dst.dtypes[index - 1], copy=False), index, window=window)
+    dst.set_band_description(index, name)
+
+def write_bands(dst, bands, band_names, stats=None):
+    """
+    Stream bands into an open GeoTIFF as they are produced, holding only one band in memory at a time.
+
+    Args:
+        dst (rasterio.io.DatasetWriter): GeoTIFF opened for writing with one slot per band name.
+        bands (iterable): (name, xarray.DataArray) pairs, e.g. from ``iter_warped_bands``.
+        band_names (list): Names of all bands, in file order.
+        stats (dict, optional): Per-band statistics; 'write_seconds' is stored under stats[name].
+    """
+    for name, band in bands:
+        start = time.perf_counter()
+        write_band(dst, band_names.index(name) + 1, band, name)
+        if stats is not None:
+            stats.setdefault(name, {})["write_seconds"] = time.perf_counter() - start
+        # Release the band before the next one is produced
+        del band
+
+def write_bands_geotiff(path, grid, bands, band_names, dtype="uint16", stats=None):
+    """
+    Stream bands into a GeoTIFF file as they are produced.
+
+    Args:
+        path (str): Output GeoTIFF path.
+        grid (WarpGrid): Destination grid shared by all bands.
+        bands (iterable): (name, xarray.DataArray) pairs, e.g. from ``iter_warped_bands``.
+        band_names (list): Names of all bands, in file order.
+        dtype (str): Data type of every band.
+        stats (dict, optional): Per-band statistics, filled by ``write_bands``.
+
+    Returns:
+        str: The output path.
+    """
+    with rasterio.open(path, "w", **geotiff_profile(grid, len(band_names), dtype)) as dst:
+        write_bands(dst, bands, band_names, stats)
+
+    return path
+
+def write_bands_geotiff_bytes(grid, bands, band_names, dtype="uint16", stats=None):
+    """
+    Stream bands into an in-memory GeoTIFF as they are produced, without touching the local disk.
+
+    Args:
+        grid (WarpGrid): Destination grid shared by all bands.
+        bands (iterable): (name, xarray.DataArray) pairs, e.g. from ``warp_bands``.
+        band_names (list): Names of all bands, in file order.
+        dtype (str): Data type of every band.
+        stats (dict, optional): Per-band statistics, filled by ``write_bands``.
+
+    Returns:
+        bytes: The encoded GeoTIFF.
+    """
+    with MemoryFile() as memfile:
+        with memfile.open(**geotiff_profile(grid, len(band_names), dtype)) as dst:
+            write_bands(dst, bands, band_names, stats)
+        return memfile.read()
+
+def zarr_compressors(spec="blosc-zstd:3"):
+    """
+    Build the Zarr compressors from a 'name:level' spec.
+
+    Args:
+        spec (str): 'blosc-zstd', 'blosc-lz4', 'zstd' or 'gzip', optionally followed by ':level', or
+            'none' for uncompressed chunks. The Blosc compressors shuffle the bytes of every value
+            first, which suits uint16 reflectances.
+
+    Returns:
+        list: Compressors for ``zarr.create_array``.
+    """
+    import zarr.codecs
+
+    name, _, level = spec.partition(":")
+    level = int(level) if level else None
+    if name == "none":
+        return []
+    if name.startswith("blosc-"):
+        return [zarr.codecs.BloscCodec(cname=name[len("blosc-"):], clevel=5 if level is None else level, shuffle="shuffle")]
+    if name == "zstd":
+        return [zarr.codecs.ZstdCodec(level=3 if level is None else level)]
+    if name == "gzip":
+        return [zarr.codecs.GzipCodec(level=6 if level is None else level)]
+    raise ValueError(f"Unknown Zarr compressor: {spec}")
+
+def write_bands_zarr(path, grid, bands, band_names, chunk_size=1024, compressor="blosc-zstd:3", dtype="uint16", nodata=0, stats=None):
+    """
+    Stream bands into a Zarr store as they are produced, one spatially chunked array per band.
+
+    Every band is its own (y, x) array of chunk_size x chunk_size chunks, so readers fetch only the
+    bands and windows they need, in parallel, instead of whole strips of a GeoTIFF. The pixel centre
+    coordinates are stored as 'x' and 'y' arrays and the CRS and transform in a CF 'spatial_ref'
+    variable, so ``xarray.open_zarr`` returns the bands on their grid and rioxarray finds the CRS.
+    The root metadata is written last and consolidated, so a store without it is incomplete.
+
+    Args:
+        path (str): Output directory of the store, e.g. '<itemID>.zarr'; replaced if it exists.
+        grid (WarpGrid): Destination grid shared by all bands.
+        bands (iterable): (name, xarray.DataArray) pairs, e.g. from ``iter_warped_bands``.
+        band_names (list): Names of all bands, in store order.
+        chunk_size (int): Side of the square chunks in pixels.
+        compressor (str): Compressor spec, see ``zarr_compressors``.
+        dtype (str): Data type of every band.
+        nodata (int): No-data value, stored as the fill value and 'nodata' attribute of every band. It is
+            not a CF '_FillValue', so xarray keeps the bands as integers instead of masking them.
+        stats (dict, optional): Per-band statistics; 'write_seconds' is stored under stats[name].
+
+    Returns:
+        str: The output path.
+    """
+    import zarr
+
+    root = zarr.open_group(path, mode="w", zarr_format=3)
+    compressors = zarr_compressors(compressor)
+    chunks = (min(chunk_size, grid.height), min(chunk_size, grid.width))
+
+    transform = grid.transform
+    root.create_array("x", data=transform.c + (np.arange(grid.width) + 0.5) * transform.a, dimension_names=("x",))
+    root.create_array("y", data=transform.f + (np.arange(grid.height) + 0.5) * transform.e, dimension_names=("y",))
+    spatial_ref = root.create_array("spatial_ref", shape=(), dtype="int64", fill_value=0, dimension_names=())
+    crs_wkt = rasterio.crs.CRS.from_user_input(grid.crs).to_wkt()
+    spatial_ref.attrs.update({
+        "crs_wkt": crs_wkt,
+        "spatial_ref": crs_wkt,
+        # GDAL order: x origin, x pixel size, row rotation, y origin, column rotation, y pixel size
+        "GeoTransform": " ".join(str(value) for value in transform.to_gdal()),
+    })
+
+    for name, band in bands:
+        start = time.perf_counter()
+        if band.shape[-2:] != (grid.height, grid.width):
+            raise ValueError(f"Band {name} has shape {band.shape[-2:]}, expected {(grid.height, grid.width)}")
+        array = root.create_array(
+            name, shape=(grid.height, grid.width), chunks=chunks, dtype=dtype, fill_value=nodata,
+            compressors=compressors, dimension_names=("y", "x"),
+            attributes={"grid_mapping": "spatial_ref", "coordinates": "spatial_ref", "nodata": nodata},
+        )
+        for rows, cols, values in iter_band_blocks(band, grid.height, grid.width):
+            array[rows, cols] = values.astype(dtype, copy=False)
+        if stats is not None:
+            stats.setdefault(name, {})["write_seconds"] = time.perf_counter() - start
+        # Release the band before the next one is produced
+        del band
+
+    root.attrs.update({"bands": list(band_names), "crs": crs_wkt, "transform": list(transform)[:6]})
+    with warnings.catch_warnings():
+        # Consolidated metadata is an extension of Zarr format 3, read by zarr-python and xarray
+        warnings.simplefilter("ignore")
+        zarr.consolidate_metadata(path, zarr_format=3)
+    return path
+
+def upload_directory(s3_client, path, bucket, prefix, max_workers=16, last=("zarr.json",)):
+    """
+    Upload every file of a local directory, e.g. a Zarr store, under an S3 prefix.
+
+    The many small chunk files of a store are uploaded in parallel. The files named in last are
+    uploaded at the end, so a store interrupted during the upload has no root metadata and is
+    recognised as incomplete.
+
+    Args:
+        s3_client (boto3.client): Boto3 S3 client.
+        path (str): Local directory.
+        bucket (str): S3 bucket name.
+        prefix (str): Key prefix the relative file paths are appended to, e.g. 'folder/<itemID>.zarr'.
+        max_workers (int): Number of files uploaded at the same time.
+        last (tuple): Relative paths uploaded after all the others.
+
+    Returns:
+        int: Total size of the uploaded files in bytes.
+    """
+    files = []
+    for folder, _, names in os.walk(path):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(folder, name), path).replace(os.sep, "/"))
+    first = [name for name in files if name not in last]
+    final = [name for name in files if name in last]
+
+    def upload(name):
+        s3_client.upload_file(os.path.join(path, name), bucket, f"{prefix}/{name}")
+        return os.path.getsize(os.path.join(path, name))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        size = sum(executor.map(upload, first))
+    return size + sum(upload(name) for name in final)
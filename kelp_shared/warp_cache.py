@@ -0,0 +1,283 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import xarray as xr
+from affine import Affine
+from rasterio.enums import Resampling
+
+from band_stacking import DST_CRS, REFERENCE_BAND, WarpGrid, destination_grid, open_band, warp_band
+
+class WarpPlan:
+    """
+    Nearest-neighbour pixel mapping from one source grid onto one destination grid.
+
+    The mapping is obtained by warping the row and column numbers of the source grid with GDAL,
+    exactly as a band would be warped, so applying it picks the same source pixel GDAL would for every
+    destination pixel. It is only used for bands with the data type, nodata value and attributes of the
+    band it was built from, which makes GDAL process both warps in the same chunks and keeps the
+    output identical.
+
+    Args:
+        band (xarray.DataArray): uint16 band on the source grid, of shape (1, height, width).
+        grid (WarpGrid): Destination grid.
+    """
+
+    def __init__(self, band, grid):
+        height, width = band.rio.height, band.rio.width
+        # Numbered from 1 so that no source pixel takes the nodata value 0
+        rows = np.broadcast_to(np.arange(1, height + 1, dtype=np.uint16)[:, None], (height, width))
+        cols = np.broadcast_to(np.arange(1, width + 1, dtype=np.uint16)[None, :], (height, width))
+        warped_rows = warp_band(band.copy(data=rows.reshape(band.shape)), grid, Resampling.nearest)
+        warped_cols = warp_band(band.copy(data=cols.reshape(band.shape)), grid, Resampling.nearest)
+
+        self.nodata = warped_rows.rio.nodata
+        outside = (warped_rows.values == self.nodata).reshape(-1)
+        index = (warped_rows.values.reshape(-1).astype(np.int32) - 1) * width + warped_cols.values.reshape(-1) - 1
+        index[outside] = 0
+        self.index = index
+        self.outside = np.flatnonzero(outside)
+
+        self.dtype = band.dtype
+        self.source_nodata = band.rio.nodata
+        self.source_attrs = dict(band.attrs)
+        self.dims = warped_rows.dims
+        self.shape = warped_rows.shape
+        self.coords = warped_rows.coords
+        self.attrs = dict(warped_rows.attrs)
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.outside.nbytes
+
+    def matches(self, band):
+        """
+        Check that a band can be warped with this plan and give the same result as GDAL.
+        """
+        return band.dtype == self.dtype and band.rio.nodata == self.source_nodata and dict(band.attrs) == self.source_attrs
+
+    def apply(self, band):
+        """
+        Warp a band with the plan.
+
+        Args:
+            band (xarray.DataArray): Band on the plan's source grid.
+
+        Returns:
+            xarray.DataArray: The band on the destination grid, as ``warp_band`` would return it.
+        """
+        values = np.take(band.values.reshape(-1), self.index)
+        values[self.outside] = self.nodata
+        warped = xr.DataArray(values.reshape(self.shape), coords=self.coords, dims=self.dims, name=band.name, attrs=dict(self.attrs))
+        warped.encoding = band.encoding
+        return warped
+
+    @staticmethod
+    def eligible(band, resampling):
+        """
+        Check whether a plan can be built from a band: nearest resampling of a uint16 band whose row and
+        column numbers fit in uint16 without reaching its nodata value.
+        """
+        nodata = band.rio.nodata
+        size = max(band.rio.height, band.rio.width)
+        return (
+            resampling == Resampling.nearest
+            and band.dtype == np.uint16
+            and band.ndim == 3
+            and size < np.iinfo(np.uint16).max
+            and (nodata is None or nodata == 0 or nodata > size)
+        )
+
+class WarpCache:
+    """
+    Cache of the warp setup shared by every acquisition of the same Sentinel-2 tile.
+
+    Two things are reused:
+
+    - Destination grids, keyed by the CRS, transform and shape of the reference asset as published in
+      the item's STAC projection metadata. They are kept on disk as small JSON files, so later runs over
+      the same tiles find the grid without opening the reference asset, and the least recently used
+      files are deleted beyond max_grids.
+    - Warp plans (see ``WarpPlan``), keyed by the source and destination grids, kept in memory up to
+      max_plan_bytes. Every nearest-neighbour uint16 band of a tile on the same source grid then costs an
+      array lookup instead of a GDAL warp. Plans hold 4 bytes per destination pixel, about 500 MB for a
+      full tile, so they are not written to disk: reading one back costs about as much as rebuilding it.
+      A tile has two plans, for its 10 m bands and for its 20 m ones (SCL, WVP, AOT), and the default
+      budget holds both. A plan never evicts another plan onto the same destination grid, and no plan
+      is built when it cannot fit next to them.
+
+    Args:
+        cache_dir (str, optional): Directory of the grid files; grids are only kept in memory if None.
+        max_grids (int): Number of grid files above which the least recently used ones are deleted.
+        max_plan_bytes (int): Memory held by warp plans; 0 disables them.
+    """
+
+    def __init__(self, cache_dir=None, max_grids=20000, max_plan_bytes=1152 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.max_grids = max_grids
+        self.max_plan_bytes = max_plan_bytes
+        self.grids = {}
+        self.plans = collections.OrderedDict()
+        self.plan_hits = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def grid_key(item, reference_band=REFERENCE_BAND, dst_crs=DST_CRS):
+        """
+        Key of an item's destination grid, from its STAC projection metadata.
+
+        Args:
+            item (pystac.Item): Sentinel-2 item.
+            reference_band (str): Name of a 10 m asset of the item.
+            dst_crs (str): Target CRS.
+
+        Returns:
+            dict: The key, or None when the item does not publish the grid of the reference asset.
+        """
+        asset = item.assets[reference_band]
+        crs = item.properties.get("proj:code") or item.properties.get("proj:epsg")
+        transform = asset.extra_fields.get("proj:transform")
+        shape = asset.extra_fields.get("proj:shape")
+        if crs is None or transform is None or shape is None:
+            return None
+        return {"crs": str(crs), "transform": list(transform)[:6], "shape": list(shape), "band": reference_band, "dst_crs": dst_crs}
+
+    def item_grid(self, item, reference_band=REFERENCE_BAND, dst_crs=DST_CRS):
+        """
+        Destination grid of an item, computed from its reference asset only the first time its source
+        grid is seen.
+
+        Args:
+            item (pystac.Item): Sentinel-2 item.
+            reference_band (str): Name of a 10 m asset of the item.
+            dst_crs (str): Target CRS.
+
+        Returns:
+            WarpGrid: The destination grid shared by all bands of the item.
+        """
+        key = self.grid_key(item, reference_band, dst_crs)
+        if key is None:
+            return destination_grid(open_band(item.assets[reference_band].href), dst_crs)
+
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        grid = self.grids.get(digest) or self._load_grid(digest)
+        if grid is None:
+            grid = destination_grid(open_band(item.assets[reference_band].href), dst_crs)
+            self._store_grid(digest, key, grid)
+        self.grids[digest] = grid
+        return grid
+
+    def _grid_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _load_grid(self, digest):
+        """
+        Read a grid file, returning None when it is missing, unreadable or there is no cache directory.
+        """
+        if not self.cache_dir:
+            return None
+        path = self._grid_path(digest)
+        try:
+            with open(path) as grid_file:
+                entry = json.load(grid_file)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used for eviction; the grid is already read if it was evicted meanwhile
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return WarpGrid(entry["grid"]["crs"], Affine(*entry["grid"]["transform"]), entry["grid"]["height"], entry["grid"]["width"])
+
+    def _store_grid(self, digest, key, grid):
+        """
+        Write a grid file atomically and evict the least recently used ones.
+        """
+        if not self.cache_dir:
+            return
+        entry = {
+            "key": key,
+            "grid": {"crs": str(grid.crs), "transform": list(grid.transform)[:6], "height": grid.height, "width": grid.width},
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as grid_file:
+            json.dump(entry, grid_file)
+        os.replace(tmp_path, self._grid_path(digest))
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                try:
+                    entries.append((os.stat(os.path.join(self.cache_dir, name)).st_mtime, name))
+                except FileNotFoundError:
+                    pass
+        for _, name in sorted(entries)[:max(len(entries) - self.max_grids, 0)]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def warp(self, band, grid, resampling=Resampling.nearest):
+        """
+        Warp a band onto a destination grid, with a warp plan when the band allows it.
+
+        Args:
+            band (xarray.DataArray): Band on its native grid.
+            grid (WarpGrid): Destination grid.
+            resampling (Resampling): Resampling method.
+
+        Returns:
+            xarray.DataArray: The band on the destination grid, identical to ``warp_band``'s result.
+        """
+        if self.max_plan_bytes <= 0 or not WarpPlan.eligible(band, resampling):
+            return warp_band(band, grid, resampling)
+
+        key = (band.rio.crs.to_string(), tuple(band.rio.transform()), band.shape, str(grid.crs), tuple(grid.transform), grid.height, grid.width)
+        with self._lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+
+        if plan is None:
+            # Plans onto the same destination grid serve the other bands of the tile, so they are kept;
+            # a new plan takes at least its 4-byte index per destination pixel next to them
+            with self._lock:
+                kept = sum(p.nbytes for k, p in self.plans.items() if k[3:] == key[3:])
+            if kept + grid.height * grid.width * np.dtype(np.int32).itemsize > self.max_plan_bytes:
+                return warp_band(band, grid, resampling)
+            plan = WarpPlan(band, grid)
+            with self._lock:
+                self.plans[key] = plan
+                # Evict the least recently used plans of other tiles first, this one only as a last resort
+                for old_key in [k for k in self.plans if k[3:] != key[3:]] + [key]:
+                    if sum(p.nbytes for p in self.plans.values()) <= self.max_plan_bytes:
+                        break
+                    del self.plans[old_key]
+        else:
+            self.plan_hits += 1
+
+        if not plan.matches(band):
+            return warp_band(band, grid, resampling)
+        return plan.apply(band)
+
+def open_warp_cache(warp_cache_dir=None, max_plan_mb=1152):
+    """
+    Open a warp cache when a cache directory is given.
+
+    Args:
+        warp_cache_dir (str, optional): Directory of the destination grid files. No cache is used if None.
+        max_plan_mb (float): Memory held by warp plans in megabytes; 0 disables them.
+
+    Returns:
+        WarpCache or None.
+    """
+    if not warp_cache_dir:
+        return None
+    return WarpCache(warp_cache_dir, max_plan_bytes=int(max_plan_mb * 1024 ** 2))
@@ -0,0 +1,310 @@
+import argparse
+import boto3
+import glob
+import os
+import tempfile
+import zlib
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from table_io import TABLE_FORMATS, TableWriter, table_path
+from generate_kelp_mask_tiles import list_s3_folders, clean_folder_name
+
+# Name of the biomass band written by generate_kelp_mask_tiles.py
+MASK_BAND = 'mask_biomass'
+
+def chip_origins(length, size, stride):
+    """
+    Offsets of the chips along one axis of a tile.
+
+    Chips start every stride pixels, and a last chip is aligned on the far edge so that the whole
+    axis is covered. A tile shorter than a chip gets a single chip, padded with nodata.
+
+    Args:
+        length (int): Height or width of the tile in pixels.
+        size (int): Chip size in pixels.
+        stride (int): Distance between the origins of consecutive chips in pixels.
+
+    Returns:
+        list: Chip offsets in pixels.
+    """
+    if length <= size:
+        return [0]
+    origins = list(range(0, length - size + 1, stride))
+    if origins[-1] != length - size:
+        origins.append(length - size)
+    return origins
+
+def window_sums(strip, col_origins, size):
+    """
+    Sum a strip of rows over the chip windows starting at each column origin.
+
+    Args:
+        strip (numpy.ndarray): Array of shape (rows, width).
+        col_origins (list): Column offsets of the chips.
+        size (int): Chip size in pixels.
+
+    Returns:
+        numpy.ndarray: One sum per chip.
+    """
+    cumulative = np.concatenate([[0], np.cumsum(strip.sum(axis=0, dtype=np.int64))])
+    starts = np.asarray(col_origins)
+    stops = np.minimum(starts + size, strip.shape[1])
+    return cumulative[stops] - cumulative[starts]
+
+def item_rng(item_id, seed):
+    """
+    Random generator of an item's negative sampling, independent of the order items are exported in.
+    """
+    return np.random.default_rng([seed, zlib.crc32(item_id.encode())])
+
+class ChipShardWriter:
+    """
+    Write chips into numbered .npz shards of a fixed number of chips, with an index table.
+
+    Each shard holds 'chips' (N, bands, size, size) uint16, the 'item', 'row' and 'col' of every chip
+    in the tile it was cut from, and the 'bands' names. The index has one row per chip with its shard
+    and position in the shard, so a data loader can pick chips (e.g. only kelp chips) without opening
+    the shards, and stream whole shards otherwise.
+
+    Args:
+        output_dir (str): Local directory of the shards and index.
+        chips_per_shard (int): Number of chips per shard.
+        compress (bool): Write compressed shards (np.savez_compressed).
+        index_format (str): 'csv' or 'parquet'.
+        on_shard (callable, optional): Called with the path of every shard once it is written, e.g. to
+            upload it.
+    """
+
+    def __init__(self, output_dir, chips_per_shard=64, compress=False, index_format='csv', on_shard=None):
+        self.output_dir = output_dir
+        self.chips_per_shard = chips_per_shard
+        self.compress = compress
+        self.on_shard = on_shard
+        self.shards = 0
+        self.chips = 0
+        self.bands = None
+        self._pending = []
+        os.makedirs(output_dir, exist_ok=True)
+        self.index_path = table_path(os.path.join(output_dir, 'index'), index_format)
+        self._index = TableWriter(self.index_path)
+
+    def add(self, chip, item_id, row, col, band_names, info):
+        """
+        Queue a chip, writing a shard whenever enough chips are queued.
+
+        Args:
+            chip (numpy.ndarray): uint16 array of shape (bands, size, size).
+            item_id (str): ID of the tile the chip was cut from.
+            row (int): Row offset of the chip in the tile.
+            col (int): Column offset of the chip in the tile.
+            band_names (list): Band names, in chip order.
+            info (dict): Extra index columns of the chip, e.g. its kelp pixel count.
+        """
+        if self.bands is None:
+            self.bands = list(band_names)
+        elif list(band_names) != self.bands:
+            raise ValueError(f"Tile {item_id} has bands {list(band_names)}, expected {self.bands}")
+
+        self._pending.append((chip, item_id, row, col, info))
+        if len(self._pending) >= self.chips_per_shard:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the queued chips as a shard and append them to the index.
+        """
+        if not self._pending:
+            return
+        shard_name = f"shard-{self.shards:06d}.npz"
+        shard_path = os.path.join(self.output_dir, shard_name)
+        save = np.savez_compressed if self.compress else np.savez
+        save(
+            shard_path,
+            chips=np.stack([chip for chip, *_ in self._pending]),
+            item=np.array([item_id for _, item_id, *_ in self._pending]),
+            row=np.array([row for _, _, row, _, _ in self._pending], dtype=np.int32),
+            col=np.array([col for _, _, _, col, _ in self._pending], dtype=np.int32),
+            bands=np.array(self.bands),
+        )
+        self._index.write(pd.DataFrame([
+            dict(shard=shard_name, offset=offset, item=item_id, row=row, col=col, **info)
+            for offset, (_, item_id, row, col, info) in enumerate(self._pending)
+        ]))
+        print(f"Shard {shard_name} written ({len(self._pending)} chips)")
+
+        self.chips += len(self._pending)
+        self.shards += 1
+        self._pending = []
+        if self.on_shard is not None:
+            self.on_shard(shard_path)
+
+    def close(self):
+        """
+        Write the last, partial shard and close the index.
+        """
+        self.flush()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_tile_chips(raster_file, item_id, writer, size=256, stride=256, negative_fraction=0.1, seed=0):
+    """
+    Cut a stacked training tile into chips, keeping every chip with kelp and a sample of the others.
+
+    The tile is read one strip of chip rows at a time: the biomass band first, to find the chips to
+    keep, then all bands of the strip only if it has any. Chips without a single valid pixel (outside
+    the acquisition swath) are never kept.
+
+    Args:
+        raster_file (str): Stacked GeoTIFF written by generate_kelp_mask_tiles.py.
+        item_id (str): ID of the Sentinel-2 item of the tile.
+        writer (ChipShardWriter): Writer of the shards.
+        size (int): Chip size in pixels.
+        stride (int): Distance between the origins of consecutive chips in pixels; smaller than size
+            for overlapping chips.
+        negative_fraction (float): Fraction of the chips without kelp that are kept.
+        seed (int): Seed of the negative sampling; the same seed keeps the same chips.
+
+    Returns:
+        tuple: (number of kelp chips, number of negative chips) kept.
+    """
+    rng = item_rng(item_id, seed)
+    positives = negatives = 0
+
+    with rasterio.open(raster_file) as src:
+        band_names = [description or f"band_{index}" for index, description in enumerate(src.descriptions, start=1)]
+        mask_index = band_names.index(MASK_BAND) + 1 if MASK_BAND in band_names else src.count
+        row_origins = chip_origins(src.height, size, stride)
+        col_origins = chip_origins(src.width, size, stride)
+        strip_width = max(src.width, size)
+        nodata = 0 if src.nodata is None else src.nodata
+
+        for row in row_origins:
+            strip_window = Window(0, row, strip_width, size)
+            mask = src.read(mask_index, window=strip_window, boundless=True, fill_value=0)
+            kelp_pixels = window_sums(mask > 0, col_origins, size)
+            biomass = window_sums(mask, col_origins, size)
+            valid_pixels = window_sums(src.read(1, window=strip_window, boundless=True, fill_value=nodata) != nodata, col_origins, size)
+
+            keep = (kelp_pixels > 0) | ((valid_pixels > 0) & (rng.random(len(col_origins)) < negative_fraction))
+            if not keep.any():
+                continue
+
+            strip = src.read(window=strip_window, boundless=True, fill_value=0)
+            for position in np.flatnonzero(keep):
+                col = col_origins[position]
+                lon, lat = src.transform * (col, row)
+                writer.add(
+                    np.ascontiguousarray(strip[:, :, col:col + size]), item_id, row, col, band_names,
+                    {"longitude": lon, "latitude": lat, "kelp_pixels": int(kelp_pixels[position]), "biomass": int(biomass[position])},
+                )
+                if kelp_pixels[position] > 0:
+                    positives += 1
+                else:
+                    negatives += 1
+
+    print(f"{item_id}: {positives} kelp chips and {negatives} negative chips kept")
+    return positives, negatives
+
+def s3_tiles(s3_client, bucket, bucket_folder):
+    """
+    List the stacked GeoTIFF tiles in the S3 folder written by generate_kelp_mask_tiles.py.
+
+    Items written as Zarr stores (--output_format zarr), or without a tile yet, are skipped with a warning.
+
+    Returns:
+        list: (item ID, object key) pairs.
+    """
+    prefix = f"{bucket_folder.rstrip('/')}/"
+    tiles = []
+    for folder in list_s3_folders(s3_client, bucket, prefix):
+        item_id = clean_folder_name(folder)
+        key = f"{folder}{item_id}.tif"
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=folder, Delimiter='/')
+        if any(content['Key'] == key for content in response.get('Contents', [])):
+            tiles.append((item_id, key))
+        elif any(common['Prefix'] == f"{folder}{item_id}.zarr/" for common in response.get('CommonPrefixes', [])):
+            print(f"Skipping {item_id}: written as a Zarr store, only GeoTIFF tiles are exported")
+        else:
+            print(f"Skipping {item_id}: no {item_id}.tif in {folder}")
+    return tiles
+
+def main(output_dir='training_chips', tiles_dir=None, bucket='kelpwatch2', bucket_folder='training/full-tiles', chips_folder=None,
+         size=256, stride=256, negative_fraction=0.1, seed=0, chips_per_shard=64, compress=False, index_format='csv', s3_client=None):
+    """
+    Export the chips of every stacked training tile as sharded archives with an index.
+
+    Args:
+        output_dir (str): Local directory of the shards and index.
+        tiles_dir (str, optional): Local directory of stacked tiles ('<itemID>.tif'). The tiles are
+            downloaded from bucket_folder one at a time if None.
+        bucket (str): S3 bucket name.
+        bucket_folder (str): S3 folder of the stacked tiles, one '<itemID>_label/' folder per item.
+        chips_folder (str, optional): S3 folder the shards and index are uploaded to; kept local only if None.
+        size (int): Chip size in pixels.
+        stride (int): Distance between the origins of consecutive chips in pixels.
+        negative_fraction (float): Fraction of the chips without kelp that are kept.
+        seed (int): Seed of the negative sampling.
+        chips_per_shard (int): Number of chips per shard.
+        compress (bool): Write compressed shards.
+        index_format (str): 'csv' or 'parquet'.
+        s3_client (boto3.client, optional): S3 client, needed to read tiles from or upload chips to S3.
+
+    Returns:
+        str: Path of the local index.
+    """
+    def upload(path):
+        if chips_folder:
+            s3_client.upload_file(path, bucket, f"{chips_folder.rstrip('/')}/{os.path.basename(path)}")
+
+    with ChipShardWriter(output_dir, chips_per_shard, compress, index_format, upload) as writer:
+        if tiles_dir:
+            for raster_file in sorted(glob.glob(os.path.join(tiles_dir, '*.tif'))):
+                item_id = os.path.splitext(os.path.basename(raster_file))[0]
+                export_tile_chips(raster_file, item_id, writer, size, stride, negative_fraction, seed)
+        else:
+            tiles = s3_tiles(s3_client, bucket, bucket_folder)
+            print(f"Tiles to export: {len(tiles)}")
+            for item_id, key in tiles:
+                # One tile on local disk at a time
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    raster_file = os.path.join(tmp_dir, f"{item_id}.tif")
+                    s3_client.download_file(bucket, key, raster_file)
+                    export_tile_chips(raster_file, item_id, writer, size, stride, negative_fraction, seed)
+
+    upload(writer.index_path)
+    print(f"{writer.chips} chips written to {writer.shards} shards, index {writer.index_path}")
+    return writer.index_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cut the stacked training tiles into chips and write them as sharded archives with an index.")
+    parser.add_argument("--output_dir", type=str, default="training_chips", help="Local directory of the shards and index.")
+    parser.add_argument("--tiles_dir", type=str, default=None, help="Local directory of stacked tiles; the tiles are read from the S3 bucket folder if not given.")
+    parser.add_argument("--bucket", type=str, default="kelpwatch2", help="Name of the S3 bucket.")
+    parser.add_argument("--bucket_folder", type=str, default="training/full-tiles", help="S3 folder of the stacked tiles.")
+    parser.add_argument("--chips_folder", type=str, default=None, help="S3 folder the shards and index are uploaded to.")
+    parser.add_argument("--chip_size", type=int, default=256, help="Chip size in pixels.")
+    parser.add_argument("--chip_stride", type=int, default=None, help="Distance between chip origins in pixels (default: the chip size, no overlap).")
+    parser.add_argument("--negative_fraction", type=float, default=0.1, help="Fraction of the chips without kelp that are kept.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the negative sampling.")
+    parser.add_argument("--chips_per_shard", type=int, default=64, help="Number of chips per shard.")
+    parser.add_argument("--compress", action="store_true", help="Write compressed shards.")
+    parser.add_argument("--index_format", type=str, choices=TABLE_FORMATS, default="csv", help="Format of the index table.")
+    parser.add_argument("--s3_endpoint_url", type=str, default=None, help="Custom S3 endpoint, e.g. a local moto or MinIO server.")
+    args = parser.parse_args()
+
+    s3_client = None
+    if not args.tiles_dir or args.chips_folder:
+        s3_client = boto3.Session().client('s3', endpoint_url=args.s3_endpoint_url)
+
+    main(args.output_dir, args.tiles_dir, args.bucket, args.bucket_folder, args.chips_folder, args.chip_size, args.chip_stride or args.chip_size,
+         args.negative_fraction, args.seed, args.chips_per_shard, args.compress, args.index_format, s3_client)
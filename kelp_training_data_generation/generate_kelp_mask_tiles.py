@@ -19,6 +19,23 @@ from pystac_client import Client
 import boto3
 from botocore.exceptions import NoCredentialsError
 import os
+import shutil
+import itertools
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from band_stacking import item_destination_grid, iter_warped_bands, crop_grid
+from tile_writers import write_bands_geotiff, write_bands_zarr, upload_directory
+from stac_cache import cached_catalog
+from asset_cache import open_asset_cache
+from warp_cache import open_warp_cache
+from table_io import list_tables, read_table
+
+# Sentinel-2 assets stacked into every training tile, in band order, ahead of the biomass mask
+TRAINING_BANDS = ['B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B08', 'B11', 'B12']
+
+# Bands needed to build the biomass mask (Red and NIR), fetched before the others
+MASK_BANDS = ['B04', 'B08']
 
 def clean_folder_name(folder_name):
     """
@@ -53,6 +70,26 @@ def calculate_bbox(lon, lat, shift_meters=30):
     return bbox
 
 
+def calculate_stations_bbox(longitudes, latitudes, margin_meters=1000):
+    """
+    Calculate the union bounding box of all kelp stations, extended by a margin in meters.
+
+    Args:
+        longitudes (np.ndarray): Longitudes of the kelp stations.
+        latitudes (np.ndarray): Latitudes of the kelp stations.
+        margin_meters (float): Margin added on every side of the bounding box.
+
+    Returns:
+        list: Bounding box coordinates [min_lon, min_lat, max_lon, max_lat].
+    """
+    min_lat, max_lat = np.min(latitudes), np.max(latitudes)
+    lat_shift_deg = margin_meters / 111000  # Convert latitude margin to degrees
+    # Convert longitude margin to degrees at the latitude farthest from the equator, where it is widest
+    lon_shift_deg = margin_meters / (111000 * math.cos(math.radians(max(abs(min_lat), abs(max_lat)))))
+
+    bbox = [np.min(longitudes) - lon_shift_deg, min_lat - lat_shift_deg, np.max(longitudes) + lon_shift_deg, max_lat + lat_shift_deg]
+    return bbox
+
 def list_s3_folders(s3_client, bucket, prefix):
     """
     List all folders with a given prefix in an S3 bucket, handling pagination.
@@ -96,7 +133,168 @@ def clean_folder_name(folder_name):
     
     return last_element
 
-def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catalog):
+def load_completed_items(s3_client, bucket, bucket_folder, manifest_path=None):
+    """
+    Build the set of item IDs that already have a label folder in S3.
+
+    When a manifest from an earlier run exists it is read instead of listing S3. Otherwise the
+    bucket folder is listed once and, if a manifest path is given, the result is saved to it.
+
+    Args:
+        s3_client (boto3.client): Boto3 S3 client.
+        bucket (str): S3 bucket name.
+        bucket_folder (str): S3 folder holding one '<itemID>_label/' folder per processed item.
+        manifest_path (str, optional): Local file with one processed item ID per line.
+
+    Returns:
+        set: IDs of the items already processed.
+    """
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            completed_items = {line.strip() for line in manifest if line.strip()}
+        print(f"Loaded {len(completed_items)} processed items from {manifest_path}")
+        return completed_items
+
+    response = list_s3_folders(s3_client, bucket, f'{bucket_folder}/')
+    completed_items = {clean_folder_name(folder) for folder in response}
+    print(f"Found {len(completed_items)} processed items in s3://{bucket}/{bucket_folder}/")
+
+    if manifest_path:
+        with open(manifest_path, 'w') as manifest:
+            manifest.writelines(f"{item}\n" for item in sorted(completed_items))
+
+    return completed_items
+
+def mark_item_completed(completed_items, itemID, manifest_path=None):
+    """
+    Record a processed item in the in-memory set and, if given, append it to the local manifest.
+
+    Args:
+        completed_items (set): IDs of the items already processed, updated in place.
+        itemID (str): ID of the item that was just uploaded.
+        manifest_path (str, optional): Local file with one processed item ID per line.
+    """
+    completed_items.add(itemID)
+    if manifest_path:
+        with open(manifest_path, 'a') as manifest:
+            manifest.write(f"{itemID}\n")
+
+def kelp_footprint_windows(longitudes, latitudes, transform, shape, lon_shift_deg_left, lon_shift_deg_right, lat_shift_deg_down, lat_shift_deg_up):
+    """
+    Convert the asymmetric footprint box of every kelp station to a pixel window in one batch.
+
+    The box of each station spans [lon - left, lon - left + right] x [lat - down, lat + up]. Bounds
+    are mapped to fractional pixel offsets with the inverse of the raster's affine transform and
+    rounded the same way as ``rio.clip_box`` (starts floored, stops ceiled, clamped to the raster).
+
+    Args:
+        longitudes (np.ndarray): Longitudes of the kelp stations.
+        latitudes (np.ndarray): Latitudes of the kelp stations.
+        transform (affine.Affine): Affine transform of the mask raster.
+        shape (tuple): Height and width of the mask raster.
+        lon_shift_deg_left (float): Longitude shift to the left of the station, in degrees.
+        lon_shift_deg_right (float): Width of the box in longitude, in degrees.
+        lat_shift_deg_down (float): Latitude shift below the station, in degrees.
+        lat_shift_deg_up (float): Latitude shift above the station, in degrees.
+
+    Returns:
+        tuple: Arrays (row_start, row_stop, col_start, col_stop, valid) where 'valid' flags the
+        windows that cover more than one pixel in each direction.
+    """
+    height, width = shape
+
+    # Corners of every footprint box in map coordinates
+    minx = np.asarray(longitudes, dtype=float) - lon_shift_deg_left
+    maxx = minx + lon_shift_deg_right
+    miny = np.asarray(latitudes, dtype=float) - lat_shift_deg_down
+    maxy = np.asarray(latitudes, dtype=float) + lat_shift_deg_up
+
+    # Map the four corners to fractional pixel offsets with the inverse transform
+    inverse = ~transform
+    corners_x = np.stack([minx, maxx, maxx, minx])
+    corners_y = np.stack([maxy, maxy, miny, miny])
+    cols = inverse.a * corners_x + inverse.b * corners_y + inverse.c
+    rows = inverse.d * corners_x + inverse.e * corners_y + inverse.f
+
+    # Round outwards and clamp to the raster, as rio.clip_box does
+    row_start = np.clip(np.floor(rows.min(axis=0)), 0, height).astype(np.int64)
+    row_stop = np.clip(np.ceil(rows.max(axis=0)), 0, height).astype(np.int64)
+    col_start = np.clip(np.floor(cols.min(axis=0)), 0, width).astype(np.int64)
+    col_stop = np.clip(np.ceil(cols.max(axis=0)), 0, width).astype(np.int64)
+
+    # rio.clip_box refuses windows that are one pixel wide or high
+    valid = ((row_stop - row_start) > 1) & ((col_stop - col_start) > 1)
+
+    return row_start, row_stop, col_start, col_stop, valid
+
+def burn_kelp_footprints(mask, row_start, row_stop, col_start, col_stop):
+    """
+    Burn a batch of pixel windows into a 2D mask in a single fancy-indexing assignment.
+
+    Args:
+        mask (np.ndarray): 2D array updated in place; pixels inside any window are set to 1.
+        row_start (np.ndarray): First row of each window.
+        row_stop (np.ndarray): Row after the last row of each window.
+        col_start (np.ndarray): First column of each window.
+        col_stop (np.ndarray): Column after the last column of each window.
+
+    Returns:
+        np.ndarray: The updated mask.
+    """
+    heights = row_stop - row_start
+    widths = col_stop - col_start
+    counts = heights * widths
+    if counts.sum() == 0:
+        return mask
+
+    # Expand every window into the flat list of its pixels
+    owner = np.repeat(np.arange(len(counts)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = row_start[owner] + local // widths[owner]
+    cols = col_start[owner] + local % widths[owner]
+
+    mask[rows, cols] = 1
+    return mask
+
+def biomass_mask(nir, red, kelp_mask, total_biomass, percentile=20):
+    """
+    Spread the stations' total biomass over the kelp pixels, computing only on the masked pixels.
+
+    The normalized difference (NIR - Red) / (NIR + Red) is computed in float32 for the pixels of the
+    kelp mask only. Pixels at or above the given percentile of the positive values receive a share of
+    total_biomass proportional to their value; every other pixel is 0.
+
+    Args:
+        nir (np.ndarray): 2D NIR band (B08).
+        red (np.ndarray): 2D Red band (B04) on the same grid.
+        kelp_mask (np.ndarray): 2D boolean mask of the kelp station footprints.
+        total_biomass (float): Sum of the biomass of the stations in the tile.
+        percentile (float): Percentile of the positive normalized differences below which pixels are dropped.
+
+    Returns:
+        np.ndarray: 2D uint16 biomass band, or None if no masked pixel has a positive normalized difference.
+    """
+    rows, cols = np.nonzero(kelp_mask)
+    nir_kelp = nir[rows, cols].astype(np.float32)
+    red_kelp = red[rows, cols].astype(np.float32)
+    ndvi = (nir_kelp - red_kelp) / (nir_kelp + red_kelp + np.float32(1e-12))
+    del nir_kelp, red_kelp
+
+    positive = ndvi[ndvi > 0]
+    if len(positive) < 1:
+        return None
+
+    # The threshold is positive, so only pixels with a positive normalized difference are kept
+    threshold = np.percentile(positive, percentile)
+    keep = ndvi >= threshold
+    weights = ndvi[keep]
+    sum_band = weights.sum(dtype=np.float64)
+
+    biomass = np.zeros(kelp_mask.shape, dtype=np.uint16)
+    biomass[rows[keep], cols[keep]] = (weights / sum_band * total_biomass).astype(np.uint16)
+    return biomass
+
+def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catalog, fetch_workers=1, crop_to_stations=False, crop_margin_meters=1000, manifest_path=None, asset_cache=None, warp_cache=None, zarr_options=None):
     """
     Process each folder in the specified directory, downloading and processing Sentinel-2 data.
     
@@ -105,6 +303,18 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
         bucket (str): S3 bucket name.
         s3_client (boto3.client): Boto3 S3 client.
         catalog (pystac_client.Catalog): STAC catalog for searching Sentinel-2 items.
+        fetch_workers (int): Number of assets of a tile downloaded and decoded in parallel.
+        crop_to_stations (bool): Only read and save the part of the tile covering the CSV's stations
+            plus crop_margin_meters, instead of the full tile.
+        crop_margin_meters (float): Margin around the stations' bounding box when cropping.
+        manifest_path (str, optional): Local manifest of processed item IDs. When it exists, it is used
+            instead of listing the bucket folder, and it is kept up to date after every upload.
+        asset_cache (AssetCache, optional): On-disk cache of decoded assets, read before downloading, so
+            reruns on the same items do not download them again.
+        warp_cache (WarpCache, optional): Cache of destination grids and nearest-neighbour warp plans,
+            shared by the items of the same Sentinel-2 tile.
+        zarr_options (dict, optional): Keyword arguments of ``write_bands_zarr`` (chunk_size, compressor).
+            Each tile is written as a Zarr store with a chunked array per band instead of a GeoTIFF.
     """
 
     # bucket = 'kelpwatch2'
@@ -116,17 +326,18 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
 
     folders = [f for f in os.listdir(kelp_tiles_directory) if os.path.isdir(os.path.join(kelp_tiles_directory, f))]
 
+    # List the processed items once for the whole run instead of once per CSV
+    completed_items = load_completed_items(s3_client, bucket, bucket_folder, manifest_path)
+
     for f in folders:
         print(f)
         directory = f"{kelp_tiles_directory}/{f}"
         df_list = []
 
-        # Read all CSV files in the folder
-        for filename in os.listdir(directory):
-            if filename.endswith(".csv"):
-                filepath = os.path.join(directory, filename)
-                df = pd.read_csv(filepath)
-                df_list.append(df)
+        # Read all CSV and Parquet files in the folder
+        for filepath in list_tables(directory):
+            df = read_table(filepath)
+            df_list.append(df)
 
         for df in df_list:
             print(df.shape)
@@ -141,12 +352,8 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
             lat = data_kelp.iloc[rowNum]["latitude"]
             lon = data_kelp.iloc[rowNum]["longitude"]
             itemID = data_kelp.iloc[rowNum]["asset"]
-            # prefix = "training/"
-            prefix = f'{bucket_folder}/'
-            response = list_s3_folders(s3_client, bucket, prefix)
-            cleaned_folders = [clean_folder_name(folder) for folder in response]
 
-            if itemID in cleaned_folders:
+            if itemID in completed_items:
                 print(f"{itemID} already processed")
                 continue
 
@@ -170,44 +377,24 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
 
             print("Asset Selection Complete")
 
-            # Define target resolution and scale factor
-            target_resolution = 10  # meters
-            scale_factor = 20 / target_resolution
-
-            # Open and reproject Sentinel-2 bands
-            dsNRI = rioxarray.open_rasterio(selected_item.assets["B08"].href, overview_level=0)
-            dsRed = rioxarray.open_rasterio(selected_item.assets["B04"].href, overview_level=0)
-            dsNRI = dsNRI.rio.reproject("EPSG:4326")
-            dsRed = dsRed.rio.reproject("EPSG:4326")
-
-            dsB02 = rioxarray.open_rasterio(selected_item.assets["B02"].href, overview_level=0).rename("dsB02").rio.reproject("EPSG:4326")
-            dsB03 = rioxarray.open_rasterio(selected_item.assets["B03"].href, overview_level=0).rename("dsB03").rio.reproject("EPSG:4326")
-            dsB04 = rioxarray.open_rasterio(selected_item.assets["B04"].href, overview_level=0).rename("dsB04").rio.reproject("EPSG:4326")
-            dsB05 = rioxarray.open_rasterio(selected_item.assets["B05"].href, overview_level=0).rename("dsB05")
-            dsB05 = dsB05.rio.reproject(dsB05.rio.crs, shape=(int(dsB05.rio.height * scale_factor), int(dsB05.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB05 = dsB05.rio.reproject("EPSG:4326")
-            dsB06 = rioxarray.open_rasterio(selected_item.assets["B06"].href, overview_level=0).rename("dsB06")
-            dsB06 = dsB06.rio.reproject(dsB06.rio.crs, shape=(int(dsB06.rio.height * scale_factor), int(dsB06.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB06 = dsB06.rio.reproject("EPSG:4326")
-            dsB07 = rioxarray.open_rasterio(selected_item.assets["B07"].href, overview_level=0).rename("dsB07")
-            dsB07 = dsB07.rio.reproject(dsB07.rio.crs, shape=(int(dsB07.rio.height * scale_factor), int(dsB07.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB07 = dsB07.rio.reproject("EPSG:4326")
-            dsB8A = rioxarray.open_rasterio(selected_item.assets["B8A"].href, overview_level=0).rename("dsB8A")
-            dsB8A = dsB8A.rio.reproject(dsB8A.rio.crs, shape=(int(dsB8A.rio.height * scale_factor), int(dsB8A.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB8A = dsB8A.rio.reproject("EPSG:4326")
-            dsB08 = rioxarray.open_rasterio(selected_item.assets["B08"].href, overview_level=0).rename("dsB08").rio.reproject("EPSG:4326")
-            dsB11 = rioxarray.open_rasterio(selected_item.assets["B11"].href, overview_level=0).rename("dsB11")
-            dsB11 = dsB11.rio.reproject(dsB11.rio.crs, shape=(int(dsB11.rio.height * scale_factor), int(dsB11.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB11 = dsB11.rio.reproject("EPSG:4326")
-            dsB12 = rioxarray.open_rasterio(selected_item.assets["B12"].href, overview_level=0).rename("dsB12")
-            dsB12 = dsB12.rio.reproject(dsB12.rio.crs, shape=(int(dsB12.rio.height * scale_factor), int(dsB12.rio.width * scale_factor)), resampling=Resampling.bilinear)
-            dsB12 = dsB12.rio.reproject("EPSG:4326")
-
-            print("Assets Download Complete")
-
-            # Create a binary mask for the NIR band
-            dsNRI_mask_binary = copy.deepcopy(dsNRI)
-            dsNRI_mask_binary.data[0, :, :] = 0
+            # Warp each band, including the 20m ones, onto the item's 10m EPSG:4326 grid in a single reprojection
+            grid = item_destination_grid(selected_item, warp_cache=warp_cache)
+            if crop_to_stations:
+                # Restrict the grid to the stations' bounding box and read only that window of each asset
+                grid = crop_grid(grid, calculate_stations_bbox(data_kelp['longitude'].values, data_kelp['latitude'].values, crop_margin_meters))
+                print(f"Cropped to stations: {grid.height} x {grid.width} pixels")
+            # Fetch NIR and Red first: the biomass mask only needs these two, and tiles without kelp pixels
+            # are skipped before the other bands are downloaded
+            mask_bands = dict(iter_warped_bands(selected_item, MASK_BANDS, grid, fetch_workers, windowed=crop_to_stations, cache=asset_cache, warp_cache=warp_cache))
+
+            # NIR and Red on the same grid for the biomass mask
+            dsNRI = mask_bands["B08"]
+            dsRed = mask_bands["B04"]
+
+            print("NIR and Red Download Complete")
+
+            # Create a binary mask of the kelp footprints on the NIR band's grid
+            kelp_mask = np.zeros(dsNRI.shape[-2:], dtype=bool)
 
             # Define the bounding box shifts in meters
             extend_meters_left = 10
@@ -221,95 +408,51 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
             lon_shift_deg_right = (extend_meters_right / (111000 * math.cos(math.radians(lat)))) * tuning_per
             lon_shift_deg_left = (extend_meters_left / (111000 * math.cos(math.radians(lat)))) * tuning_per
 
-            # Process the binary mask with the calculated bounding box shifts
-            for data_row in data_kelp.index:
-                # Calculate the minimum and maximum longitude and latitude for the bounding box
-                minx = data_kelp.loc[data_row, 'longitude'] - lon_shift_deg_left
-                miny = data_kelp.loc[data_row, 'latitude'] - lat_shift_deg_down
-                maxx = minx + lon_shift_deg_right
-                maxy = data_kelp.loc[data_row, 'latitude'] + lat_shift_deg_up
-
-                # Check if the bounding box provides sufficient area for clipping
-                if minx != maxx and miny != maxy:
-                    try:
-                        # Clip the raster dataset based on the bounding box
-                        ds_32610_clipped_loop = dsNRI_mask_binary.rio.clip_box(minx=minx, miny=miny, maxx=maxx, maxy=maxy)
-                        # Loop through the clipped coordinates to update the binary mask
-                        for lonX_clipped in ds_32610_clipped_loop.coords['x'].values:
-                            for latY_clipped in ds_32610_clipped_loop.coords['y'].values:
-                                # Find the indices of the clipped coordinates in the original dataset
-                                x_index = np.where(dsNRI_mask_binary.coords['x'].values == lonX_clipped)[0]
-                                y_index = np.where(dsNRI_mask_binary.coords['y'].values == latY_clipped)[0]
-                                # Update the binary mask with ones at the clipped coordinate indices
-                                dsNRI_mask_binary.data[0, int(y_index), int(x_index)] = 1
-                    except Exception as e:
-                        # Print an error message and skip the current row if an exception occurs
-                        print(f"Skipping row {data_row} due to error: {e}")
-                else:
-                    # Print a message and skip the current row if the bounding box is insufficient
-                    print(f"Skipping row {data_row} due to insufficient area for clipping.")
+            # Convert every station's footprint box to a pixel window and burn them all at once
+            row_start, row_stop, col_start, col_stop, valid = kelp_footprint_windows(
+                data_kelp['longitude'].values, data_kelp['latitude'].values,
+                dsNRI.rio.transform(), kelp_mask.shape,
+                lon_shift_deg_left, lon_shift_deg_right, lat_shift_deg_down, lat_shift_deg_up)
+            for data_row in data_kelp.index[~valid]:
+                # Print a message for the rows whose box does not cover enough of the raster
+                print(f"Skipping row {data_row} due to insufficient area for clipping.")
+            burn_kelp_footprints(kelp_mask, row_start[valid], row_stop[valid], col_start[valid], col_stop[valid])
 
             # Print a confirmation message
             print("Binary Mask Complete")
 
 
-            # Convert the data of dsNRI_mask_binary and dsRed to float for calculations
-            dsNRI_mask_binary.data = np.array(dsNRI_mask_binary.data, dtype=float)
-            dsRed.data = np.array(dsRed.data, dtype=float)
-
-            # Create a mask for NRI - RED
-            ds_NRI_Red_mask_binary = copy.deepcopy(dsRed)
-            # Compute the normalized difference between dsNRI and dsRed
-            ds_NRI_Red_mask_binary.data = (dsNRI.data - ds_NRI_Red_mask_binary.data) / (dsNRI.data + ds_NRI_Red_mask_binary.data + 1e-12)
-
-            # Apply the binary mask to the normalized difference
-            ds_NRI_Red_mask_binary.data = ds_NRI_Red_mask_binary.data * dsNRI_mask_binary.data  
-
-            # Flatten the data and consider only non-zero values for percentile calculation
-            data = ds_NRI_Red_mask_binary.data.flatten()
-            data = data[data > 0]
-            if len(data) < 1:
-                print("No Data")
-                continue
-
-            # Calculate the 20th percentile of the data
-            threshold_NRI = np.percentile(data, [20])[0]
-            
-            percentile_label = '20th'
-
-            # Create a copy of the mask for thresholding
-            mask_NRI_copy = copy.deepcopy(ds_NRI_Red_mask_binary)
-
-            # Apply the threshold to create a binary mask
-            mask_NRI_copy.data[0, :, :][mask_NRI_copy.data[0, :, :] < threshold_NRI] = 0
-
-            # Sum the values of the masked data
-            sum_band = np.sum(mask_NRI_copy.data)
-
             # Calculate the total biomass from the data_kelp DataFrame
             total_biomass = data_kelp['biomass'].sum(axis=0)
 
-            # Normalize the masked data to the total biomass
-            mask_NRI_copy.data[0, :, :] = (mask_NRI_copy.data[0, :, :] / sum_band) * total_biomass
+            # Threshold the normalized difference at its 20th percentile over the kelp pixels and spread
+            # the biomass over the remaining pixels, without full-tile float copies
+            biomass = biomass_mask(dsNRI.data[0], dsRed.data[0], kelp_mask, total_biomass, 20)
+            if biomass is None:
+                print("No Data")
+                continue
 
             # Print confirmation message for the completion of the biomass mask
             print("Biomass Mask Complete")
 
-            # Rename the mask to "dsBioMass"
-            mask_NRI_copy = mask_NRI_copy.rename("dsBioMass")
-
-            # Convert the data to uint16 for saving
-            mask_NRI_copy.data = np.array(mask_NRI_copy.data, dtype=np.uint16)
-
-            # Stack the bands into a single dataset
-            data_arrays = [dsB02, dsB03, dsB04, dsB05, dsB06, dsB07, dsB8A, dsB08, dsB11, dsB12, mask_NRI_copy]
-            stacked = xr.concat(data_arrays, dim='band')
-            stacked = stacked.assign_coords(band=['B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B08', 'B11', 'B12', 'mask_biomass'])
-            stacked.rio.write_crs("EPSG:4326", inplace=True)  
-
-            # Define the raster file name and save it
-            raster_file = f"{itemID}.tif"
-            stacked.rio.to_raster(raster_file)
+            # Wrap the uint16 band on the NIR band's grid, without copying it
+            mask_bands['mask_biomass'] = dsNRI.copy(data=biomass[np.newaxis]).rename("dsBioMass")
+
+            # Release the intermediate arrays, keeping only the bands still to be written
+            del dsNRI, dsRed, kelp_mask, biomass
+
+            # Define the raster file name and stream the bands into it one at a time: first the bands
+            # already in memory, then each remaining band as soon as it is warped
+            raster_file = f"{itemID}.zarr" if zarr_options is not None else f"{itemID}.tif"
+            remaining_bands = [name for name in TRAINING_BANDS if name not in mask_bands]
+            bands = itertools.chain(
+                ((name, mask_bands.pop(name)) for name in list(mask_bands)),
+                iter_warped_bands(selected_item, remaining_bands, grid, fetch_workers, windowed=crop_to_stations, cache=asset_cache, warp_cache=warp_cache),
+            )
+            if zarr_options is not None:
+                write_bands_zarr(raster_file, grid, bands, TRAINING_BANDS + ['mask_biomass'], **zarr_options)
+            else:
+                write_bands_geotiff(raster_file, grid, bands, TRAINING_BANDS + ['mask_biomass'])
 
             # Print confirmation message for the completion of band merging and saving
             print("Bands Merge Complete and Saved")
@@ -318,8 +461,11 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
             sub_folder_name = f"{itemID}_label"
             object_name = f"{bucket_folder}/{sub_folder_name}/{raster_file}"
 
-            # Upload the raster file to S3
-            s3_client.upload_file(raster_file, bucket, object_name)
+            # Upload the raster file, or every file of the Zarr store, to S3
+            if zarr_options is not None:
+                upload_directory(s3_client, raster_file, bucket, object_name)
+            else:
+                s3_client.upload_file(raster_file, bucket, object_name)
 
             # Define the CSV file name and save the DataFrame
             csv_file = f"{itemID}.csv"
@@ -332,9 +478,15 @@ def process_folders(kelp_tiles_directory, bucket,bucket_folder, s3_client, catal
             # Print confirmation message for the completion of S3 upload
             print("S3 Upload Complete")
 
+            # Record the item as processed for the rest of the run and for restarts
+            mark_item_completed(completed_items, itemID, manifest_path)
+
             # Remove the local copies of the CSV and raster files
             os.remove(csv_file)
-            os.remove(raster_file)
+            if zarr_options is not None:
+                shutil.rmtree(raster_file)
+            else:
+                os.remove(raster_file)
 
 
 if __name__ == "__main__":
@@ -343,19 +495,35 @@ if __name__ == "__main__":
     parser.add_argument("--kelp_tiles_directory", type=str, default="kelp_tiles_segmented_data", help="Directory containing folders with CSV files.")
     parser.add_argument("--bucket", type=str, default="kelpwatch2", help="S3 bucket.")
     parser.add_argument("--bucket_folder", type=str, default="training/full-tiles", help="S3 bucket folder.")  
+    parser.add_argument("--fetch_workers", type=int, default=1, help="Number of assets of a tile downloaded and decoded in parallel.")
+    parser.add_argument("--crop_to_stations", action="store_true", help="Only read and save the part of each tile covering its kelp stations.")
+    parser.add_argument("--crop_margin_meters", type=float, default=1000, help="Margin around the kelp stations when cropping, in meters.")
+    parser.add_argument("--manifest", type=str, default=None, help="Local manifest of processed item IDs, used instead of listing S3 on restarts.")
+    parser.add_argument("--s3_endpoint_url", type=str, default=None, help="Custom S3 endpoint, e.g. a local moto or MinIO server.")
+    parser.add_argument("--stac_cache_dir", type=str, default=None, help="Directory of an on-disk cache of STAC search results, reused across runs.")
+    parser.add_argument("--stac_cache_ttl_hours", type=float, default=168, help="Age in hours after which cached STAC searches are refreshed; 0 keeps them forever.")
+    parser.add_argument("--asset_cache_dir", type=str, default=None, help="Directory of an on-disk cache of decoded Sentinel-2 assets, reused across runs and by the inference pipeline.")
+    parser.add_argument("--asset_cache_max_gb", type=float, default=50, help="Size cap of the asset cache in gigabytes; the least recently used assets are evicted.")
+    parser.add_argument("--warp_cache_dir", type=str, default=None, help="Directory of a cache of destination grids, reused across runs; also keeps warp plans in memory.")
+    parser.add_argument("--warp_plan_mb", type=float, default=1152, help="Memory held by cached warp plans in megabytes; 0 disables them.")
+    parser.add_argument("--output_format", type=str, choices=["geotiff", "zarr"], default="geotiff", help="Write one GeoTIFF per tile, or one Zarr store with a chunked array per band.")
+    parser.add_argument("--zarr_chunk_size", type=int, default=1024, help="Side of the square chunks of the Zarr arrays in pixels.")
+    parser.add_argument("--zarr_compressor", type=str, default="blosc-zstd:3", help="Compressor of the Zarr chunks: blosc-zstd, blosc-lz4, zstd, gzip or none, optionally followed by ':level'.")
     args = parser.parse_args()
 
     session = boto3.Session()
 
-    s3_client = session.client('s3')
+    s3_client = session.client('s3', endpoint_url=args.s3_endpoint_url)
 
     # Initialize STAC catalog
     catalog = pystac_client.Client.open(
         "https://planetarycomputer.microsoft.com/api/stac/v1",
         modifier=planetary_computer.sign_inplace,
     )
+    catalog = cached_catalog(catalog, args.stac_cache_dir, args.stac_cache_ttl_hours)
 
     # Process folders
-    process_folders(args.kelp_tiles_directory, args.bucket, args.bucket_folder, s3_client, catalog)
+    process_folders(args.kelp_tiles_directory, args.bucket, args.bucket_folder, s3_client, catalog, args.fetch_workers, args.crop_to_stations, args.crop_margin_meters, args.manifest, open_asset_cache(args.asset_cache_dir, args.asset_cache_max_gb), open_warp_cache(args.warp_cache_dir, args.warp_plan_mb),
+                    {"chunk_size": args.zarr_chunk_size, "compressor": args.zarr_compressor} if args.output_format == 'zarr' else None)
 
 
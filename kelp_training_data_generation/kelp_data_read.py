@@ -3,19 +3,105 @@ import pandas as pd
 import os
 import numpy as np
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from table_io import TABLE_FORMATS, table_path, write_table
 
-def main(nc_file, output_dir='kelp_nc_segmented_data'):
+# Dataset opened lazily by each export worker process
+worker_data = None
+
+def init_worker(nc_file):
+    """
+    Open the NetCDF file lazily, one timestep per chunk, in an export worker process.
+
+    Args:
+        nc_file (str): Path to the NetCDF file.
+    """
+    global worker_data
+    worker_data = xr.open_dataset(nc_file, chunks={'time': 1})
+
+def export_timestep(time_index, output_dir, output_format='csv'):
+    """
+    Save the stations with biomass > 0 at one timestep to a CSV or Parquet file.
+
+    The biomass of the timestep is read and filtered as an array first, so only the rows of stations
+    with kelp are turned into a DataFrame. The CSV has the same rows and columns as in the default mode.
+
+    Args:
+        time_index (int): Position of the timestep along the time dimension.
+        output_dir (str): Directory to save the file.
+        output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+        str: Path of the saved file.
+    """
+    specific_time_data = worker_data.isel(time=[time_index])
+    filter_time = pd.Timestamp(specific_time_data.time.values[0]).strftime('%Y-%m-%d')
+
+    # Filter the stations on the biomass array before building the DataFrame
+    biomass = specific_time_data['biomass'].isel(time=0)
+    station_dim = biomass.dims[0]
+    stations = np.flatnonzero(biomass.values > 0)
+    data_df_biomass = specific_time_data.isel({station_dim: stations}).to_dataframe()
+
+    file_name = table_path(f'{output_dir}/data_df_biomass_{filter_time}', output_format)
+    write_table(data_df_biomass, file_name, index=True)
+    print(f"{file_name} has been saved ({len(data_df_biomass)} rows)")
+    return file_name
+
+def export_chunked(nc_file, output_dir, date_threshold='2018-01-01', workers=1, output_format='csv'):
+    """
+    Export the timesteps after a date to CSV files in parallel, reading one timestep at a time.
+
+    Args:
+        nc_file (str): Path to the NetCDF file.
+        output_dir (str): Directory to save the CSV files.
+        date_threshold (str): Only timesteps after this date are exported.
+        workers (int): Number of worker processes; each opens the file itself.
+        output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+        list: Paths of the saved CSV files.
+    """
+    # Only the time coordinate is read here
+    with xr.open_dataset(nc_file) as data:
+        time_indices = np.flatnonzero(data.time.values > np.datetime64(date_threshold)).tolist()
+    print(f"Timesteps to export: {len(time_indices)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    if workers <= 1:
+        init_worker(nc_file)
+        return [export_timestep(i, output_dir, output_format) for i in time_indices]
+
+    # Spawned workers do not inherit the parent's HDF5 file state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(nc_file,)) as executor:
+        return list(executor.map(export_timestep, time_indices, [output_dir] * len(time_indices), [output_format] * len(time_indices)))
+
+def main(nc_file, output_dir='kelp_nc_segmented_data', date_threshold='2018-01-01', chunked=False, workers=1, output_format='csv'):
     """
     Process NetCDF file to filter biomass data and save it to CSV files.
 
     Args:
         nc_file (str): Path to the NetCDF file.
         output_dir (str, optional): Directory to save the CSV files. Defaults to 'kelp_nc_segmented_data'.
+        date_threshold (str, optional): Only timesteps after this date are saved. Defaults to '2018-01-01'.
+        chunked (bool, optional): Read one timestep at a time and filter the biomass before building
+            DataFrames, exporting timesteps in parallel. Defaults to False.
+        workers (int, optional): Number of worker processes in chunked mode. Defaults to 1.
+        output_format (str, optional): 'csv' or 'parquet'. Parquet files store compact dtypes. Defaults to 'csv'.
 
     Returns:
         None
     """
-    
+    if chunked:
+        export_chunked(nc_file, output_dir, date_threshold, workers, output_format)
+        return
+
     # Open the NetCDF file as an xarray Dataset
     data = xr.open_dataset(nc_file)
     
@@ -23,7 +109,7 @@ def main(nc_file, output_dir='kelp_nc_segmented_data'):
     list_time = data.time
     
     # Convert the string date to a numpy datetime64 object
-    date_threshold = np.datetime64('2018-01-01')
+    date_threshold = np.datetime64(date_threshold)
     
     # Filter the time values greater than the date threshold
     filtered_time = list_time.where(list_time > date_threshold, drop=True)
@@ -41,10 +127,10 @@ def main(nc_file, output_dir='kelp_nc_segmented_data'):
         # Filter the DataFrame to include only rows where the biomass value is greater than 0
         data_df_biomass = data_df.query('biomass > 0')
         
-        file_name = f'{output_dir}/data_df_biomass_{filter_time}.csv'
+        file_name = table_path(f'{output_dir}/data_df_biomass_{filter_time}', output_format)
         
-        # Save the filtered DataFrame to a CSV file
-        data_df_biomass.to_csv(file_name, index=True)  
+        # Save the filtered DataFrame to a CSV or Parquet file
+        write_table(data_df_biomass, file_name, index=True)
         
         # Print a confirmation message
         print(f"{file_name} has been saved")
@@ -53,7 +139,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process NetCDF file to filter biomass data and save to CSV.')
     parser.add_argument('--nc_file', type=str, help='Path to the NetCDF file.')
     parser.add_argument('--output_dir', type=str, default='kelp_nc_segmented_data', help='Directory to save the CSV files.')
+    parser.add_argument('--date_threshold', type=str, default='2018-01-01', help='Only timesteps after this date are saved.')
+    parser.add_argument('--chunked', action='store_true', help='Read one timestep at a time and filter the biomass before building DataFrames.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes exporting timesteps in chunked mode.')
+    parser.add_argument('--output_format', type=str, choices=TABLE_FORMATS, default='csv', help='Format of the saved tables.')
 
     args = parser.parse_args()
     
-    main(args.nc_file, args.output_dir)
\ No newline at end of file
+    main(args.nc_file, args.output_dir, args.date_threshold, args.chunked, args.workers, args.output_format)
\ No newline at end of file
@@ -11,6 +11,13 @@ import math
 import glob
 from datetime import datetime
 import argparse
+import sys
+# Modules shared by the inference and training pipelines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kelp_shared"))
+from stac_cache import cached_catalog
+from region_search import search_region_items, assign_points
+from point_coverage import PointCoverageIndex
+from table_io import TABLE_FORMATS, list_tables, read_table, table_path, write_table
 
 def calculate_bbox(lon, lat, shift_meters=30):
     """
@@ -70,7 +77,7 @@ def get_quarter_range(sdate):
     
     return time_range
 
-def process_point(data_kelp, rowNum, directory):
+def process_point(data_kelp, rowNum, directory, coverage=None, output_format='csv'):
     """
     Process a single point to filter and save relevant kelp biomass data.
 
@@ -78,6 +85,9 @@ def process_point(data_kelp, rowNum, directory):
         data_kelp (DataFrame): DataFrame containing kelp data.
         rowNum (int): Row number of the point to process.
         directory (str): Directory to save the filtered CSV files.
+        coverage (PointCoverageIndex, optional): Index over the rows of data_kelp; used to find the points
+            inside the selected item and to mark them covered instead of scanning the whole frame.
+        output_format (str): 'csv' or 'parquet'.
 
     Returns:
         None
@@ -121,32 +131,77 @@ def process_point(data_kelp, rowNum, directory):
     min_lon, min_lat, max_lon, max_lat = selected_item.bbox
 
     # Filter the kelp data to include only points within the selected bounding box
-    filtered_kelp_data = data_kelp[(data_kelp['latitude'] >= min_lat) &
-                                   (data_kelp['latitude'] <= max_lat) &
-                                   (data_kelp['longitude'] >= min_lon) &
-                                   (data_kelp['longitude'] <= max_lon)].copy()
+    if coverage is not None:
+        rows = coverage.query_bbox(min_lon, min_lat, max_lon, max_lat)
+        filtered_kelp_data = data_kelp.iloc[rows].copy()
+        coverage.mark_covered(rows)
+    else:
+        filtered_kelp_data = data_kelp[(data_kelp['latitude'] >= min_lat) &
+                                       (data_kelp['latitude'] <= max_lat) &
+                                       (data_kelp['longitude'] >= min_lon) &
+                                       (data_kelp['longitude'] <= max_lon)].copy()
 
     print(filtered_kelp_data.shape)
     # Mark the filtered data as processed
     filtered_kelp_data['proccessed_flag'] = 1
     filtered_kelp_data['asset'] = selected_item.id
 
-    # Construct the file path for the CSV file
-    file_path = f"{directory}/{selected_item.id}.csv"
+    # Construct the file path for the CSV or Parquet file
+    file_path = table_path(f"{directory}/{selected_item.id}", output_format)
 
-    # Save the filtered data to a CSV file
-    filtered_kelp_data.to_csv(file_path, index=False)
+    # Save the filtered data
+    write_table(filtered_kelp_data, file_path)
 
     # Update the processed flag in the original dataset
     data_kelp.loc[filtered_kelp_data.index, 'proccessed_flag'] = 1
 
-def main(nc_segmented_data_dir='kelp_nc_segmented_data', kelp_tiles_dir='kelp_tiles_segmented_data'):
+def process_points_batched(data_kelp, directory, region_degrees=5.0, output_format='csv'):
+    """
+    Assign all points to Sentinel-2 items with one STAC search per region and save the same per-asset
+    CSV files as process_point.
+
+    Args:
+        data_kelp (DataFrame): DataFrame containing kelp data.
+        directory (str): Directory to save the filtered CSV files.
+        region_degrees (float): Side of the search regions in degrees.
+        output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+        None
+    """
+    # Define the time range for the search
+    time_range = get_quarter_range(data_kelp.iloc[0]['time'])
+
+    lons = data_kelp['longitude'].to_numpy()
+    lats = data_kelp['latitude'].to_numpy()
+    items = search_region_items(catalog, lons, lats, time_range, region_degrees)
+    print(f"Q {data_kelp.iloc[0]['quarter']} {data_kelp.iloc[0]['year']} candidate items: {len(items)}")
+
+    for selected_item, rows in assign_points(lons, lats, items):
+        if selected_item is None:
+            print(f"No features found for point at row {rows[0]}.")
+            data_kelp.iloc[rows, data_kelp.columns.get_loc('proccessed_flag')] = 1
+            continue
+
+        filtered_kelp_data = data_kelp.iloc[rows].copy()
+        print(filtered_kelp_data.shape)
+
+        filtered_kelp_data['proccessed_flag'] = 1
+        filtered_kelp_data['asset'] = selected_item.id
+
+        write_table(filtered_kelp_data, table_path(f"{directory}/{selected_item.id}", output_format))
+        data_kelp.iloc[rows, data_kelp.columns.get_loc('proccessed_flag')] = 1
+
+def main(nc_segmented_data_dir='kelp_nc_segmented_data', kelp_tiles_dir='kelp_tiles_segmented_data', batched_search=False, region_degrees=5.0, output_format='csv'):
     """
     Main function to process kelp data and save filtered results to CSV files.
 
     Args:
         nc_segmented_data_dir (str): Directory containing the segmented NetCDF data as CSV files.
         kelp_tiles_dir (str): Directory to save the filtered kelp data tiles.
+        batched_search (bool): Search once per region and assign points with a spatial index instead of searching per point.
+        region_degrees (float): Side of the search regions in degrees when batched_search is set.
+        output_format (str): Format of the saved tiles tables, 'csv' or 'parquet'.
 
     Returns:
         None
@@ -154,12 +209,12 @@ def main(nc_segmented_data_dir='kelp_nc_segmented_data', kelp_tiles_dir='kelp_ti
     # Create the output directory if it doesn't exist
     os.makedirs(kelp_tiles_dir, exist_ok=True)
 
-    # Get the list of all CSV files in the directory
-    csv_files = glob.glob(os.path.join(nc_segmented_data_dir, '*.csv'))
+    # Get the list of all CSV and Parquet files in the directory
+    csv_files = list_tables(nc_segmented_data_dir)
 
     for c in csv_files:
         # Load the data
-        data_kelp = pd.read_csv(c)
+        data_kelp = read_table(c)
         data_kelp['proccessed_flag'] = 0
         data_kelp['ID'] = range(1, len(data_kelp) + 1)
 
@@ -167,18 +222,26 @@ def main(nc_segmented_data_dir='kelp_nc_segmented_data', kelp_tiles_dir='kelp_ti
         csv_dir = f"{kelp_tiles_dir}/{csv_dir}" 
         os.makedirs(csv_dir, exist_ok=True)
 
+        if batched_search:
+            process_points_batched(data_kelp, csv_dir, region_degrees, output_format)
+            print(f"{csv_dir} All points processed.")
+            continue
+
+        # Track the uncovered points incrementally instead of rescanning the frame for every tile
+        coverage = PointCoverageIndex(data_kelp['longitude'], data_kelp['latitude'])
+
         # Iterate until all points are processed
         while True:
-            # Find indices of unprocessed rows
-            unprocessed_indices = data_kelp[data_kelp['proccessed_flag'] == 0].index
+            # Find the first unprocessed row
+            rowNum = coverage.next_uncovered()
             # Break the loop if all points are processed
-            if len(unprocessed_indices) == 0:
+            if rowNum is None:
                 break
             # Process the first unprocessed point
-            rowNum = unprocessed_indices[0]
-            process_point(data_kelp, rowNum, csv_dir)
+            process_point(data_kelp, rowNum, csv_dir, coverage, output_format)
             # Update the processed flag for the current point
             data_kelp.loc[rowNum, 'proccessed_flag'] = 1
+            coverage.mark_covered([rowNum])
 
         print(f"{csv_dir} All points processed.")
 
@@ -186,6 +249,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process kelp data and save filtered results to CSV files.')
     parser.add_argument('--nc_segmented_data_dir', type=str, default='kelp_nc_segmented_data', help='Directory containing the segmented NetCDF data as CSV files.')
     parser.add_argument('--kelp_tiles_dir', type=str, default='kelp_tiles_segmented_data', help='Directory to save the filtered kelp data tiles.')
+    parser.add_argument('--stac_cache_dir', type=str, default=None, help='Directory of an on-disk cache of STAC search results, reused across runs.')
+    parser.add_argument('--stac_cache_ttl_hours', type=float, default=168, help='Age in hours after which cached STAC searches are refreshed; 0 keeps them forever.')
+    parser.add_argument('--batched_search', action='store_true', help='Search once per region and assign points to items with a spatial index instead of one search per point.')
+    parser.add_argument('--region_degrees', type=float, default=5.0, help='Side of the search regions in degrees in batched mode.')
+    parser.add_argument('--output_format', type=str, choices=TABLE_FORMATS, default='csv', help='Format of the saved tiles tables.')
     args = parser.parse_args()
 
     # Open the STAC catalog
@@ -194,5 +262,6 @@ if __name__ == "__main__":
         "https://planetarycomputer.microsoft.com/api/stac/v1",
         modifier=planetary_computer.sign_inplace,
     )
+    catalog = cached_catalog(catalog, args.stac_cache_dir, args.stac_cache_ttl_hours)
 
-    main(args.nc_segmented_data_dir, args.kelp_tiles_dir)
+    main(args.nc_segmented_data_dir, args.kelp_tiles_dir, args.batched_search, args.region_degrees, args.output_format)
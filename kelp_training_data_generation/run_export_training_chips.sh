@@ -0,0 +1,85 @@
+#!/bin/bash
+
+# Default parameters
+output_dir="training_chips"
+tiles_dir=()
+bucket="kelpwatch2"
+bucket_folder="training/full-tiles"
+chips_folder=()
+chip_size=256
+chip_stride=""
+negative_fraction=0.1
+chips_per_shard=64
+compress=""
+
+# Parse command-line arguments
+while [[ $# -gt 0 ]]; do
+  case $1 in
+    --output-dir)
+      output_dir="$2"
+      shift
+      shift
+      ;;
+    --tiles-dir)
+      tiles_dir+=(--tiles_dir "$2")
+      shift
+      shift
+      ;;
+    --bucket)
+      bucket="$2"
+      shift
+      shift
+      ;;
+    --bucket-folder)
+      bucket_folder="$2"
+      shift
+      shift
+      ;;
+    --chips-folder)
+      chips_folder+=(--chips_folder "$2")
+      shift
+      shift
+      ;;
+    --chip-size)
+      chip_size="$2"
+      shift
+      shift
+      ;;
+    --chip-stride)
+      chip_stride="--chip_stride $2"
+      shift
+      shift
+      ;;
+    --negative-fraction)
+      negative_fraction="$2"
+      shift
+      shift
+      ;;
+    --chips-per-shard)
+      chips_per_shard="$2"
+      shift
+      shift
+      ;;
+    --compress)
+      compress="--compress"
+      shift
+      ;;
+    *)
+      echo "Unknown option: $1"
+      exit 1
+      ;;
+  esac
+done
+
+# Run the Python script
+python3 export_training_chips.py \
+  --output_dir "$output_dir" \
+  --bucket "$bucket" \
+  --bucket_folder "$bucket_folder" \
+  --chip_size "$chip_size" \
+  --negative_fraction "$negative_fraction" \
+  --chips_per_shard "$chips_per_shard" \
+  "${tiles_dir[@]}" \
+  "${chips_folder[@]}" \
+  $chip_stride \
+  $compress
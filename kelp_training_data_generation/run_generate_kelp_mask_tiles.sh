@@ -4,6 +4,15 @@
 kelp_tiles_directory="kelp_tiles_segmented_data"
 bucket="kelpwatch2"
 bucket_folder="training/full-tiles"
+fetch_workers=1
+crop_to_stations=""
+crop_margin_meters=1000
+# Optional flags, kept in an array so that paths with spaces stay one argument
+extra=()
+stac_cache=()
+asset_cache=()
+warp_cache=()
+zarr_output=""
 
 # Parse command-line arguments
 while [[ $# -gt 0 ]]; do
@@ -23,6 +32,70 @@ while [[ $# -gt 0 ]]; do
       shift
       shift
       ;;
+    --fetch_workers)
+      fetch_workers="$2"
+      shift
+      shift
+      ;;
+    --crop_to_stations)
+      crop_to_stations="--crop_to_stations"
+      shift
+      ;;
+    --crop_margin_meters)
+      crop_margin_meters="$2"
+      shift
+      shift
+      ;;
+    --manifest)
+      extra+=(--manifest "$2")
+      shift
+      shift
+      ;;
+    --stac_cache_dir)
+      stac_cache+=(--stac_cache_dir "$2")
+      shift
+      shift
+      ;;
+    --stac_cache_ttl_hours)
+      stac_cache+=(--stac_cache_ttl_hours "$2")
+      shift
+      shift
+      ;;
+    --asset_cache_dir)
+      asset_cache+=(--asset_cache_dir "$2")
+      shift
+      shift
+      ;;
+    --asset_cache_max_gb)
+      asset_cache+=(--asset_cache_max_gb "$2")
+      shift
+      shift
+      ;;
+    --warp_cache_dir)
+      warp_cache+=(--warp_cache_dir "$2")
+      shift
+      shift
+      ;;
+    --warp_plan_mb)
+      warp_cache+=(--warp_plan_mb "$2")
+      shift
+      shift
+      ;;
+    --output_format)
+      zarr_output="$zarr_output --output_format $2"
+      shift
+      shift
+      ;;
+    --zarr_chunk_size)
+      zarr_output="$zarr_output --zarr_chunk_size $2"
+      shift
+      shift
+      ;;
+    --zarr_compressor)
+      zarr_output="$zarr_output --zarr_compressor $2"
+      shift
+      shift
+      ;;
     *)
       echo "Unknown option: $1"
       exit 1
@@ -34,4 +107,12 @@ done
 python3 generate_kelp_mask_tiles.py \
   --kelp_tiles_directory "$kelp_tiles_directory" \
   --bucket "$bucket" \
-  --bucket_folder "$bucket_folder"
+  --bucket_folder "$bucket_folder" \
+  --fetch_workers "$fetch_workers" \
+  --crop_margin_meters "$crop_margin_meters" \
+  $crop_to_stations \
+  "${stac_cache[@]}" \
+  "${asset_cache[@]}" \
+  "${warp_cache[@]}" \
+  $zarr_output \
+  "${extra[@]}"
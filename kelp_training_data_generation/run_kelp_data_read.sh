@@ -3,6 +3,10 @@
 # Default parameters
 nc_file="LandsatKelpBiomass_2024_Q1_withmetadata.nc"
 output_dir="kelp_nc_segmented_data"
+date_threshold="2018-01-01"
+chunked=""
+workers=1
+output_format="csv"
 
 # Parse command-line arguments
 while [[ $# -gt 0 ]]; do
@@ -17,6 +21,25 @@ while [[ $# -gt 0 ]]; do
       shift
       shift
       ;;
+    --date-threshold)
+      date_threshold="$2"
+      shift
+      shift
+      ;;
+    --chunked)
+      chunked="--chunked"
+      shift
+      ;;
+    --output-format)
+      output_format="$2"
+      shift
+      shift
+      ;;
+    --workers)
+      workers="$2"
+      shift
+      shift
+      ;;
     *)
       echo "Unknown option: $1"
       exit 1
@@ -32,4 +55,8 @@ fi
 # Run the Python script
 python3 kelp_data_read.py \
   --nc_file "$nc_file" \
-  --output_dir "$output_dir"
+  --output_dir "$output_dir" \
+  --date_threshold "$date_threshold" \
+  --workers "$workers" \
+  --output_format "$output_format" \
+  $chunked
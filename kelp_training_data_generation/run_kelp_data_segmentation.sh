@@ -3,6 +3,9 @@
 # Default parameters
 nc_segmented_data_dir="kelp_nc_segmented_data"
 kelp_tiles_dir="kelp_tiles_segmented_data"
+stac_cache=()
+batched=""
+output_format="csv"
 
 # Parse command-line arguments
 while [[ $# -gt 0 ]]; do
@@ -17,6 +20,30 @@ while [[ $# -gt 0 ]]; do
       shift
       shift
       ;;
+    --stac-cache-dir)
+      stac_cache+=(--stac_cache_dir "$2")
+      shift
+      shift
+      ;;
+    --stac-cache-ttl-hours)
+      stac_cache+=(--stac_cache_ttl_hours "$2")
+      shift
+      shift
+      ;;
+    --output-format)
+      output_format="$2"
+      shift
+      shift
+      ;;
+    --batched-search)
+      batched="$batched --batched_search"
+      shift
+      ;;
+    --region-degrees)
+      batched="$batched --region_degrees $2"
+      shift
+      shift
+      ;;
     *)
       echo "Unknown option: $1"
       exit 1
@@ -27,4 +54,7 @@ done
 # Run the Python script
 python3 kelp_data_segmentation.py \
   --nc_segmented_data_dir "$nc_segmented_data_dir" \
-  --kelp_tiles_dir "$kelp_tiles_dir"
+  --kelp_tiles_dir "$kelp_tiles_dir" \
+  --output_format "$output_format" \
+  "${stac_cache[@]}" \
+  $batched